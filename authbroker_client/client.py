@@ -1,13 +1,27 @@
+import base64
+import hashlib
+import json
+import time
 from urllib.parse import urljoin
 
+import requests
+from cryptography.fernet import Fernet, InvalidToken
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
 from django.urls import reverse
 from django.shortcuts import redirect
 from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
 
-from requests_oauthlib import OAuth2Session
+from core.health import http_probe
+from core.http import get_session, mount_adapter
+from core.metrics import timed
 
 
 TOKEN_SESSION_KEY = '_authbroker_token'
+TOKEN_CHECKED_SESSION_KEY = '_authbroker_token_checked'
+PROFILE_SESSION_KEY = '_authbroker_profile'
 PROFILE_URL = urljoin(settings.AUTHBROKER_URL, '/api/v1/user/me/')
 INTROSPECT_URL = urljoin(settings.AUTHBROKER_URL, 'o/introspect/')
 TOKEN_URL = urljoin(settings.AUTHBROKER_URL, '/o/token/')
@@ -16,17 +30,54 @@ TOKEN_CHECK_PERIOD_SECONDS = 60
 SCOPE = 'read write'
 
 
+def get_fernet():
+    key = settings.TOKEN_ENCRYPTION_KEY or base64.urlsafe_b64encode(
+        hashlib.sha256(f'authbroker-token:{settings.SECRET_KEY}'.encode()).digest())
+
+    return Fernet(key)
+
+
+def get_token(request):
+    """Return the session's authbroker token, which is stored encrypted as the session may be held in a cookie."""
+
+    encrypted = request.session.get(TOKEN_SESSION_KEY, None)
+
+    if not encrypted:
+        return None
+
+    try:
+        return json.loads(get_fernet().decrypt(encrypted.encode()).decode())
+    except (InvalidToken, AttributeError, ValueError):
+        # stored unencrypted or with another key; the user signs in again
+        return None
+
+
+def encrypt_token(token):
+    return get_fernet().encrypt(json.dumps(dict(token)).encode()).decode()
+
+
+def save_token(request, token):
+    request.session[TOKEN_SESSION_KEY] = encrypt_token(token)
+
+
+def token_digest(token):
+    return hashlib.sha256(token.get('access_token', '').encode()).hexdigest()
+
+
 def get_client(request, **kwargs):
+    # imported on first use; most requests are served from the token and profile cached in the session
+    from requests_oauthlib import OAuth2Session
+
     token_saver = get_token_saver(request)
 
-    token = request.session.get(TOKEN_SESSION_KEY, None)
+    token = get_token(request)
 
     refresh_args = {
         'client_id': settings.AUTHBROKER_CLIENT_ID,
         'client_secret': settings.AUTHBROKER_CLIENT_SECRET,
     }
 
-    return OAuth2Session(
+    client = OAuth2Session(
         settings.AUTHBROKER_CLIENT_ID,
         redirect_uri=request.build_absolute_uri(reverse('authbroker_callback')),
         scope=SCOPE,
@@ -36,20 +87,60 @@ def get_client(request, **kwargs):
         token_updater=token_saver,
         **kwargs)
 
+    return mount_adapter(client, 'authbroker')
+
+
+def token_expired(token):
+    return 'expires_at' in token and token['expires_at'] <= time.time()
+
 
 def has_valid_token(request):
-    """Does the session have a valid token?"""
+    """Does the session have a valid token?
+
+    A positive answer is remembered in the session for TOKEN_CHECK_PERIOD_SECONDS, or until the token expires."""
+
+    token = get_token(request)
+
+    if not token:
+        return False
+
+    checked = request.session.get(TOKEN_CHECKED_SESSION_KEY, 0)
+
+    if time.time() - checked < TOKEN_CHECK_PERIOD_SECONDS and not token_expired(token):
+        return True
+
+    valid = get_client(request).authorized
 
-    return get_client(request).authorized
+    if valid:
+        request.session[TOKEN_CHECKED_SESSION_KEY] = time.time()
+
+    return valid
 
 
 def get_profile(request):
-    profile = get_client(request).get(PROFILE_URL)
+    """Return the user's profile, fetching it from the authbroker once per access token."""
+
+    token = get_token(request) or {}
+    cached = request.session.get(PROFILE_SESSION_KEY, None)
+
+    if cached and cached.get('token') == token_digest(token) and not token_expired(token):
+        return cached['profile']
+
+    with timed('profile'):
+        profile = get_client(request).get(PROFILE_URL)
 
     if profile.status_code != 200:
         raise Exception('Failed to get user profile - status: {}'.format(profile.status_code))
 
-    return profile.json()
+    # the client may have refreshed the token while fetching the profile
+    token = get_token(request) or {}
+
+    request.session[PROFILE_SESSION_KEY] = {
+        'token': token_digest(token),
+        'profile': profile.json(),
+    }
+
+    return request.session[PROFILE_SESSION_KEY]['profile']
 
 
 def authbroker_login_required(func):
@@ -57,16 +148,109 @@ def authbroker_login_required(func):
     This is different to the @login_required decorator in that it only checks for a valid authbroker Oauth2 token,
     not an authenticated django user."""
 
-    def decorated(request):
+    def decorated(request, *args, **kwargs):
         if not has_valid_token(request):
             return redirect('authbroker_login')
 
-        return func(request)
+        return func(request, *args, **kwargs)
+    return decorated
+
+
+def get_bearer_token(request):
+    scheme, _, access_token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+
+    return access_token.strip() if scheme.lower() == 'bearer' and access_token.strip() else None
+
+
+def introspect(access_token):
+    """Return whether `access_token` is an active authbroker access token, and the username it belongs to.
+
+    The answer is cached for TOKEN_CHECK_PERIOD_SECONDS, or until the token expires."""
+
+    key = 'authbroker-introspection:' + hashlib.sha256(access_token.encode()).hexdigest()
+    introspection = cache.get(key)
+
+    if introspection is not None:
+        return introspection
+
+    with timed('introspect'):
+        response = get_session('authbroker').post(
+            INTROSPECT_URL,
+            data={'token': access_token},
+            auth=(settings.AUTHBROKER_CLIENT_ID, settings.AUTHBROKER_CLIENT_SECRET),
+        )
+
+    data = response.json() if response.status_code == 200 else {}
+    introspection = {'active': data.get('active') is True, 'username': data.get('username')}
+    timeout = TOKEN_CHECK_PERIOD_SECONDS
+
+    if introspection['active'] and 'exp' in data:
+        timeout = min(timeout, int(data['exp'] - time.time()))
+
+    if timeout > 0:
+        cache.set(key, introspection, timeout)
+
+    return introspection
+
+
+def introspect_token(access_token):
+    """Is `access_token` an active authbroker access token?"""
+
+    return introspect(access_token)['active']
+
+
+def get_caller(request):
+    """Identify the user making an API request authenticated by `authbroker_token_required`: the username its
+    access token belongs to, or the email address of its session's user."""
+
+    access_token = get_bearer_token(request)
+
+    if access_token is None:
+        return get_profile(request)['email']
+
+    # fall back to the token itself, should the authbroker not say whose it is
+    return introspect(access_token)['username'] or 'token:' + hashlib.sha256(access_token.encode()).hexdigest()
+
+
+def authbroker_token_required(func):
+    """Like `authbroker_login_required`, for API views: a request may instead carry an authbroker access token in an
+    `Authorization: Bearer` header, and is answered with a 401 rather than redirected to sign in.
+
+    The view is exempt from the CSRF middleware so that token-authenticated clients don't need a CSRF token;
+    requests authenticated by their session are still checked."""
+
+    @csrf_exempt
+    def decorated(request, *args, **kwargs):
+        access_token = get_bearer_token(request)
+
+        try:
+            if access_token is not None:
+                authenticated = introspect_token(access_token)
+            else:
+                authenticated = has_valid_token(request)
+        except requests.RequestException:
+            return JsonResponse({'error': 'Unable to check your credentials, try again later'}, status=503)
+
+        if not authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+
+        if access_token is None:
+            rejected = CsrfViewMiddleware().process_view(request, None, (), {})
+            if rejected is not None:
+                return rejected
+
+        return func(request, *args, **kwargs)
     return decorated
 
 
 def get_token_saver(request):
     def token_saver(token):
-        request.session[TOKEN_SESSION_KEY] = token
+        save_token(request, token)
+        request.session[TOKEN_CHECKED_SESSION_KEY] = time.time()
 
     return token_saver
+
+
+def probe():
+    """Readiness probe: is the authbroker answering?"""
+    http_probe('authbroker', settings.AUTHBROKER_URL)
@@ -0,0 +1,73 @@
+import time
+
+from unittest.mock import patch, Mock
+from django.core.cache import cache
+from django.test import TestCase
+
+from .client import (
+    TOKEN_SESSION_KEY, get_caller, get_profile, get_token, has_valid_token, introspect_token, save_token)
+
+
+class ClientTestCase(TestCase):
+    def setUp(self):
+        self.request = Mock(session={})
+        save_token(self.request, {'access_token': 'abc', 'expires_at': time.time() + 3600})
+
+    @patch('authbroker_client.client.get_client')
+    def test_token_check_is_cached(self, mock_get_client):
+        mock_get_client.return_value.authorized = True
+
+        self.assertTrue(has_valid_token(self.request))
+        self.assertTrue(has_valid_token(self.request))
+
+        self.assertEqual(mock_get_client.call_count, 1)
+
+    def test_no_token(self):
+        self.request.session = {}
+
+        self.assertFalse(has_valid_token(self.request))
+
+    @patch('authbroker_client.client.get_client')
+    def test_profile_is_cached_per_access_token(self, mock_get_client):
+        mock_get_client.return_value.get.return_value = Mock(status_code=200, json=lambda: {'email': 'a@b.com'})
+
+        self.assertEqual(get_profile(self.request), {'email': 'a@b.com'})
+        self.assertEqual(get_profile(self.request), {'email': 'a@b.com'})
+        self.assertEqual(mock_get_client.call_count, 1)
+
+        save_token(self.request, {'access_token': 'def'})
+
+        get_profile(self.request)
+        self.assertEqual(mock_get_client.call_count, 2)
+
+    def test_token_is_encrypted(self):
+        self.assertNotIn('abc', self.request.session[TOKEN_SESSION_KEY])
+        self.assertEqual(get_token(self.request)['access_token'], 'abc')
+
+    def test_unreadable_token(self):
+        self.request.session[TOKEN_SESSION_KEY] = {'access_token': 'abc'}
+
+        self.assertIsNone(get_token(self.request))
+        self.assertFalse(has_valid_token(self.request))
+
+    @patch('authbroker_client.client.get_session')
+    def test_introspection_is_cached(self, mock_get_session):
+        cache.clear()
+        mock_get_session.return_value.post.return_value = Mock(
+            status_code=200, json=lambda: {'active': True, 'exp': time.time() + 3600})
+
+        self.assertTrue(introspect_token('abc'))
+        self.assertTrue(introspect_token('abc'))
+        self.assertEqual(mock_get_session.return_value.post.call_count, 1)
+
+        mock_get_session.return_value.post.return_value = Mock(status_code=401)
+
+        self.assertFalse(introspect_token('def'))
+
+    @patch('authbroker_client.client.get_session')
+    def test_caller_is_token_username(self, mock_get_session):
+        cache.clear()
+        mock_get_session.return_value.post.return_value = Mock(
+            status_code=200, json=lambda: {'active': True, 'username': 'test@test.com'})
+
+        self.assertEqual(get_caller(Mock(META={'HTTP_AUTHORIZATION': 'Bearer abc'})), 'test@test.com')
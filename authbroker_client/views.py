@@ -3,8 +3,7 @@ from django.shortcuts import redirect
 from django.http import HttpResponseBadRequest, HttpResponseServerError
 from django.conf import settings
 
-from raven.contrib.django.raven_compat.models import client
-from .client import get_client, AUTHORISATION_URL, TOKEN_URL, TOKEN_SESSION_KEY
+from .client import get_client, save_token, AUTHORISATION_URL, TOKEN_URL, TOKEN_SESSION_KEY
 
 
 class AuthView(RedirectView):
@@ -38,7 +37,7 @@ class AuthCallbackView(View):
                 client_secret=settings.AUTHBROKER_CLIENT_SECRET,
                 code=auth_code)
 
-            self.request.session[TOKEN_SESSION_KEY] = dict(token)
+            save_token(self.request, token)
 
             del self.request.session[TOKEN_SESSION_KEY + '_oauth_state']
 
@@ -48,6 +47,8 @@ class AuthCallbackView(View):
         # an exception. However, looking at the fetch_code method, I'm not entirely sure what exceptions it
         # would raise in this instance.
         except BaseException:
+            from raven.contrib.django.raven_compat.models import client
+
             client.captureException()
             return redirect('authbroker_login')
 
@@ -0,0 +1 @@
+default_app_config = 'change_request_form.apps.ChangeRequestFormConfig'
@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import TicketSubmission
+
+
+@admin.register(TicketSubmission)
+class TicketSubmissionAdmin(admin.ModelAdmin):
+    list_display = ('reference', 'status', 'attempts', 'ticket_id', 'next_attempt_at', 'created_at')
+    list_filter = ('status',)
+    readonly_fields = ('reference', 'created_at', 'updated_at')
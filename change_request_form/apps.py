@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ChangeRequestFormConfig(AppConfig):
     name = 'change_request_form'
+
+    def ready(self):
+        # registers the duplicate submission cache check
+        from . import idempotency  # noqa: F401
@@ -0,0 +1,83 @@
+"""Ticket backends.
+
+Each submission is sent to the backends listed for its platform in TICKET_BACKENDS_BY_PLATFORM, all at once. The
+first backend listed is the primary: its ticket is the submission's reference, and the submission fails (and is
+queued or retried) if the primary fails. The ticket each backend creates is recorded with the queued submission, so
+when some backends fail, the ticket queue worker retries those backends only, and none gets a duplicate ticket.
+
+The backends themselves are configured in TICKET_BACKENDS, each with the dotted path of a function that takes a
+submission's cleaned data and attachment paths and returns the new ticket's id, and the URL of a ticket. A backend
+is named after its upstream in HTTP_UPSTREAMS, whose circuit breaker decides whether to queue the submission.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from core.metrics import with_request_timings
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_backends(platform):
+    return settings.TICKET_BACKENDS_BY_PLATFORM.get(platform) or settings.TICKET_BACKENDS_BY_PLATFORM['default']
+
+
+def primary_backend(platform):
+    return get_backends(platform)[0]
+
+
+def ticket_url(backend, ticket_id):
+    return settings.TICKET_BACKENDS[backend]['URL'].format(ticket_id)
+
+
+def get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TICKET_BACKEND_CONCURRENCY, thread_name_prefix='ticket-backend')
+
+        return _executor
+
+
+def create_tickets(data, attachment_paths, backends=None):
+    """Send a submission to `backends`, by default all of its platform's backends, concurrently.
+
+    Returns the ids of the tickets created, by backend, and the exception raised by each backend that failed.
+    """
+
+    backends = get_backends(data['platform']) if backends is None else backends
+
+    futures = [
+        (backend, get_executor().submit(
+            with_request_timings(import_string(settings.TICKET_BACKENDS[backend]['CREATE'])), data, attachment_paths))
+        for backend in backends
+    ]
+
+    wait([future for _, future in futures])
+
+    tickets, errors = {}, {}
+
+    for backend, future in futures:
+        try:
+            tickets[backend] = future.result()
+        except Exception as e:
+            logger.warning('Failed to create a %s ticket', backend, exc_info=True)
+            errors[backend] = e
+
+    return tickets, errors
+
+
+def format_notification(tickets):
+    """Format the Slack notification for a submission's tickets, by backend."""
+
+    return 'new content request: {}'.format(
+        ', '.join(ticket_url(backend, ticket_id) for backend, ticket_id in tickets.items()))
@@ -0,0 +1,289 @@
+"""Benchmark form submissions against local stand-ins for the upstream services.
+
+`StubService` runs a small HTTP server that answers like Zendesk, the AV service, the authbroker or Slack, after a
+configurable delay and with a configurable rate of 500 errors. `run_scenario` drives GETs and POSTs of the change
+request form, served by `start_app_server`, from several threads and collects their latencies. See the
+`benchmark_submissions` management command.
+"""
+import itertools
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from importlib import import_module
+from socketserver import ThreadingMixIn
+
+import requests
+from django.conf import settings
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.wsgi import get_wsgi_application
+
+from authbroker_client.client import TOKEN_SESSION_KEY, encrypt_token
+
+
+FORM_DATA = {
+    'name': 'Benchmark',
+    'department': 'Benchmarking',
+    'email': 'benchmark@example.com',
+    'platform': 'gov.uk',
+    'request_type': 'New page(s)',
+    'request_summary': 'A benchmark submission',
+    'user_need': 'To measure submission latency',
+    'approver': 'Nobody',
+}
+
+CSRF_TOKEN_PATTERN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+PROFILE = {'email': 'benchmark@example.com', 'first_name': 'Bench', 'last_name': 'Mark'}
+
+_ticket_ids = itertools.count(1)
+
+
+def zendesk_response(method, path):
+    if path.startswith('/api/v2/uploads'):
+        return 201, {'upload': {'token': uuid.uuid4().hex, 'attachments': []}}
+
+    if path.startswith('/api/v2/tickets'):
+        ticket_id = next(_ticket_ids)
+        return 201, {'ticket': {'id': ticket_id}, 'audit': {'id': ticket_id, 'ticket_id': ticket_id, 'events': []}}
+
+    if path.startswith('/api/v2/users/me'):
+        return 200, {'user': {'id': 1}}
+
+    return 404, {'error': 'Not found'}
+
+
+def av_response(method, path):
+    return 200, {'malware': False, 'reason': None}
+
+
+def authbroker_response(method, path):
+    if path.startswith('/o/token/'):
+        return 200, {'access_token': uuid.uuid4().hex, 'refresh_token': uuid.uuid4().hex, 'token_type': 'Bearer',
+                     'expires_in': 3600, 'scope': 'read write'}
+
+    if path.startswith('/o/introspect/'):
+        return 200, {'active': True, 'username': PROFILE['email'], 'exp': int(time.time()) + 3600}
+
+    if path.startswith('/api/v1/user/me/'):
+        return 200, PROFILE
+
+    return 404, {'error': 'Not found'}
+
+
+def slack_response(method, path):
+    return 200, 'ok'
+
+
+UPSTREAM_RESPONSES = {
+    'authbroker': authbroker_response,
+    'av': av_response,
+    'slack': slack_response,
+    'zendesk': zendesk_response,
+}
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    # keep connections alive, as the app's connection pools do
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                # the chunk and the line break after it
+                self.rfile.read(size + 2)
+                if not size:
+                    return
+
+        remaining = int(self.headers.get('Content-Length') or 0)
+
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+
+    def respond(self):
+        self.read_body()
+        status, payload = self.server.stub.handle(self.command, self.path)
+
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), 'text/plain'
+        else:
+            body, content_type = DjangoJSONEncoder().encode(payload).encode(), 'application/json'
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = respond
+
+
+class StubService:
+    """A local stand-in for an upstream service that answers each request after about `latency` seconds, failing
+    a proportion `error_rate` of them with a 500."""
+
+    def __init__(self, name, latency=0, error_rate=0):
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.responses = UPSTREAM_RESPONSES[name]
+        self.server = None
+
+    def handle(self, method, path):
+        if self.latency:
+            time.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+        if random.random() < self.error_rate:
+            return 500, {'error': 'Injected error'}
+
+        return self.responses(method, path)
+
+    def start(self):
+        self.server = StubServer(('127.0.0.1', 0), StubRequestHandler)
+        self.server.stub = self
+        threading.Thread(target=self.server.serve_forever, name=f'stub-{self.name}', daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/'
+
+
+def percentile(timings, p):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+
+class ScenarioResult:
+    def __init__(self, name):
+        self.name = name
+        self.timings = {'GET': [], 'POST': []}
+        self.errors = {'GET': 0, 'POST': 0}
+        self.duration = 0
+        self._lock = threading.Lock()
+
+    def record(self, method, duration, ok):
+        with self._lock:
+            self.timings[method].append(duration)
+            if not ok:
+                self.errors[method] += 1
+
+    def summary(self, method):
+        timings = self.timings[method]
+
+        return {
+            'requests': len(timings),
+            'errors': self.errors[method],
+            'p50': percentile(timings, 0.5),
+            'p95': percentile(timings, 0.95),
+            'p99': percentile(timings, 0.99),
+            'rate': len(timings) / self.duration,
+        }
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_app_server():
+    """Serve the app from a thread, returning the server; ALLOWED_HOSTS must include 127.0.0.1."""
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler)
+    server.set_app(get_wsgi_application())
+    threading.Thread(target=server.serve_forever, name='benchmark-app', daemon=True).start()
+
+    return server
+
+
+def new_client():
+    """Return a session for a signed-in user. The token is checked locally and the profile is fetched from the
+    authbroker stand-in."""
+
+    store = import_module(settings.SESSION_ENGINE).SessionStore()
+    store[TOKEN_SESSION_KEY] = encrypt_token({'access_token': uuid.uuid4().hex, 'token_type': 'Bearer',
+                                              'expires_at': time.time() + 24 * 60 * 60})
+    store.save()
+
+    client = requests.Session()
+    client.cookies[settings.SESSION_COOKIE_NAME] = store.session_key
+
+    return client
+
+
+def timed_request(result, method, request, expected_status):
+    start = time.perf_counter()
+
+    try:
+        response = request()
+        ok = response.status_code == expected_status
+    except requests.RequestException:
+        response, ok = None, False
+
+    result.record(method, time.perf_counter() - start, ok)
+
+    return response
+
+
+def submit(client, url, result, number, attachment_size):
+    response = timed_request(result, 'GET', lambda: client.get(url), 200)
+    csrf_token = response and CSRF_TOKEN_PATTERN.search(response.text)
+
+    # each submission differs, so none is treated as a repeat of another
+    data = dict(FORM_DATA, title_of_request=f'{result.name} {number}', idempotency_key=uuid.uuid4().hex,
+                csrfmiddlewaretoken=csrf_token.group(1) if csrf_token else '')
+    files = None
+
+    if attachment_size:
+        # random content, so the AV verdict cache doesn't skip the scan
+        files = {'attachment': ('attachment.zip', os.urandom(attachment_size), 'application/zip')}
+
+    timed_request(result, 'POST', lambda: client.post(url, data=data, files=files, allow_redirects=False), 302)
+
+
+def run_scenario(url, name, submissions, concurrency, attachment_size=0):
+    """Make `submissions` GETs and POSTs of the form at `url`, `concurrency` at a time, each client making its GETs
+    and POSTs in turn, as a user would."""
+
+    result = ScenarioResult(name)
+    numbers = iter(range(submissions))
+    numbers_lock = threading.Lock()
+
+    def worker():
+        client = new_client()
+
+        while True:
+            with numbers_lock:
+                number = next(numbers, None)
+
+            if number is None:
+                return
+
+            submit(client, url, result, number, attachment_size)
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+
+    result.duration = time.perf_counter() - start
+
+    return result
@@ -0,0 +1,198 @@
+"""Bulk submissions.
+
+`BulkSubmissionView` accepts a batch of requests either as JSON, a list of objects keyed by `ChangeRequestForm` field
+name (optionally wrapped as `{"requests": [...]}`), or as CSV with a header row of field names. Publication dates
+are given as `publication_date` in YYYY-MM-DD form. Attachments aren't supported, and nor are platforms whose
+requests go to ticket backends other than Zendesk alone (see TICKET_BACKENDS_BY_PLATFORM).
+
+Every row is validated with `ChangeRequestForm`, and nothing is submitted unless all of them are valid, so a
+rejected batch can be corrected and sent again without duplicating tickets. The tickets are then created with
+Zendesk's batch create, ZENDESK_BATCH_SIZE at a time, each batch becoming one Zendesk job, and a single Slack
+message summarises the lot.
+
+A batch sent with an `Idempotency-Key` header has its results kept for BULK_SUBMISSION_TTL_SECONDS, per caller: sending
+it again with the same key only submits the rows that weren't submitted before, e.g. after a Zendesk failure, and a
+different batch with the same key is rejected. Each Zendesk job can only be looked up by the caller that created it.
+"""
+import csv
+import hashlib
+import io
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .backends import get_backends
+from .forms import ChangeRequestForm, slack_notify
+from .idempotency import SubmissionConflict, SubmissionInProgress
+from .zendesk import create_ticket_batch
+
+
+logger = logging.getLogger(__name__)
+
+
+class BulkSubmissionError(ValueError):
+    pass
+
+
+def parse_rows(content_type, body):
+    """Return the rows of a bulk submission as dicts of field name to value."""
+
+    if content_type == 'text/csv':
+        try:
+            rows = list(csv.DictReader(io.StringIO(body.decode('utf-8-sig'))))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise BulkSubmissionError(f'Invalid CSV: {e}')
+
+    elif content_type == 'application/json':
+        try:
+            rows = json.loads(body)
+        except ValueError as e:
+            raise BulkSubmissionError(f'Invalid JSON: {e}')
+
+        if isinstance(rows, dict):
+            rows = rows.get('requests')
+
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise BulkSubmissionError('Provide a list of requests')
+
+    else:
+        raise BulkSubmissionError('Send the requests as application/json or text/csv')
+
+    if not rows:
+        raise BulkSubmissionError('There are no requests')
+
+    if len(rows) > settings.BULK_SUBMISSION_MAX_ROWS:
+        raise BulkSubmissionError(f'Send at most {settings.BULK_SUBMISSION_MAX_ROWS} requests at a time')
+
+    return rows
+
+
+def form_data(row):
+    """Convert a row to the data the form would be posted."""
+
+    # CSV rows with more values than headings have them under None
+    data = {
+        field: '' if value is None else value
+        for field, value in row.items() if field is not None and not field.startswith('attachment')
+    }
+
+    date = str(data.pop('publication_date', '') or '')
+
+    if date:
+        parts = date.split('-')
+        year, month, day = parts if len(parts) == 3 else (date, '', '')
+
+        data.update(publication_date_0=day, publication_date_1=month, publication_date_2=year)
+
+    return data
+
+
+def validate_rows(rows):
+    """Return a bound form for each row, and each row's validation errors by field."""
+
+    forms, errors = [], []
+
+    for row in rows:
+        form = ChangeRequestForm(data=form_data(row))
+
+        # tickets are created with Zendesk's batch create, so rows for platforms with other backends are rejected
+        # rather than silently missing those backends' tickets
+        if form.is_valid() and get_backends(form.cleaned_data['platform']) != ['zendesk']:
+            backends = ', '.join(get_backends(form.cleaned_data['platform']))
+            form.add_error('platform', f'Requests for this platform go to {backends}; submit them with the form')
+
+        forms.append(form)
+        errors.append(
+            {} if form.is_valid() else {field: list(messages) for field, messages in form.errors.items()})
+
+    return forms, errors
+
+
+def submit_rows(forms, results=None):
+    """Create a ticket for each of the valid forms, in batches of ZENDESK_BATCH_SIZE.
+
+    Returns the new Zendesk job ids, and for each row the job creating its ticket and its index within that job. If a
+    batch fails, it and the batches after it aren't submitted and their rows have an `error` instead. Given the
+    `results` of an earlier attempt at the same rows, only the rows it didn't submit are sent.
+    """
+
+    job_ids = []
+    results = results or [{'index': index} for index in range(len(forms))]
+    pending = [result for result in results if 'job_id' not in result]
+    batch_size = settings.ZENDESK_BATCH_SIZE
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+
+        try:
+            job_id = create_ticket_batch([forms[result['index']].cleaned_data for result in batch])
+        except Exception:
+            logger.exception('Failed to submit requests %d to %d', batch[0]['index'], pending[-1]['index'])
+
+            for result in pending[start:]:
+                result['error'] = 'Not submitted'
+            break
+
+        job_ids.append(job_id)
+
+        for job_index, result in enumerate(batch):
+            result.pop('error', None)
+            result.update(job_id=job_id, job_index=job_index)
+
+    if job_ids:
+        submitted = sum(1 for result in pending if 'job_id' in result)
+        message = f'{submitted} new content requests submitted in bulk, Zendesk job(s): {", ".join(job_ids)}'
+
+        if not slack_notify(message):
+            logger.error('Slack message not sent: %s', message)
+
+    return job_ids, results
+
+
+def get_cache():
+    return caches[settings.SUBMISSION_DEDUP_CACHE]
+
+
+def caller_key(prefix, caller, name):
+    return f'{prefix}:{hashlib.sha256(caller.encode()).hexdigest()}:{name}'
+
+
+def claim_batch(caller, idempotency_key, body):
+    """Lock the caller's batch with `idempotency_key` and return the results of earlier attempts at it, if any.
+
+    Raises SubmissionInProgress if the batch is being submitted by another request, and SubmissionConflict if the key
+    was used for a different batch."""
+
+    key = caller_key('bulk', caller, idempotency_key)
+
+    if not get_cache().add(key + ':lock', True, settings.BULK_SUBMISSION_TTL_SECONDS):
+        raise SubmissionInProgress()
+
+    recorded = get_cache().get(key)
+
+    if recorded is not None and recorded['fingerprint'] != hashlib.sha256(body).hexdigest():
+        release_batch(caller, idempotency_key)
+        raise SubmissionConflict()
+
+    return recorded and recorded['results']
+
+
+def record_batch(caller, idempotency_key, body, results):
+    get_cache().set(
+        caller_key('bulk', caller, idempotency_key),
+        {'fingerprint': hashlib.sha256(body).hexdigest(), 'results': results},
+        settings.BULK_SUBMISSION_TTL_SECONDS)
+
+
+def release_batch(caller, idempotency_key):
+    get_cache().delete(caller_key('bulk', caller, idempotency_key) + ':lock')
+
+
+def record_jobs(caller, job_ids):
+    get_cache().set_many({'bulk-job:' + job_id: caller for job_id in job_ids}, settings.BULK_SUBMISSION_TTL_SECONDS)
+
+
+def is_job_owner(caller, job_id):
+    return get_cache().get('bulk-job:' + job_id) == caller
@@ -1,32 +1,202 @@
+import hashlib
 import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from django import forms
 from django.conf import settings
 
-import requests
+from core.circuit_breaker import CircuitOpenError
+from core.health import http_probe
+from core.http import RequestAbandoned, get_session
+from core.metrics import timed, with_request_timings
+from .uploads import UploadError
+from .verdict_cache import get_verdict_cache, is_known_clean, mark_clean
 
 
 logger = logging.getLogger('av-file-check')
 
+_scan_executor = None
+_scan_executor_lock = threading.Lock()
+
+
+def get_scan_executor():
+    global _scan_executor
+
+    with _scan_executor_lock:
+        if _scan_executor is None:
+            _scan_executor = ThreadPoolExecutor(max_workers=settings.AV_SCAN_CONCURRENCY, thread_name_prefix='av-scan')
+
+        return _scan_executor
+
+
+class ScanCancelled(RequestAbandoned):
+    pass
+
+
+def cancel_scan(scan):
+    """Cancel an AV scan whose verdict is no longer needed.
+
+    A scan started by `AVFileField.start_scan` that is already running stops reading its file at the next chunk, so
+    it doesn't outlive the request's uploads; scans of uploads as they arrive read from the upload, not the file."""
+
+    scan.cancel()
+
+    stop_reading = getattr(scan, 'stop_reading', None)
+
+    if stop_reading is not None:
+        stop_reading.set()
+
+
+class HashingReader:
+    """Wraps an uploaded file so that its SHA-256 is computed as it is streamed to the AV service.
+
+    Once `stop_reading` is set, reading raises ScanCancelled, abandoning the scan."""
+
+    def __init__(self, fp, size, stop_reading=None):
+        self.fp = fp
+        self.size = size
+        self.hash = hashlib.sha256()
+        self.stop_reading = stop_reading
+
+    @property
+    def len(self):
+        # read by MultipartEncoder to work out the Content-Length without loading the file
+        return self.size - self.fp.tell()
+
+    def read(self, size=-1):
+        if self.stop_reading is not None and self.stop_reading.is_set():
+            raise ScanCancelled()
+
+        chunk = self.fp.read(size)
+        self.hash.update(chunk)
+        return chunk
+
+
+def probe():
+    """Readiness probe: is the AV service answering?"""
+    http_probe('av', settings.AV_URL, auth=(settings.AV_USERNAME, settings.AV_PASSWORD))
+
+
+def av_unavailable_error():
+    return forms.ValidationError('Attachments cannot be checked for viruses at the moment. Please try again later, '
+                                 'or submit your request without the attachment.')
+
+
+def check_verdict(response, sha256):
+    """Raise a ValidationError if the AV service found malware, otherwise remember that the file is clean."""
+
+    if response['malware'] and 'Encrypted' in response['reason']:
+        logger.info('Encrypted file {} detected'.format(response['reason']))
+        raise forms.ValidationError('You cannot upload encrypted files.')
+
+    elif response['malware']:
+        logger.info('Malware {} detected'.format(response['reason']))
+        raise forms.ValidationError('File appears to contain Malware.')
+
+    mark_clean(sha256)
+
+
+def scan_stream(name, chunks):
+    """Stream a file to the AV service as its chunks become available, returning the verdict.
+
+    The file's length isn't known up front, so the multipart body is sent with chunked transfer encoding."""
+
+    boundary = uuid.uuid4().hex
+    filename = name.replace('"', '%22')
+
+    def body():
+        yield (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+               f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        yield from chunks
+        yield f'\r\n--{boundary}--\r\n'.encode()
+
+    with timed('av_scan'):
+        raw_response = get_session('av').post(
+            settings.AV_URL, auth=(settings.AV_USERNAME, settings.AV_PASSWORD), data=body(),
+            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+    return raw_response.json()
+
+
+def validate_stream(name, chunks, sha256):
+    """Validate a file from its chunks as `scan_stream` sends them; `sha256` is the file's hash, complete once the
+    last chunk has been sent."""
+
+    try:
+        response = scan_stream(name, chunks)
+    except CircuitOpenError:
+        raise av_unavailable_error()
+
+    # the upload stopped part way, so the verdict is only for part of the file and mustn't pass it
+    if getattr(chunks, 'abandoned', False):
+        raise forms.ValidationError('The attachment could not be checked for viruses. Please upload it again.')
+
+    check_verdict(response, sha256.hexdigest())
+
 
 class AVFileField(forms.FileField):
-    def clean(self, data, initial=None):
-        data = super().clean(data, initial=initial)
+    def scan(self, data, stop_reading=None):
+        """Stream `data` to the AV service, setting its `sha256` attribute on the way, and return the verdict.
+
+        Raises ScanCancelled if `stop_reading` is set before `data` has been read."""
+
+        from requests_toolbelt import MultipartEncoder
 
-        if data:
-            auth = (settings.AV_USERNAME, settings.AV_PASSWORD)
+        auth = (settings.AV_USERNAME, settings.AV_PASSWORD)
 
-            raw_response = requests.post(settings.AV_URL, auth=auth, files={"file": data})
-            response = raw_response.json()
+        data.seek(0)
+        reader = HashingReader(data, data.size, stop_reading)
+        encoder = MultipartEncoder(fields={'file': (data.name, reader)})
 
-            data.seek(0)
+        with timed('av_scan'):
+            raw_response = get_session('av').post(
+                settings.AV_URL, auth=auth, data=encoder, headers={'Content-Type': encoder.content_type})
 
-            if response['malware'] and 'Encrypted' in response['reason']:
-                logger.info('Encrypted file {} detected'.format(response['reason']))
-                raise forms.ValidationError('You cannot upload encrypted files.')
+        data.sha256 = reader.hash.hexdigest()
+        data.seek(0)
+
+        return raw_response.json()
+
+    def validate_file(self, data, stop_reading=None):
+        """Raise a ValidationError unless `data` is known to be clean or the AV service finds it clean.
+
+        The verdict cache is only consulted for files whose SHA-256 was computed as they were uploaded; any other file
+        is scanned straight away, its hash computed as it is read for the scan, rather than read once more to hash
+        it."""
+
+        if get_verdict_cache() is not None and getattr(data, 'sha256', None) and is_known_clean(data.sha256):
+            return
+
+        try:
+            response = self.scan(data, stop_reading)
+        except CircuitOpenError:
+            raise av_unavailable_error()
+
+        check_verdict(response, data.sha256)
+
+    def start_scan(self, data):
+        """Validate `data` in the background; the form that owns this field must join the scan with `data.av_scan`, or
+        cancel it with `cancel_scan`."""
+
+        stop_reading = threading.Event()
+
+        data.av_scan = get_scan_executor().submit(with_request_timings(self.validate_file), data, stop_reading)
+        data.av_scan.stop_reading = stop_reading
+
+        return data.av_scan
+
+    def to_python(self, data):
+        if isinstance(data, UploadError):
+            raise forms.ValidationError(f'The attachment could not be uploaded: {data}. Please upload it again.')
+
+        return super().to_python(data)
+
+    def clean(self, data, initial=None):
+        data = super().clean(data, initial=initial)
 
-            elif response['malware']:
-                logger.info('Malware {} detected'.format(response['reason']))
-                raise forms.ValidationError('File appears to contain Malware.')
+        if data and not hasattr(data, 'av_scan'):
+            self.validate_file(data)
 
         return data
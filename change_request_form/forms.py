@@ -1,28 +1,34 @@
-import json
 import datetime as dt
+import functools
 
 from django import forms
 from django.conf import settings
-from zenpy import Zenpy
-from zenpy.lib.api_objects import Ticket, CustomField, Comment, User
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 
 from govuk_forms.forms import GOVUKForm
 from govuk_forms import widgets, fields
-import requests
 
-from .fields import AVFileField
+from core.circuit_breaker import CircuitOpenError
+from .backends import create_tickets
+from .fields import AVFileField, cancel_scan
+from .slack import get_slack_dispatcher, post_slack_message
+from .uploads import ChunkedUploadWidget
+from .zendesk import format_ticket_text
 
 
 def slack_notify(message):
-    slack_message = json.dumps(
-        {
-            'text': message,
-            'username': 'contentbot',
-            'mrkdwn': True
-        }
-    ).encode()
+    """Send `message` to Slack, returning False if Slack can't take it at the moment, for the caller to keep."""
 
-    requests.post(settings.SLACK_URL, data=slack_message)
+    if settings.SLACK_DIGEST_WINDOW_SECONDS:
+        return get_slack_dispatcher().notify(message)
+
+    try:
+        post_slack_message(message)
+    except CircuitOpenError:
+        return False
+
+    return True
 
 
 PLATFORM_CHOICES = (
@@ -40,13 +46,6 @@ REQUEST_TYPE_CHOICES = (
     ('Other', 'Other'),
 )
 
-SERVICE_FIELD_MAPPING = {
-    'gov.uk': 'GOV.UK',
-    'great.gov.uk': 'Great',
-    'digital_workspace': 'Digital Workspace',
-    'None': 'None',
-}
-
 
 class ChangeRequestForm(GOVUKForm):
     name = forms.CharField(
@@ -113,7 +112,7 @@ class ChangeRequestForm(GOVUKForm):
         label='Upload an attachment if required',
         help_text='For multiple files, please upload a .zip file',
         max_length=255,
-        widget=widgets.ClearableFileInput(),
+        widget=ChunkedUploadWidget(),
         required=False
     )
 
@@ -148,6 +147,61 @@ class ChangeRequestForm(GOVUKForm):
         required=False
     )
 
+    def __init__(self, *args, rejected_uploads=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # attachments that AttachmentUploadHandler refused, by field name
+        self.rejected_uploads = rejected_uploads or {}
+
+    def full_clean(self):
+        scans = self.start_av_scans()
+
+        super().full_clean()
+
+        if self.is_bound:
+            for name, error in self.rejected_uploads.items():
+                self.add_error(name, error)
+
+        self.join_av_scans(scans)
+
+    def start_av_scans(self):
+        """Collect the scans that started while uploads were received and, with AV_SCAN_CONCURRENTLY, start
+        scanning the other uploads before the other fields are validated."""
+
+        scans = {}
+
+        if not self.is_bound:
+            return scans
+
+        for name, field in self.fields.items():
+            if not isinstance(field, AVFileField):
+                continue
+
+            upload = field.widget.value_from_datadict(self.data, self.files, self.add_prefix(name))
+
+            if not upload or not hasattr(upload, 'read'):
+                continue
+
+            if hasattr(upload, 'av_scan'):
+                scans[name] = upload.av_scan
+            elif settings.AV_SCAN_CONCURRENTLY:
+                scans[name] = field.start_scan(upload)
+
+        return scans
+
+    def join_av_scans(self, scans):
+        """Wait for the scans to finish, unless the form is already invalid and the verdicts don't matter."""
+
+        for name, scan in scans.items():
+            if self._errors or name not in self.cleaned_data:
+                cancel_scan(scan)
+                continue
+
+            try:
+                scan.result()
+            except forms.ValidationError as e:
+                self.add_error(name, e)
+
     def clean_due_date(self):
         date = self.cleaned_data['due_date']
         if date and date < dt.date.today():
@@ -157,61 +211,59 @@ class ChangeRequestForm(GOVUKForm):
     def clean(self):
         cleaned_data = super().clean()
 
-        if 'Update' in cleaned_data['request_type'] and not cleaned_data['update_url']:
+        if 'Update' in cleaned_data.get('request_type', '') and not cleaned_data.get('update_url'):
             raise forms.ValidationError('Provide an update url')
 
+    def close_uploads(self, delete=False):
+        """Close the chunked uploads opened for the form, deleting them if it has been submitted."""
+
+        for field in self.fields.values():
+            if isinstance(field.widget, ChunkedUploadWidget):
+                field.widget.close_uploads(delete)
+
     def formatted_text(self):
-        return  """Name: {name}<br>
-                Department: {department}<br>
-                Email: {email}<br>
-                Telephone: {telephone}<br>
-                Title of request: {title_of_request}<br>
-                platform: {platform}<br>
-                request type: {request_type}<br>
-                Update urls: {update_url}<br>
-                Request summary: {request_summary}<br>
-                User need: {user_need}<br>
-                Approver: {approver}<br>
-                Publication date: {publication_date}<br>
-                Publication date not required?: {publication_date_not_required}<br>
-                publication date reason: {publication_date_explanation}""".format(**self.cleaned_data)
-
-    def create_zendesk_ticket(self):
-
-        zenpy_client = Zenpy(
-            subdomain=settings.ZENDESK_SUBDOMAIN,
-            email=settings.ZENDESK_EMAIL,
-            token=settings.ZENDESK_TOKEN,
-        )
-
-        attachments = [value for field, value in self.cleaned_data.items() if field.startswith('attachment') and value]
-
-        if attachments:
-            uploads = []
-            for attachment in attachments:
-                upload_instance = zenpy_client.attachments.upload(attachment.temporary_file_path())
-                uploads.append(upload_instance.token)
-        else:
-            uploads = None
-
-        service = SERVICE_FIELD_MAPPING[self.cleaned_data['platform']]
-
-        custom_fields = [
-            CustomField(id=30041969, value=service),                                                # service
-            CustomField(id=360000180437, value=self.cleaned_data['department']),                    # directorate
-            CustomField(id=45522485, value=self.cleaned_data['email']),                             # email
-            CustomField(id=360000188178, value=self.cleaned_data['telephone']),                     # Phone number
-            CustomField(id=360000182638, value=self.cleaned_data['request_type']),                  # Content request
-            CustomField(id=360000180477, value=self.cleaned_data['publication_date_explanation']),  # reason
-            CustomField(id=360000180457, value=str(self.cleaned_data['publication_date']))          # due date
-        ]
-
-        ticket = zenpy_client.tickets.create(Ticket(
-            subject=self.cleaned_data['title_of_request'],
-            custom_fields=custom_fields,
-            tags=['content_delivery', self.cleaned_data['platform']],
-            comment=Comment(html_body=self.formatted_text(), uploads=uploads),
-            requester=User(name=self.cleaned_data['name'], email=self.cleaned_data['email'])
-        )).ticket
-
-        return ticket.id
+        return format_ticket_text(self.cleaned_data)
+
+    def attachments(self):
+        return [value for field, value in self.cleaned_data.items() if field.startswith('attachment') and value]
+
+    def add_upload_errors(self, paths):
+        """Report the attachments at `paths` that couldn't be uploaded to a ticket backend."""
+
+        for field, value in list(self.cleaned_data.items()):
+            if field.startswith('attachment') and value and value.temporary_file_path() in paths:
+                self.add_error(field, 'The file could not be attached to your request, please submit it again')
+
+    def create_tickets(self):
+        """Send the request to its platform's ticket backends; see `backends.create_tickets`."""
+
+        attachment_paths = [attachment.temporary_file_path() for attachment in self.attachments()]
+
+        return create_tickets(self.cleaned_data, attachment_paths)
+
+
+# the fields that ChangeRequestFormView prefills for each user
+PREFILLED_FIELDS = ('name', 'email')
+
+
+def placeholder(field):
+    return f'__prefilled_{field}__'
+
+
+@functools.lru_cache(maxsize=2)
+def render_unbound_form(day):
+    """Render the form with placeholders for the prefilled values. `day` is part of the cache key as the
+    publication date's year choices depend on it."""
+
+    return str(ChangeRequestForm(initial={field: placeholder(field) for field in PREFILLED_FIELDS}))
+
+
+def render_cached(form):
+    """Render an unbound form from the cached copy, substituting its prefilled values."""
+
+    html = render_unbound_form(dt.date.today())
+
+    for field in PREFILLED_FIELDS:
+        html = html.replace(placeholder(field), escape(form.initial.get(field, '')))
+
+    return mark_safe(html)
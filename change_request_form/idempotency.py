@@ -0,0 +1,148 @@
+"""Detect repeated submissions of the same change request.
+
+A double click, a refresh or a resubmission of the same form must not raise a second ticket. Each submission is
+identified by the idempotency key rendered into the form and by a fingerprint of its cleaned data, both scoped to the
+user's session; both are mapped to the submission's fingerprint and ticket id (or ticket queue reference) in a cache
+for SUBMISSION_DEDUP_TTL_SECONDS. A repeat that arrives while the original is still being submitted waits up to
+SUBMISSION_DEDUP_WAIT_SECONDS for its result, and a reuse of an idempotency key with different data is rejected as a
+conflict.
+
+Duplicates are only caught across processes if the cache is shared by every process serving the form, so with
+SUBMISSION_DEDUP_ENABLED a local-memory cache is warned about by Django's deployment checks, which gunicorn runs
+before starting its workers, unless DEBUG is on.
+"""
+import hashlib
+import json
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+PENDING = 'pending'
+KEY_PREFIX = 'submission:'
+SESSION_KEY = 'submission_scope'
+# how often a repeat checks whether the original submission has finished
+POLL_INTERVAL = 0.1
+
+# caches that aren't shared between processes
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class SubmissionInProgress(Exception):
+    pass
+
+
+class SubmissionConflict(Exception):
+    """The idempotency key has already been used to submit different data."""
+
+
+class SubmissionKeys(namedtuple('SubmissionKeys', ['fingerprint', 'lock', 'idempotency_key'])):
+    """A submission's fingerprint and cache keys; `lock`, the fingerprint's key, is used to lock it."""
+
+    @property
+    def all(self):
+        return [self.lock] + ([self.idempotency_key] if self.idempotency_key else [])
+
+
+def get_cache():
+    return caches[settings.SUBMISSION_DEDUP_CACHE]
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_dedup_cache(app_configs, **kwargs):
+    if not settings.SUBMISSION_DEDUP_ENABLED or settings.DEBUG:
+        return []
+
+    if settings.CACHES[settings.SUBMISSION_DEDUP_CACHE]['BACKEND'] not in LOCAL_CACHE_BACKENDS:
+        return []
+
+    return [checks.Warning(
+        'SUBMISSION_DEDUP_CACHE is local to each process, so repeated submissions are only caught by the process '
+        'that received the original',
+        hint='Set CACHE_URL to a shared cache, or turn off SUBMISSION_DEDUP_ENABLED',
+        id='change_request_form.W001',
+    )]
+
+
+def session_scope(session):
+    """Return the random id of the user's session that their submission keys are scoped to."""
+
+    if SESSION_KEY not in session:
+        session[SESSION_KEY] = uuid.uuid4().hex
+
+    return session[SESSION_KEY]
+
+
+def fingerprint(form):
+    data = {}
+
+    for field, value in form.cleaned_data.items():
+        if hasattr(value, 'read'):
+            value = getattr(value, 'sha256', None) or [value.name, value.size]
+        data[field] = value
+
+    serialised = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+
+    return hashlib.sha256(serialised.encode()).hexdigest()
+
+
+def submission_keys(idempotency_key, form, scope):
+    """Return the `SubmissionKeys` for a submission in the session with the `scope` id."""
+
+    digest = fingerprint(form)
+    prefix = f'{KEY_PREFIX}{scope}:'
+
+    return SubmissionKeys(
+        digest, prefix + 'fingerprint:' + digest, idempotency_key and prefix + 'key:' + idempotency_key)
+
+
+def claim_submission(keys):
+    """Return the ticket id of an earlier identical submission, or None if this one should go ahead.
+
+    Raises SubmissionInProgress if an identical submission hasn't finished within SUBMISSION_DEDUP_WAIT_SECONDS, and
+    SubmissionConflict if the idempotency key belongs to a submission of different data."""
+
+    cache = get_cache()
+    deadline = time.monotonic() + settings.SUBMISSION_DEDUP_WAIT_SECONDS
+    claim = [keys.fingerprint, PENDING]
+    ttl = settings.SUBMISSION_DEDUP_TTL_SECONDS
+
+    while True:
+        for digest, ticket_id in cache.get_many(keys.all).values():
+            if digest != keys.fingerprint:
+                raise SubmissionConflict()
+
+            if ticket_id != PENDING:
+                return ticket_id
+
+        if cache.add(keys.lock, claim, ttl):
+            if not keys.idempotency_key or cache.add(keys.idempotency_key, claim, ttl):
+                return None
+
+            # the idempotency key was claimed by a submission of different data in the meantime
+            cache.delete(keys.lock)
+            continue
+
+        if time.monotonic() >= deadline:
+            raise SubmissionInProgress()
+
+        time.sleep(POLL_INTERVAL)
+
+
+def record_submission(keys, ticket_id):
+    get_cache().set_many(
+        {key: [keys.fingerprint, str(ticket_id)] for key in keys.all}, settings.SUBMISSION_DEDUP_TTL_SECONDS)
+
+
+def release_submission(keys):
+    """Let an identical submission be retried after this one failed."""
+
+    get_cache().delete_many(keys.all)
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+
+from core.http import get_session, mount_adapter
+from core.metrics import timed, with_request_timings
+from .zendesk import format_ticket_text
+
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+_watcher_executor = None
+_watcher_executor_lock = threading.Lock()
+
+
+def get_jira_client():
+    """Return the process-wide Jira client, built on the process-wide jira connection pool.
+
+    The client is built once, as building one fetches the server's details; it holds no per-call state, so it is
+    shared between threads. Its own retries are turned off: they would retry the POST that creates an issue, and
+    so could create duplicates, and wait up to a minute between attempts. The jira upstream's retry policy applies
+    instead."""
+
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            # jira is imported on first use, as it's slow to import and not needed to serve the form
+            from jira import JIRA
+
+            _client = JIRA(
+                settings.JIRA_URL,
+                basic_auth=(settings.JIRA_USERNAME, settings.JIRA_PASSWORD),
+                get_server_info=False,
+                max_retries=0,
+            )
+            mount_adapter(_client._session, 'jira')
+
+        return _client
+
+
+def get_watcher_executor():
+    global _watcher_executor
+
+    with _watcher_executor_lock:
+        if _watcher_executor is None:
+            _watcher_executor = ThreadPoolExecutor(
+                max_workers=settings.JIRA_WATCHER_CONCURRENCY, thread_name_prefix='jira-watchers')
+
+        return _watcher_executor
+
+
+def project_id(platform):
+    return settings.JIRA_WORKSPACE_PROJECT_ID if platform == 'digital_workspace' else settings.JIRA_CONTENT_PROJECT_ID
+
+
+def format_issue_text(data):
+    return '\n'.join(line.strip() for line in format_ticket_text(data).replace('<br>', '').splitlines())
+
+
+def add_attachments(issue_key, paths):
+    """Attach the files to an issue with a single request; Jira accepts several files per call."""
+
+    with ExitStack() as stack:
+        files = [('file', (os.path.basename(path), stack.enter_context(open(path, 'rb')))) for path in paths]
+
+        response = get_session('jira').post(
+            f'{settings.JIRA_URL.rstrip("/")}/rest/api/2/issue/{issue_key}/attachments',
+            files=files,
+            auth=(settings.JIRA_USERNAME, settings.JIRA_PASSWORD),
+            headers={'X-Atlassian-Token': 'no-check'},
+        )
+
+    response.raise_for_status()
+
+
+def add_watchers(issue_key, watchers):
+    """Add the watchers to an issue concurrently, at most JIRA_WATCHER_CONCURRENCY at a time; Jira's API adds one
+    watcher per call. Returns the watchers that couldn't be added."""
+
+    client = get_jira_client()
+    futures = [
+        (watcher, get_watcher_executor().submit(with_request_timings(client.add_watcher), issue_key, watcher))
+        for watcher in watchers
+    ]
+    failed = []
+
+    for watcher, future in futures:
+        try:
+            future.result()
+        except Exception:
+            logger.exception('Failed to add watcher %s to Jira issue %s', watcher, issue_key)
+            failed.append(watcher)
+
+    return failed
+
+
+def create_issue(data, attachment_paths):
+    """Create a Jira issue from a submission's cleaned data, returning its key.
+
+    The issue is kept if its attachments or watchers can't be added; the failures are logged."""
+
+    fields = {
+        'project': {'id': project_id(data['platform'])},
+        'issuetype': {'name': 'Task'},
+        'summary': data['title_of_request'],
+        'description': format_issue_text(data),
+        'customfield_11224': data['department'],
+        'customfield_11225': data['email'],
+        'customfield_11227': data['name'],
+    }
+
+    if data.get('publication_date'):
+        fields['duedate'] = str(data['publication_date'])
+
+    with timed('jira_issue'):
+        issue_key = get_jira_client().create_issue(fields=fields).key
+
+    if attachment_paths:
+        try:
+            with timed('jira_attachments'):
+                add_attachments(issue_key, attachment_paths)
+        except Exception:
+            logger.exception('Failed to attach files to Jira issue %s', issue_key)
+
+    if settings.JIRA_WATCHERS:
+        with timed('jira_watchers'):
+            add_watchers(issue_key, settings.JIRA_WATCHERS)
+
+    return issue_key
@@ -0,0 +1,53 @@
+import statistics
+import time
+from unittest.mock import patch
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+from change_request_form.forms import render_unbound_form
+from change_request_form.views import ChangeRequestFormView
+
+
+PROFILE = {'email': 'benchmark@example.com', 'first_name': 'Bench', 'last_name': 'Mark'}
+
+
+class Command(BaseCommand):
+    help = 'Measure how long the change request form page takes to render, with and without the form fragment cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Number of GET requests per mode')
+
+    def handle(self, *args, **options):
+        view = ChangeRequestFormView.as_view()
+        factory = RequestFactory()
+
+        # the authbroker isn't called, so only rendering is measured
+        with patch('authbroker_client.client.has_valid_token', return_value=True), \
+                patch('change_request_form.views.get_profile', return_value=PROFILE):
+
+            for cached in (False, True):
+                render_unbound_form.cache_clear()
+
+                with override_settings(FORM_FRAGMENT_CACHE=cached, ALLOWED_HOSTS=['testserver']):
+                    timings = []
+
+                    for _ in range(options['requests']):
+                        request = factory.get('/')
+                        request.session = {}
+
+                        start = time.perf_counter()
+                        view(request).render()
+                        timings.append((time.perf_counter() - start) * 1000)
+
+                self.report('fragment cache' if cached else 'no fragment cache', timings)
+
+    def report(self, mode, timings):
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+        self.stdout.write(
+            f'{mode}: mean {statistics.mean(timings):.2f}ms, p50 {percentile(0.5):.2f}ms, '
+            f'p95 {percentile(0.95):.2f}ms, p99 {percentile(0.99):.2f}ms over {len(timings)} requests')
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from change_request_form.benchmark import UPSTREAM_RESPONSES, StubService, run_scenario, start_app_server
+from change_request_form.slack import get_slack_dispatcher
+from core.http import route_upstream
+
+
+DEFAULT_LATENCY = {'authbroker': 0.05, 'av': 0.1, 'slack': 0.05, 'zendesk': 0.2}
+
+
+def upstream_values(values, value_type):
+    """Parse `upstream=value` options."""
+
+    parsed = {}
+
+    for value in values:
+        upstream, _, number = value.partition('=')
+
+        if upstream not in UPSTREAM_RESPONSES:
+            raise CommandError(f'Unknown upstream {upstream}; choose from {", ".join(sorted(UPSTREAM_RESPONSES))}')
+
+        try:
+            parsed[upstream] = value_type(number)
+        except ValueError:
+            raise CommandError(f'Invalid value {value}')
+
+    return parsed
+
+
+class Command(BaseCommand):
+    help = ('Measure form GET and POST latency and throughput, with and without attachments, against local '
+            'stand-ins for Zendesk, the AV service, the authbroker and Slack')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--submissions', type=int, default=50, help='Submissions per scenario')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--small-size', type=int, default=100 * 1024, help='Small attachment size in bytes')
+        parser.add_argument('--large-size', type=int, default=20 * 1024 * 1024, help='Large zip size in bytes')
+        parser.add_argument('--latency', action='append', default=[], metavar='UPSTREAM=SECONDS',
+                            help='Mean response time of an upstream stand-in (default: {})'.format(
+                                ', '.join(f'{k}={v}' for k, v in sorted(DEFAULT_LATENCY.items()))))
+        parser.add_argument('--error-rate', action='append', default=[], metavar='UPSTREAM=RATE',
+                            help='Proportion of requests an upstream stand-in fails with a 500 (default: 0)')
+
+    def handle(self, *args, **options):
+        latency = dict(DEFAULT_LATENCY, **upstream_values(options['latency'], float))
+        error_rate = upstream_values(options['error_rate'], float)
+
+        stubs = [StubService(name, latency.get(name, 0), error_rate.get(name, 0)) for name in UPSTREAM_RESPONSES]
+
+        for stub in stubs:
+            stub.start()
+            route_upstream(stub.name, stub.url)
+
+        scenarios = (
+            ('no attachment', 0),
+            ('small attachment', options['small_size']),
+            ('large zip', options['large_size']),
+        )
+
+        with override_settings(ALLOWED_HOSTS=['127.0.0.1']):
+            server = start_app_server()
+            url = 'http://{}:{}/'.format(*server.server_address)
+
+            try:
+                for name, attachment_size in scenarios:
+                    result = run_scenario(url, name, options['submissions'], options['concurrency'], attachment_size)
+                    self.report(result)
+            finally:
+                server.shutdown()
+
+                # send any Slack digest while the stand-in is still there
+                if settings.SLACK_DIGEST_WINDOW_SECONDS:
+                    get_slack_dispatcher().flush()
+
+                for stub in stubs:
+                    stub.stop()
+
+    def report(self, result):
+        for method in ('GET', 'POST'):
+            summary = result.summary(method)
+
+            self.stdout.write(
+                '{name:<17} {method:<4} {requests} requests, {errors} errors, p50 {p50:.0f}ms, p95 {p95:.0f}ms, '
+                'p99 {p99:.0f}ms, {rate:.1f} req/s'.format(
+                    name=result.name, method=method, **dict(
+                        summary, p50=summary['p50'] * 1000, p95=summary['p95'] * 1000, p99=summary['p99'] * 1000)))
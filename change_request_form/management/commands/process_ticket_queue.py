@@ -0,0 +1,36 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from change_request_form.outbox import process_due_submissions
+
+
+class Command(BaseCommand):
+    help = 'Send queued change requests to Zendesk and Slack'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the due submissions once and exit')
+
+    def handle(self, *args, **options):
+        self.running = True
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while self.running:
+            processed = process_due_submissions()
+
+            if processed:
+                self.stdout.write(f'Processed {processed} ticket submission(s)')
+
+            if options['once']:
+                break
+
+            if not processed:
+                time.sleep(settings.TICKET_QUEUE_POLL_SECONDS)
+
+    def stop(self, signum, frame):
+        """Finish the submission in progress, then exit."""
+        self.running = False
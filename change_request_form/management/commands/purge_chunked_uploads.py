@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from change_request_form.uploads import purge_expired_uploads
+
+
+class Command(BaseCommand):
+    help = 'Remove chunked uploads that have expired'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Removed {purge_expired_uploads()} expired upload(s)')
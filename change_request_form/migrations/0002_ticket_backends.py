@@ -0,0 +1,23 @@
+# Generated by Django 2.2.13 on 2026-10-16 22:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('change_request_form', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketsubmission',
+            name='tickets',
+            field=models.TextField(default='[]'),
+        ),
+        migrations.AlterField(
+            model_name='ticketsubmission',
+            name='ticket_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -1,3 +1,40 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
+
+
+class TicketSubmission(models.Model):
+    """A validated change request waiting to be sent to Zendesk and Slack by the ticket queue worker."""
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    reference = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    data = models.TextField()
+    attachments = models.TextField(default='[]')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    # the primary backend's ticket id, and (backend, ticket id) for each ticket created
+    ticket_id = models.CharField(max_length=64, null=True, blank=True)
+    tickets = models.TextField(default='[]')
+    notified = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ('next_attempt_at',)
 
-# Create your models here.
+    def __str__(self):
+        return str(self.reference)
@@ -0,0 +1,163 @@
+"""A durable queue of ticket submissions.
+
+`ChangeRequestFormView.form_valid` stores the cleaned form data and a copy of each attachment here so that the
+request can return without waiting on Zendesk and Slack. The `process_ticket_queue` management command drains the
+queue, retrying failed submissions with an exponential backoff.
+"""
+import json
+import logging
+import os
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+
+from .backends import create_tickets, format_notification, get_backends, primary_backend
+from .models import TicketSubmission
+from .slack import post_slack_message
+
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_submission(form, tickets=None, notified=False):
+    """Persist a valid `ChangeRequestForm` to the queue and return the new `TicketSubmission`.
+
+    `tickets` are the tickets already created for it, by backend; the worker creates the rest."""
+
+    data = {field: value for field, value in form.cleaned_data.items() if not field.startswith('attachment')}
+    tickets = tickets or {}
+
+    submission = TicketSubmission(
+        data=json.dumps(data, cls=DjangoJSONEncoder),
+        ticket_id=tickets.get(primary_backend(data['platform'])),
+        tickets=json.dumps(list(tickets.items())),
+        notified=notified,
+    )
+
+    attachment_dir = os.path.join(settings.TICKET_QUEUE_ATTACHMENT_DIR, str(submission.reference))
+    attachment_paths = []
+
+    for attachment in form.attachments():
+        os.makedirs(attachment_dir, exist_ok=True)
+        path = os.path.join(attachment_dir, os.path.basename(attachment.name))
+        shutil.copyfile(attachment.temporary_file_path(), path)
+        attachment_paths.append(path)
+
+    submission.attachments = json.dumps(attachment_paths)
+    submission.save()
+
+    return submission
+
+
+def retry_delay(attempts):
+    """The backoff before the next attempt of a submission that has failed `attempts` times."""
+
+    delay = settings.TICKET_QUEUE_BACKOFF_SECONDS * 2 ** (attempts - 1)
+
+    return timedelta(seconds=min(delay, settings.TICKET_QUEUE_MAX_BACKOFF_SECONDS))
+
+
+def due_submissions():
+    """Pending submissions whose next attempt is due, plus any abandoned mid-flight by a worker that died."""
+
+    now = timezone.now()
+    lease_expired = now - timedelta(seconds=settings.TICKET_QUEUE_LEASE_SECONDS)
+
+    return TicketSubmission.objects.filter(
+        Q(status=TicketSubmission.PENDING, next_attempt_at__lte=now) |
+        Q(status=TicketSubmission.PROCESSING, updated_at__lte=lease_expired))
+
+
+def claim(submission):
+    """Mark a submission as being processed, returning False if another worker got there first."""
+
+    return TicketSubmission.objects.filter(
+        pk=submission.pk, status=submission.status, updated_at=submission.updated_at,
+    ).update(status=TicketSubmission.PROCESSING, updated_at=timezone.now()) == 1
+
+
+def get_tickets(submission):
+    # submissions queued before there were ticket backends only have a Zendesk ticket id
+    if submission.ticket_id is not None and submission.tickets == '[]':
+        return {'zendesk': submission.ticket_id}
+
+    return dict(json.loads(submission.tickets))
+
+
+def process_submission(submission):
+    """Create the missing tickets and send the Slack notification for a claimed submission.
+
+    Progress is saved after each step, and only the backends without a ticket are sent the submission, so a retry
+    never creates a second ticket in any backend. The notification is sent once the primary backend's ticket exists.
+    Slack is posted to directly, rather than through the digest dispatcher, so a submission is only done once Slack
+    has accepted its notification.
+    """
+
+    # a failure, e.g. an attachment failing to upload, leaves the submission's attachments in place for the retry
+    try:
+        data = json.loads(submission.data)
+        tickets = get_tickets(submission)
+        missing = [backend for backend in get_backends(data['platform']) if backend not in tickets]
+        errors = {}
+
+        if missing:
+            created, errors = create_tickets(data, json.loads(submission.attachments), missing)
+
+            if created:
+                tickets.update(created)
+                submission.ticket_id = tickets.get(primary_backend(data['platform']))
+                submission.tickets = json.dumps(list(tickets.items()))
+                submission.save(update_fields=['ticket_id', 'tickets', 'updated_at'])
+
+        if not submission.notified and submission.ticket_id is not None:
+            post_slack_message(format_notification(tickets)).raise_for_status()
+            submission.notified = True
+            submission.save(update_fields=['notified', 'updated_at'])
+
+        if errors:
+            raise next(iter(errors.values()))
+
+    except Exception as exc:
+        submission.attempts += 1
+        submission.last_error = repr(exc)
+
+        if submission.attempts >= settings.TICKET_QUEUE_MAX_ATTEMPTS:
+            logger.exception('Giving up on ticket submission %s after %d attempts',
+                             submission.reference, submission.attempts)
+            submission.status = TicketSubmission.FAILED
+        else:
+            logger.warning('Ticket submission %s failed, attempt %d', submission.reference, submission.attempts,
+                           exc_info=True)
+            submission.status = TicketSubmission.PENDING
+            submission.next_attempt_at = timezone.now() + retry_delay(submission.attempts)
+
+        submission.save()
+        return False
+
+    submission.status = TicketSubmission.DONE
+    submission.last_error = ''
+    submission.save()
+
+    shutil.rmtree(os.path.join(settings.TICKET_QUEUE_ATTACHMENT_DIR, str(submission.reference)), ignore_errors=True)
+
+    return True
+
+
+def process_due_submissions(limit=None):
+    """Process the submissions that are due and return how many were attempted."""
+
+    processed = 0
+
+    for submission in due_submissions()[:limit]:
+        if not claim(submission):
+            continue
+
+        submission.status = TicketSubmission.PROCESSING
+        process_submission(submission)
+        processed += 1
+
+    return processed
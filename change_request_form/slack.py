@@ -0,0 +1,166 @@
+"""Slack notifications.
+
+Messages sent with `SlackDigestDispatcher.notify` are buffered in-process and posted by a background thread as a
+digest every SLACK_DIGEST_WINDOW_SECONDS, at most SLACK_DIGEST_MAX_MESSAGES to a Slack message; once that many are
+waiting they're posted straight away. A digest that Slack rate limits (429) or fails to accept is kept and retried
+with a backoff. While Slack is failing, at most SLACK_DIGEST_MAX_PENDING messages are kept: `notify` refuses any more
+until some have been sent, and the caller keeps them instead (see `change_request_form.forms.slack_notify`).
+
+The buffer is only held in memory: anything still unsent when a gunicorn worker exits, including on a worker timeout,
+is posted one last time and logged if that fails, but a worker that is killed outright loses up to a window's worth.
+Set SLACK_DIGEST_WINDOW_SECONDS to 0 to post each message in the request instead.
+"""
+import atexit
+import json
+import logging
+import threading
+
+import requests
+from django.conf import settings
+
+from core.http import get_session
+from core.metrics import counter, timed
+
+
+logger = logging.getLogger(__name__)
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def post_slack_message(text):
+    slack_message = json.dumps(
+        {
+            'text': text,
+            'username': 'contentbot',
+            'mrkdwn': True
+        }
+    ).encode()
+
+    with timed('slack'):
+        return get_session('slack').post(settings.SLACK_URL, data=slack_message)
+
+
+def format_digest(messages):
+    if len(messages) == 1:
+        return messages[0]
+
+    return '{} new messages:\n{}'.format(len(messages), '\n'.join(messages))
+
+
+class SlackDigestDispatcher:
+    def __init__(self, window, max_backoff, max_messages=20, max_pending=1000):
+        self.window = window
+        self.max_backoff = max_backoff
+        self.max_messages = max_messages
+        self.max_pending = max_pending
+        self._messages = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._failures = 0
+
+    def notify(self, message):
+        """Buffer `message` for the next digest, returning False if too many messages are waiting to take it."""
+
+        with self._lock:
+            if len(self._messages) >= self.max_pending:
+                counter('slack_messages_refused_total', 'Slack messages refused as too many were waiting').inc()
+                return False
+
+            self._messages.append(message)
+
+            # a full digest is posted straight away, unless Slack is being backed off
+            if len(self._messages) >= self.max_messages and not self._failures:
+                self._wake.set()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='slack-digest', daemon=True)
+                self._thread.start()
+
+        return True
+
+    def flush(self):
+        """Post the buffered messages as digests of at most `max_messages`, returning the number of seconds to wait
+        before the next attempt if one failed, else None."""
+
+        while True:
+            with self._lock:
+                messages = self._messages[:self.max_messages]
+                del self._messages[:self.max_messages]
+
+            if not messages:
+                return None
+
+            retry_after = self._post(messages)
+
+            if retry_after is not None:
+                return retry_after
+
+    def _post(self, messages):
+        retry_after = None
+
+        try:
+            response = post_slack_message(format_digest(messages))
+
+            if response.status_code == 429:
+                retry_after = int(response.headers.get('Retry-After', 1))
+            else:
+                response.raise_for_status()
+
+        except (requests.RequestException, ValueError):
+            logger.warning('Failed to send %d Slack message(s)', len(messages), exc_info=True)
+            retry_after = min(2 ** self._failures, self.max_backoff)
+
+        if retry_after is None:
+            self._failures = 0
+            counter('slack_digests_total', 'Slack digest messages sent').inc()
+            return None
+
+        self._failures += 1
+        counter('slack_digest_failures_total', 'Slack digest messages that were retried').inc()
+
+        # put the messages back ahead of any that arrived in the meantime
+        with self._lock:
+            self._messages[:0] = messages
+
+        return retry_after
+
+    def close(self):
+        """Make a last attempt to send anything that is still buffered."""
+
+        if self.flush() is not None:
+            with self._lock:
+                for message in self._messages:
+                    logger.error('Slack message not sent: %s', message)
+
+    def _run(self):
+        delay = self.window
+
+        while True:
+            self._wake.wait(delay)
+            self._wake.clear()
+            delay = self.flush() or self.window
+
+
+def get_slack_dispatcher():
+    global _dispatcher
+
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = SlackDigestDispatcher(
+                settings.SLACK_DIGEST_WINDOW_SECONDS, settings.SLACK_DIGEST_MAX_BACKOFF_SECONDS,
+                settings.SLACK_DIGEST_MAX_MESSAGES, settings.SLACK_DIGEST_MAX_PENDING)
+            atexit.register(_dispatcher.close)
+
+        return _dispatcher
+
+
+def close_slack_dispatcher():
+    """Send anything the process's dispatcher, if it has one, still has buffered."""
+
+    with _dispatcher_lock:
+        dispatcher = _dispatcher
+
+    if dispatcher is not None:
+        dispatcher.close()
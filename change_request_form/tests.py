@@ -1,45 +1,73 @@
 import datetime as dt
+import hashlib
+import io
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import uuid
 
-from unittest.mock import patch, Mock
+from unittest.mock import ANY, patch, Mock
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import SkipFile
 from django.test import TestCase, Client, override_settings
 from django.conf import settings
+from django.core.cache import cache
 
+import requests
 from parameterized import parameterized
 
-from .forms import ChangeRequestForm, REASON_CHOICES
+from .forms import PLATFORM_CHOICES, ChangeRequestForm, render_cached
+from core.circuit_breaker import CircuitOpenError
+from .backends import create_tickets
+from .benchmark import StubService
+from .bulk import BulkSubmissionError, form_data, parse_rows
+from .fields import AVFileField, HashingReader, ScanCancelled
+from .idempotency import (
+    SubmissionConflict, SubmissionInProgress, check_dedup_cache, claim_submission, record_submission,
+    release_submission, submission_keys)
+from .jira import add_watchers, create_issue, get_jira_client, project_id
+from .models import TicketSubmission
+from .outbox import process_submission, retry_delay
+from .slack import SlackDigestDispatcher
+from .ticket_status import get_status, remember_request
+from .upload_handlers import AttachmentUploadHandler
+from .uploads import UploadError, data_path, make_token, open_upload, start_upload, upload_dir
+from .verdict_cache import LocalVerdictCache
+from .zendesk import AttachmentUploadError, create_ticket, upload_attachments, zendesk_client
+
+
+VALID_POST_DATA = {
+    'name': 'Mr Smith',
+    'department': 'test dept',
+    'email': 'test@test.com',
+    'title_of_request': 'a title',
+    'platform': 'gov.uk',
+    'request_type': 'New page(s)',
+    'request_summary': 'a summary',
+    'user_need': 'a user need',
+    'approver': 'an approver',
+}
 
 
 class BaseTestCase(TestCase):
 
     def setUp(self):
-        self.test_post_data = {
-            'name': 'Mr Smith',
-            'department': 'test dept',
-            'email': 'test@test.com',
-            'telephone': '07700 TEST',
-            'action': 'Add new content to Gov.uk',
-            'description': 'a description',
-            'due_date_0': dt.date.today().day,
-            'due_date_1': dt.date.today().month,
-            'due_date_2': dt.date.today().year,
-            'date_explanation': 'ministerial visit',
-            'time_due': 'time due',
-        }
-
-        test_data = self.test_post_data.copy()
-
-        test_data['due_date'] = dt.date.today()
-
-        self.test_formatted_text = (
-            'Name: {name}\n'
-            'Department: {department}\n'
-            'Email: {email}\n'
-            'Telephone: {telephone}\n'
-            'Action: {action}\n'
-            'Description: {description}\n'
-            'Due date: {due_date}\n'
-            'Time due: {time_due}\n'
-            'Due date explanation: {date_explanation}').format(**test_data)
+        next_year = dt.date.today().year + 1
+
+        self.test_post_data = dict(
+            VALID_POST_DATA,
+            telephone='07700 TEST',
+            publication_date_0=1,
+            publication_date_1=7,
+            publication_date_2=next_year,
+            publication_date_explanation='ministerial visit',
+        )
+
+        self.publication_date = dt.date(next_year, 7, 1)
 
 
 class ChangeRequestFormTestCase(BaseTestCase):
@@ -47,69 +75,56 @@ class ChangeRequestFormTestCase(BaseTestCase):
 
         form = ChangeRequestForm(self.test_post_data)
         self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['publication_date'], self.publication_date)
 
-    def test_date_in_future(self):
-        post_data = {
-            'due_date_0': dt.date.today().day - 1,
-            'due_date_1': dt.date.today().month,
-            'due_date_2': dt.date.today().year,
-        }
+    def test_update_requires_url(self):
+        post_data = dict(self.test_post_data, request_type='Update page(s)')
 
         form = ChangeRequestForm(post_data)
 
         self.assertFalse(form.is_valid())
-        self.assertIn('due_date', form.errors)
-        self.assertEqual(form.errors['due_date'], ['The date cannot be in the past'])
+        self.assertEqual(form.non_field_errors(), ['Provide an update url'])
+
+        post_data['update_url'] = 'https://www.gov.uk/a-page'
+
+        self.assertTrue(ChangeRequestForm(post_data).is_valid())
 
     def test_formatted_text(self):
         form = ChangeRequestForm(self.test_post_data)
         form.is_valid()
 
-        self.assertEqual(
-            form.formatted_text(),
-            self.test_formatted_text)
+        text = form.formatted_text()
 
-    def test_due_date_is_optional(self):
-        post_data = {k: v for k, v in self.test_post_data.items() if not k.startswith('due_date')}
+        self.assertIn('Name: Mr Smith<br>', text)
+        self.assertIn('Telephone: 07700 TEST<br>', text)
+        self.assertIn('platform: gov.uk<br>', text)
+        self.assertIn(f'Publication date: {self.publication_date}<br>', text)
+        self.assertIn('publication date reason: ministerial visit', text)
+
+    def test_publication_date_is_optional(self):
+        post_data = {k: v for k, v in self.test_post_data.items() if not k.startswith('publication_date')}
         form = ChangeRequestForm(post_data)
 
         self.assertTrue(form.is_valid())
+        self.assertIsNone(form.cleaned_data['publication_date'])
 
-    def test_no_future_limit_on_date(self):
-        year = dt.date.today().year
+    def test_publication_date_is_limited_to_next_year(self):
         post_data = self.test_post_data.copy()
 
-        post_data['due_date_2'] = year + 1
+        post_data['publication_date_2'] = dt.date.today().year + 2
         form = ChangeRequestForm(post_data)
 
-        self.assertTrue(form.is_valid())
-
-    @parameterized.expand((action_id,) for action_id, _ in REASON_CHOICES)
-    @patch('change_request_form.forms.create_jira_issue')
-    @patch('change_request_form.forms.slack_notify')
-    def test_jira_project_id(self, action_id, mock_slack_notify, mock_create_jira_issue):
-
-        mock_create_jira_issue.return_value = 'FAKE-JIRA-ID'
+        self.assertFalse(form.is_valid())
+        self.assertIn('publication_date', form.errors)
 
+    @parameterized.expand((platform,) for platform, _ in PLATFORM_CHOICES)
+    def test_jira_project_id(self, platform):
         assert settings.JIRA_CONTENT_PROJECT_ID != settings.JIRA_WORKSPACE_PROJECT_ID
 
-        workspace_actions = [
-            'Add new content to Digital Workspace',
-            'Update or remove content on Digital Workspace'
-        ]
-
-        post_data = self.test_post_data.copy()
-        post_data['action'] = action_id
-
-        form = ChangeRequestForm(post_data)
-        self.assertTrue(form.is_valid())
-
-        form.create_jira_issue()
-
-        project_id = settings.JIRA_WORKSPACE_PROJECT_ID if action_id in workspace_actions \
+        project = settings.JIRA_WORKSPACE_PROJECT_ID if platform == 'digital_workspace' \
             else settings.JIRA_CONTENT_PROJECT_ID
 
-        self.assertEquals(mock_create_jira_issue.call_args[0][0], project_id)
+        self.assertEqual(project_id(platform), project)
 
 
 class ChangeRequestFormViewTestCase(BaseTestCase):
@@ -117,6 +132,7 @@ class ChangeRequestFormViewTestCase(BaseTestCase):
         super().setUp()
 
         self.client = Client()
+        cache.clear()
 
     def test_requires_auth(self):
         response = self.client.get('/')
@@ -126,29 +142,1000 @@ class ChangeRequestFormViewTestCase(BaseTestCase):
 
     @patch('change_request_form.views.get_profile')
     @patch('authbroker_client.client.has_valid_token')
-    @patch('change_request_form.forms.create_jira_issue')
-    @patch('change_request_form.forms.slack_notify')
-    @override_settings(JIRA_ISSUE_URL='http://jira_url/?selectedIssue={}')
-    def test_successful_submission(self, mock_slack_notify, mock_create_jira_issue, mock_has_valid_token, mock_get_profile):
+    @patch('change_request_form.forms.ChangeRequestForm.create_tickets')
+    @patch('change_request_form.views.slack_notify')
+    def test_successful_submission(
+            self, mock_slack_notify, mock_create_tickets, mock_has_valid_token, mock_get_profile):
         mock_has_valid_token.return_value = True
-        mock_create_jira_issue.return_value = 'FAKE-JIRA-ID'
+        mock_create_tickets.return_value = ({'zendesk': 123}, {})
 
         response = self.client.post('/', self.test_post_data)
 
         self.assertEqual(response.status_code, 302)
-        self.assertEqual(response.url, '/success/?issue=FAKE-JIRA-ID')
-        self.assertTrue(mock_slack_notify.called)
-        mock_slack_notify.call_args.assert_called_with(
-            'new content request:http://jira_url/?selectedIssue=FAKE-JIRA-ID')
-
-        submitted_date = '{}-{}-{}'.format(
-            str(self.test_post_data['due_date_2']),
-            str(self.test_post_data['due_date_1']).zfill(2),
-            str(self.test_post_data['due_date_0']).zfill(2),
-        )
+        self.assertEqual(response.url, '/success/?issue=123')
+        mock_slack_notify.assert_called_with(f'new content request: {settings.ZENDESK_URL.format(123)}')
+        self.assertEqual(mock_create_tickets.call_count, 1)
+        self.assertEqual(self.client.session['submitted_requests'], ['123'])
+
+    @patch('change_request_form.views.enqueue_submission')
+    @patch('change_request_form.views.get_profile')
+    @patch('authbroker_client.client.has_valid_token')
+    @patch('change_request_form.views.slack_notify')
+    @override_settings(TICKET_QUEUE_ENABLED=True)
+    def test_queued_submission(self, mock_slack_notify, mock_has_valid_token, mock_get_profile,
+                               mock_enqueue_submission):
+        mock_has_valid_token.return_value = True
+        reference = uuid.uuid4()
+        mock_enqueue_submission.return_value = Mock(reference=reference)
+
+        response = self.client.post('/', VALID_POST_DATA)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, f'/success/?issue={reference}')
+        self.assertTrue(mock_enqueue_submission.called)
+        self.assertFalse(mock_slack_notify.called)
+
+    @patch('change_request_form.views.enqueue_submission')
+    @patch('change_request_form.views.get_breaker')
+    @patch('change_request_form.views.get_profile')
+    @patch('authbroker_client.client.has_valid_token')
+    @patch('change_request_form.forms.ChangeRequestForm.create_tickets')
+    def test_submission_fails_while_zendesk_is_unavailable(
+            self, mock_create_tickets, mock_has_valid_token, mock_get_profile, mock_get_breaker,
+            mock_enqueue_submission):
+        mock_has_valid_token.return_value = True
+        mock_get_breaker.return_value.is_open = True
+
+        response = self.client.post('/', VALID_POST_DATA)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(mock_create_tickets.called)
+        self.assertFalse(mock_enqueue_submission.called)
+
+    @patch('change_request_form.views.get_profile')
+    @patch('authbroker_client.client.has_valid_token')
+    @patch('change_request_form.forms.ChangeRequestForm.create_tickets')
+    def test_submission_fails_if_zendesk_becomes_unavailable(
+            self, mock_create_tickets, mock_has_valid_token, mock_get_profile):
+        mock_has_valid_token.return_value = True
+        mock_create_tickets.return_value = ({}, {'zendesk': CircuitOpenError()})
+
+        response = self.client.post('/', dict(VALID_POST_DATA, idempotency_key='abc'))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.client.post('/', dict(VALID_POST_DATA, idempotency_key='abc')).status_code, 503)
+        self.assertEqual(mock_create_tickets.call_count, 2)
+
+    @patch('change_request_form.views.get_profile')
+    @patch('authbroker_client.client.has_valid_token')
+    @patch('change_request_form.views.slack_notify')
+    @patch('change_request_form.forms.ChangeRequestForm.create_tickets')
+    def test_repeated_submission_returns_original_ticket(
+            self, mock_create_tickets, mock_slack_notify, mock_has_valid_token, mock_get_profile):
+        mock_has_valid_token.return_value = True
+        mock_create_tickets.return_value = ({'zendesk': 123}, {})
+        post_data = dict(VALID_POST_DATA, idempotency_key='abc')
+
+        first = self.client.post('/', post_data)
+        second = self.client.post('/', post_data)
+
+        self.assertEqual(first.url, '/success/?issue=123')
+        self.assertEqual(second.url, '/success/?issue=123')
+        self.assertEqual(mock_create_tickets.call_count, 1)
+        self.assertEqual(mock_slack_notify.call_count, 1)
+
+    @patch('change_request_form.views.get_profile')
+    @patch('authbroker_client.client.has_valid_token')
+    @patch('change_request_form.views.slack_notify')
+    @patch('change_request_form.forms.ChangeRequestForm.create_tickets')
+    def test_repeated_key_with_different_data_is_rejected(
+            self, mock_create_tickets, mock_slack_notify, mock_has_valid_token, mock_get_profile):
+        mock_has_valid_token.return_value = True
+        mock_create_tickets.return_value = ({'zendesk': 123}, {})
+
+        self.client.post('/', dict(VALID_POST_DATA, idempotency_key='abc'))
+        response = self.client.post('/', dict(VALID_POST_DATA, idempotency_key='abc', name='Mrs Smith'))
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(mock_create_tickets.call_count, 1)
+
+    @patch('change_request_form.views.get_profile')
+    @patch('authbroker_client.client.has_valid_token')
+    @patch('change_request_form.views.slack_notify')
+    @patch('change_request_form.forms.ChangeRequestForm.create_tickets')
+    def test_ticket_is_kept_if_notification_fails(
+            self, mock_create_tickets, mock_slack_notify, mock_has_valid_token, mock_get_profile):
+        mock_has_valid_token.return_value = True
+        mock_create_tickets.return_value = ({'zendesk': 123}, {})
+        mock_slack_notify.side_effect = [requests.HTTPError(), None]
+        post_data = dict(VALID_POST_DATA, idempotency_key='abc')
+        self.client.get('/')
+
+        with self.assertRaises(requests.HTTPError):
+            self.client.post('/', post_data)
+
+        self.assertEqual(self.client.post('/', post_data).url, '/success/?issue=123')
+        self.assertEqual(mock_create_tickets.call_count, 1)
+
+    @patch('change_request_form.views.enqueue_submission')
+    @patch('change_request_form.views.get_profile')
+    @patch('authbroker_client.client.has_valid_token')
+    @patch('change_request_form.views.slack_notify')
+    @patch('change_request_form.forms.ChangeRequestForm.create_tickets')
+    def test_notification_slack_refuses_is_queued(
+            self, mock_create_tickets, mock_slack_notify, mock_has_valid_token, mock_get_profile,
+            mock_enqueue_submission):
+        mock_has_valid_token.return_value = True
+        mock_create_tickets.return_value = ({'zendesk': 123}, {})
+        mock_slack_notify.return_value = False
+
+        response = self.client.post('/', VALID_POST_DATA)
+
+        self.assertEqual(response.url, '/success/?issue=123')
+        mock_enqueue_submission.assert_called_with(ANY, {'zendesk': 123}, notified=False)
+
+
+    @patch('change_request_form.views.get_profile')
+    @patch('authbroker_client.client.has_valid_token')
+    @patch('change_request_form.forms.ChangeRequestForm.add_upload_errors')
+    @patch('change_request_form.forms.ChangeRequestForm.create_tickets')
+    def test_failed_attachment_upload_is_reported(
+            self, mock_create_tickets, mock_add_upload_errors, mock_has_valid_token, mock_get_profile):
+        mock_has_valid_token.return_value = True
+        mock_create_tickets.return_value = ({}, {'zendesk': AttachmentUploadError(['/tmp/a.zip'])})
+        post_data = dict(VALID_POST_DATA, idempotency_key='abc')
+
+        first = self.client.post('/', post_data)
+        second = self.client.post('/', post_data)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        mock_add_upload_errors.assert_called_with(['/tmp/a.zip'])
+        self.assertEqual(mock_create_tickets.call_count, 2)
+
+
+class FormFragmentCacheTestCase(TestCase):
+    def test_cached_render_matches_form(self):
+        form = ChangeRequestForm(initial={'name': 'Mr <Smith>', 'email': 'test@test.com'})
+
+        self.assertEqual(render_cached(form), str(form))
+
+    def test_cached_render_without_profile(self):
+        form = ChangeRequestForm(initial={})
+
+        self.assertNotIn('__prefilled_', render_cached(form))
+
+
+class IdempotencyTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def get_keys(self, idempotency_key=None, scope='session', **data):
+        form = ChangeRequestForm(dict(VALID_POST_DATA, **data))
+        self.assertTrue(form.is_valid())
+
+        return submission_keys(idempotency_key, form, scope)
+
+    def test_fingerprint_depends_on_data(self):
+        self.assertEqual(self.get_keys().lock, self.get_keys().lock)
+        self.assertNotEqual(self.get_keys().lock, self.get_keys(name='Mrs Smith').lock)
+
+    def test_recorded_submission_is_found_by_key(self):
+        record_submission(self.get_keys('abc'), 123)
+
+        self.assertEqual(claim_submission(self.get_keys('abc')), '123')
+        self.assertEqual(claim_submission(self.get_keys()), '123')
+
+    def test_keys_are_scoped_to_session(self):
+        record_submission(self.get_keys('abc'), 123)
+
+        self.assertIsNone(claim_submission(self.get_keys('abc', scope='other session')))
+
+    def test_key_reused_with_different_data_conflicts(self):
+        record_submission(self.get_keys('abc'), 123)
+
+        with self.assertRaises(SubmissionConflict):
+            claim_submission(self.get_keys('abc', name='Mrs Smith'))
+
+    @override_settings(SUBMISSION_DEDUP_WAIT_SECONDS=0)
+    def test_key_in_use_with_different_data_conflicts(self):
+        claim_submission(self.get_keys('abc'))
+
+        with self.assertRaises(SubmissionConflict):
+            claim_submission(self.get_keys('abc', name='Mrs Smith'))
+
+        release_submission(self.get_keys('abc'))
+        self.assertIsNone(claim_submission(self.get_keys('abc', name='Mrs Smith')))
+
+    @override_settings(DEBUG=False, SUBMISSION_DEDUP_ENABLED=True)
+    def test_local_cache_is_reported(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([error.id for error in check_dedup_cache(None)], ['change_request_form.W001'])
+
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache'}}):
+            self.assertEqual(check_dedup_cache(None), [])
+
+    @override_settings(SUBMISSION_DEDUP_WAIT_SECONDS=0)
+    def test_submission_in_progress(self):
+        keys = self.get_keys('abc')
+
+        self.assertIsNone(claim_submission(keys))
+
+        with self.assertRaises(SubmissionInProgress):
+            claim_submission(keys)
+
+
+class TicketQueueTestCase(TestCase):
+    @override_settings(TICKET_QUEUE_BACKOFF_SECONDS=30, TICKET_QUEUE_MAX_BACKOFF_SECONDS=3600)
+    def test_retry_delay_doubles_up_to_maximum(self):
+        self.assertEqual(retry_delay(1), dt.timedelta(seconds=30))
+        self.assertEqual(retry_delay(2), dt.timedelta(seconds=60))
+        self.assertEqual(retry_delay(3), dt.timedelta(seconds=120))
+        self.assertEqual(retry_delay(20), dt.timedelta(seconds=3600))
+
+
+@override_settings(TICKET_BACKENDS_BY_PLATFORM={'default': ['zendesk'], 'digital_workspace': ['jira', 'zendesk']})
+@patch('change_request_form.jira.create_issue')
+@patch('change_request_form.zendesk.create_ticket')
+class TicketBackendTestCase(TestCase):
+    def test_tickets_are_created_in_each_backend(self, mock_create_ticket, mock_create_issue):
+        mock_create_ticket.return_value = 123
+        mock_create_issue.return_value = 'CONTENT-1'
+
+        self.assertEqual(create_tickets({'platform': 'gov.uk'}, []), ({'zendesk': 123}, {}))
+        self.assertEqual(
+            create_tickets({'platform': 'digital_workspace'}, []), ({'jira': 'CONTENT-1', 'zendesk': 123}, {}))
+        self.assertEqual(mock_create_issue.call_count, 1)
+
+    def test_failures_are_returned_by_backend(self, mock_create_ticket, mock_create_issue):
+        error = requests.ConnectionError()
+        mock_create_ticket.side_effect = error
+        mock_create_issue.return_value = 'CONTENT-1'
+
+        self.assertEqual(
+            create_tickets({'platform': 'digital_workspace'}, []), ({'jira': 'CONTENT-1'}, {'zendesk': error}))
+
+    @patch('change_request_form.outbox.post_slack_message')
+    def test_queued_submission_retries_only_failed_backends(
+            self, mock_post_slack_message, mock_create_ticket, mock_create_issue):
+        submission = TicketSubmission.objects.create(
+            data=json.dumps({'platform': 'digital_workspace'}), ticket_id='CONTENT-1',
+            tickets=json.dumps([['jira', 'CONTENT-1']]), notified=True, status=TicketSubmission.PROCESSING)
+        mock_create_ticket.side_effect = [requests.ConnectionError(), 123]
+
+        process_submission(submission)
+        submission.refresh_from_db()
+
+        self.assertEqual(submission.status, TicketSubmission.PENDING)
+        self.assertEqual(submission.attempts, 1)
+
+        process_submission(submission)
+        submission.refresh_from_db()
+
+        self.assertEqual(submission.status, TicketSubmission.DONE)
+        self.assertEqual(json.loads(submission.tickets), [['jira', 'CONTENT-1'], ['zendesk', 123]])
+        self.assertFalse(mock_create_issue.called)
+        self.assertFalse(mock_post_slack_message.called)
+
+    @patch('change_request_form.outbox.post_slack_message')
+    def test_queued_submission_is_notified_once_primary_ticket_exists(
+            self, mock_post_slack_message, mock_create_ticket, mock_create_issue):
+        submission = TicketSubmission.objects.create(
+            data=json.dumps({'platform': 'digital_workspace'}), status=TicketSubmission.PROCESSING)
+        mock_create_issue.side_effect = [requests.ConnectionError(), 'CONTENT-1']
+        mock_create_ticket.return_value = 123
+
+        process_submission(submission)
+        submission.refresh_from_db()
+
+        self.assertIsNone(submission.ticket_id)
+        self.assertFalse(mock_post_slack_message.called)
+
+        process_submission(submission)
+        submission.refresh_from_db()
+
+        self.assertEqual(submission.ticket_id, 'CONTENT-1')
+        self.assertEqual(submission.status, TicketSubmission.DONE)
+        self.assertEqual(mock_create_ticket.call_count, 1)
+        self.assertEqual(mock_post_slack_message.call_count, 1)
+
+
+@override_settings(JIRA_WORKSPACE_PROJECT_ID='2', JIRA_WATCHERS=['a', 'b', 'c'])
+@patch('change_request_form.jira.get_jira_client')
+class JiraTestCase(TestCase):
+    def test_create_issue(self, mock_get_jira_client):
+        mock_get_jira_client.return_value.create_issue.return_value = Mock(key='CONTENT-1')
+        data = dict(VALID_POST_DATA, platform='digital_workspace', telephone='', update_url='', approver='',
+                    publication_date=dt.date(2020, 7, 1), publication_date_not_required=False,
+                    publication_date_explanation='')
+
+        self.assertEqual(create_issue(data, []), 'CONTENT-1')
+
+        fields = mock_get_jira_client.return_value.create_issue.call_args[1]['fields']
+        self.assertEqual(fields['project'], {'id': '2'})
+        self.assertEqual(fields['duedate'], '2020-07-01')
+        self.assertNotIn('<br>', fields['description'])
+        self.assertEqual(mock_get_jira_client.return_value.add_watcher.call_count, 3)
+
+    def test_watcher_failures_are_reported(self, mock_get_jira_client):
+        def add_watcher(issue, watcher):
+            if watcher == 'b':
+                raise requests.HTTPError()
+
+        mock_get_jira_client.return_value.add_watcher.side_effect = add_watcher
+
+        self.assertEqual(add_watchers('CONTENT-1', ['a', 'b', 'c']), ['b'])
+
+
+class JiraClientTestCase(TestCase):
+    @patch('change_request_form.jira._client', None)
+    @patch('change_request_form.jira.mount_adapter')
+    def test_client_does_not_retry(self, mock_mount_adapter):
+        jira = Mock()
+
+        with patch.dict('sys.modules', {'jira': jira}):
+            get_jira_client()
+
+        self.assertEqual(jira.JIRA.call_args[1]['max_retries'], 0)
+        mock_mount_adapter.assert_called_with(jira.JIRA.return_value._session, 'jira')
+
+
+class ZendeskTestCase(TestCase):
+    @patch('change_request_form.zendesk.upload_attachment')
+    def test_upload_attachments_reports_failures(self, mock_upload_attachment):
+        mock_upload_attachment.side_effect = lambda path: {'/tmp/a.zip': 'token-a', '/tmp/c.pdf': 'token-c'}[path]
+
+        tokens, failed = upload_attachments(['/tmp/a.zip', '/tmp/b.zip', '/tmp/c.pdf'])
+
+        self.assertEqual(tokens, ['token-a', 'token-c'])
+        self.assertEqual(failed, ['/tmp/b.zip'])
+
+    @patch('change_request_form.zendesk.zendesk_client')
+    @patch('change_request_form.zendesk.upload_attachments')
+    def test_no_ticket_is_created_if_an_attachment_fails(self, mock_upload_attachments, mock_zendesk_client):
+        mock_upload_attachments.return_value = (['token-a'], ['/tmp/b.zip'])
+
+        with self.assertRaises(AttachmentUploadError) as cm:
+            create_ticket(VALID_POST_DATA, ['/tmp/a.zip', '/tmp/b.zip'])
+
+        self.assertEqual(cm.exception.paths, ['/tmp/b.zip'])
+        self.assertFalse(mock_zendesk_client.called)
+
+    @override_settings(ZENDESK_RATELIMIT_BUDGET=60)
+    @patch('change_request_form.zendesk._clients', queue.LifoQueue())
+    def test_ratelimit_budget_is_per_call(self):
+        with zendesk_client() as client:
+            pass
+
+        # each call waits out most of the budget on 429s, on the same pooled client
+        for _ in range(3):
+            with zendesk_client() as pooled_client:
+                self.assertIs(pooled_client, client)
+
+                for api in (pooled_client.tickets, pooled_client.attachments, pooled_client.job_status):
+                    api.check_ratelimit_budget(50)
+
+    @patch('change_request_form.outbox.create_tickets')
+    def test_queued_attachments_are_kept_until_uploaded(self, mock_create_tickets):
+        submission = TicketSubmission.objects.create(
+            data=json.dumps({'platform': 'gov.uk'}), status=TicketSubmission.PROCESSING)
+        attachment_dir = os.path.join(settings.TICKET_QUEUE_ATTACHMENT_DIR, str(submission.reference))
+        os.makedirs(attachment_dir)
+        self.addCleanup(shutil.rmtree, attachment_dir, True)
+        mock_create_tickets.return_value = ({}, {'zendesk': AttachmentUploadError(['/tmp/b.zip'])})
+
+        process_submission(submission)
+        submission.refresh_from_db()
+
+        self.assertEqual(submission.status, TicketSubmission.PENDING)
+        self.assertTrue(os.path.isdir(attachment_dir))
+
+
+@patch('authbroker_client.client.introspect', Mock(return_value={'active': True, 'username': 'test@test.com'}))
+class BulkSubmissionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def post(self, body, content_type='application/json', **extra):
+        return Client().post('/bulk/', body, content_type=content_type, HTTP_AUTHORIZATION='Bearer abc', **extra)
+
+    def test_parse_csv(self):
+        rows = parse_rows('text/csv', b'\xef\xbb\xbfname,email\r\nMr Smith,test@test.com\r\n')
+
+        self.assertEqual(rows, [{'name': 'Mr Smith', 'email': 'test@test.com'}])
+
+    def test_parse_rejects_other_content(self):
+        with self.assertRaises(BulkSubmissionError):
+            parse_rows('application/json', b'{"name": "Mr Smith"}')
+
+        with self.assertRaises(BulkSubmissionError):
+            parse_rows('text/plain', b'name')
+
+    def test_publication_date_is_split(self):
+        data = form_data({'publication_date': '2020-07-01', 'attachment_upload': 'token'})
+
+        self.assertEqual(data, {'publication_date_0': '01', 'publication_date_1': '07', 'publication_date_2': '2020'})
+
+    def test_requires_auth(self):
+        response = Client().post('/bulk/', '[]', content_type='application/json')
+
+        self.assertEqual(response.status_code, 401)
+
+    @patch('change_request_form.bulk.create_ticket_batch')
+    def test_nothing_is_submitted_if_a_row_is_invalid(self, mock_create_ticket_batch):
+        response = self.post(json.dumps([VALID_POST_DATA, dict(VALID_POST_DATA, email='invalid')]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'][0]['errors'], {})
+        self.assertIn('email', response.json()['results'][1]['errors'])
+        self.assertFalse(mock_create_ticket_batch.called)
+
+    @override_settings(TICKET_BACKENDS_BY_PLATFORM={'default': ['zendesk'], 'gov.uk': ['jira', 'zendesk']})
+    @patch('change_request_form.bulk.create_ticket_batch')
+    def test_rows_for_other_backends_are_rejected(self, mock_create_ticket_batch):
+        response = self.post(json.dumps([VALID_POST_DATA]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('platform', response.json()['results'][0]['errors'])
+        self.assertFalse(mock_create_ticket_batch.called)
+
+    @override_settings(ZENDESK_BATCH_SIZE=2)
+    @patch('change_request_form.bulk.slack_notify')
+    @patch('change_request_form.bulk.create_ticket_batch')
+    def test_tickets_are_created_in_batches(self, mock_create_ticket_batch, mock_slack_notify):
+        mock_create_ticket_batch.side_effect = ['job-1', 'job-2']
+
+        response = self.post(json.dumps({'requests': [VALID_POST_DATA] * 3}))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['job_ids'], ['job-1', 'job-2'])
+        self.assertEqual(response.json()['results'][2], {'index': 2, 'job_id': 'job-2', 'job_index': 0})
+        self.assertEqual([len(call[0][0]) for call in mock_create_ticket_batch.call_args_list], [2, 1])
+        self.assertEqual(mock_slack_notify.call_count, 1)
+
+    @override_settings(ZENDESK_BATCH_SIZE=2)
+    @patch('change_request_form.bulk.slack_notify')
+    @patch('change_request_form.bulk.create_ticket_batch')
+    def test_rows_after_a_failed_batch_are_not_submitted(self, mock_create_ticket_batch, mock_slack_notify):
+        mock_create_ticket_batch.side_effect = ['job-1', requests.ConnectionError(), 'job-3']
+
+        response = self.post(json.dumps([VALID_POST_DATA] * 5))
+
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.json()['job_ids'], ['job-1'])
+        self.assertEqual([result.get('error') for result in response.json()['results']],
+                         [None, None, 'Not submitted', 'Not submitted', 'Not submitted'])
+        self.assertEqual(mock_create_ticket_batch.call_count, 2)
+
+    @override_settings(ZENDESK_BATCH_SIZE=2)
+    @patch('change_request_form.bulk.slack_notify')
+    @patch('change_request_form.bulk.create_ticket_batch')
+    def test_retry_with_idempotency_key_submits_the_rest(self, mock_create_ticket_batch, mock_slack_notify):
+        mock_create_ticket_batch.side_effect = ['job-1', requests.ConnectionError(), 'job-2', 'job-3']
+        body = json.dumps([VALID_POST_DATA] * 5)
+
+        self.assertEqual(self.post(body, HTTP_IDEMPOTENCY_KEY='abc').status_code, 502)
+        response = self.post(body, HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['job_ids'], ['job-1', 'job-2', 'job-3'])
+        self.assertEqual(response.json()['results'][2], {'index': 2, 'job_id': 'job-2', 'job_index': 0})
+        self.assertEqual([len(call[0][0]) for call in mock_create_ticket_batch.call_args_list], [2, 2, 2, 1])
+
+        self.assertEqual(self.post(body, HTTP_IDEMPOTENCY_KEY='abc').json(), response.json())
+        self.assertEqual(mock_create_ticket_batch.call_count, 4)
+
+    @patch('change_request_form.bulk.slack_notify')
+    @patch('change_request_form.bulk.create_ticket_batch')
+    def test_idempotency_key_reused_for_another_batch_conflicts(self, mock_create_ticket_batch, mock_slack_notify):
+        mock_create_ticket_batch.return_value = 'job-1'
+
+        self.post(json.dumps([VALID_POST_DATA]), HTTP_IDEMPOTENCY_KEY='abc')
+        response = self.post(json.dumps([VALID_POST_DATA] * 2), HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(mock_create_ticket_batch.call_count, 1)
+
+    @patch('change_request_form.views.get_job_status')
+    @patch('change_request_form.bulk.slack_notify')
+    @patch('change_request_form.bulk.create_ticket_batch')
+    def test_jobs_are_only_visible_to_their_caller(
+            self, mock_create_ticket_batch, mock_slack_notify, mock_get_job_status):
+        mock_create_ticket_batch.return_value = 'job-1'
+        mock_get_job_status.return_value = {'id': 'job-1'}
+        self.post(json.dumps([VALID_POST_DATA]))
+
+        response = Client().get('/bulk/jobs/job-1/', HTTP_AUTHORIZATION='Bearer abc')
+        self.assertEqual(response.json(), {'id': 'job-1'})
+
+        with patch('authbroker_client.client.introspect', Mock(return_value={'active': True, 'username': 'other'})):
+            response = Client().get('/bulk/jobs/job-1/', HTTP_AUTHORIZATION='Bearer def')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(mock_get_job_status.call_count, 1)
+
+
+@patch('authbroker_client.client.has_valid_token', Mock(return_value=True))
+@patch('change_request_form.ticket_status.get_ticket')
+class TicketStatusTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def submitted(self, issue):
+        session = self.client.session
+        remember_request(session, issue)
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def test_status_is_cached(self, mock_get_ticket):
+        mock_get_ticket.return_value = Mock(status='open', updated_at='2020-06-01T10:00:00Z')
+
+        status = get_status('123')
+
+        self.assertEqual(status['label'], 'In progress')
+        self.assertEqual(status['updated_at'], dt.datetime(2020, 6, 1, 10, tzinfo=dt.timezone.utc))
+        self.assertEqual(get_status('123'), status)
+        self.assertEqual(mock_get_ticket.call_count, 1)
+
+    def test_unknown_issue(self, mock_get_ticket):
+        mock_get_ticket.return_value = None
+
+        self.assertIsNone(get_status('123'))
+        self.assertIsNone(get_status('123'))
+        self.assertIsNone(get_status('Not specified'))
+        self.assertEqual(mock_get_ticket.call_count, 1)
+
+    def test_failed_fetch_is_cached(self, mock_get_ticket):
+        mock_get_ticket.side_effect = requests.ConnectionError()
+        self.submitted('123')
+
+        response = self.client.get('/status/123/')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(get_status('123'))
+        self.assertEqual(mock_get_ticket.call_count, 1)
+
+    @patch('change_request_form.ticket_status.TicketSubmission')
+    def test_queued_submission(self, mock_ticket_submission, mock_get_ticket):
+        mock_ticket_submission.objects.filter.return_value.first.return_value = Mock(
+            ticket_id=None, status='pending', updated_at=dt.datetime(2020, 6, 1, tzinfo=dt.timezone.utc))
+
+        self.assertEqual(get_status(str(uuid.uuid4()))['status'], 'queued')
+        self.assertFalse(mock_get_ticket.called)
+
+    def test_conditional_get(self, mock_get_ticket):
+        mock_get_ticket.return_value = Mock(status='new', updated_at='2020-06-01T10:00:00Z')
+        self.submitted('123')
+
+        response = self.client.get('/status/123/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'new')
+
+        response = self.client.get('/status/123/', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(mock_get_ticket.call_count, 1)
+
+    def test_success_page_does_not_fetch_status(self, mock_get_ticket):
+        self.submitted('123')
+
+        response = self.client.get('/success/?issue=123')
+
+        self.assertContains(response, 'data-url="/status/123/"')
+        self.assertFalse(mock_get_ticket.called)
+
+    def test_status_is_only_shown_to_the_submitting_session(self, mock_get_ticket):
+        mock_get_ticket.return_value = Mock(status='new', updated_at='2020-06-01T10:00:00Z')
+        self.submitted('456')
+
+        self.assertEqual(self.client.get('/status/123/').status_code, 404)
+        self.assertNotContains(self.client.get('/success/?issue=123'), 'data-url=')
+        self.assertFalse(mock_get_ticket.called)
+
+
+@override_settings(ATTACHMENT_MAX_SIZE=100, CHUNKED_UPLOAD_MAX_CHUNK_SIZE=4)
+class ChunkedUploadTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.upload_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(CHUNKED_UPLOAD_DIR=self.upload_dir.name)
+        self.settings_override.enable()
+
+        patcher = patch('authbroker_client.client.has_valid_token', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.upload_dir.cleanup()
+
+    def put_chunk(self, upload_id, offset, chunk):
+        return self.client.put(f'/uploads/{upload_id}/', chunk, content_type='application/octet-stream',
+                               HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_upload_in_chunks(self):
+        response = self.client.post('/uploads/', json.dumps({'name': 'file.zip', 'size': 6}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.json()['id']
+
+        self.assertEqual(self.put_chunk(upload_id, 0, b'abcd').json()['offset'], 4)
+
+        # a chunk that doesn't follow on from the last is rejected with the offset to resume from
+        response = self.put_chunk(upload_id, 2, b'ef')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 4)
+
+        self.assertEqual(self.client.get(f'/uploads/{upload_id}/').json()['offset'], 4)
+
+        status = self.put_chunk(upload_id, 4, b'ef').json()
+        upload = open_upload(status['token'])
+
+        self.assertEqual(upload.name, 'file.zip')
+        self.assertEqual(upload.size, 6)
+        self.assertEqual(upload.read(), b'abcdef')
+        # so the verdict cache can be used at submission
+        self.assertEqual(upload.sha256, hashlib.sha256(b'abcdef').hexdigest())
+
+    def test_oversized_chunk(self):
+        upload_id = start_upload('file.zip', 10)
+
+        self.assertEqual(self.put_chunk(upload_id, 0, b'abcde').status_code, 400)
+
+    def test_incomplete_upload(self):
+        upload_id = start_upload('file.zip', 10)
+
+        with self.assertRaises(UploadError):
+            open_upload(make_token(upload_id))
+
+    def test_invalid_token(self):
+        with self.assertRaises(UploadError):
+            open_upload('not-a-token')
+
+    @patch.object(AVFileField, 'validate_file')
+    def test_form_accepts_upload_token(self, mock_validate_file):
+        upload_id = start_upload('file.zip', 3)
+        self.put_chunk(upload_id, 0, b'abc')
+
+        form = ChangeRequestForm(dict(VALID_POST_DATA, attachment_upload=make_token(upload_id)))
+
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['attachment'].read(), b'abc')
+        self.assertTrue(form.cleaned_data['attachment'].temporary_file_path().startswith(self.upload_dir.name))
+
+    @patch.object(AVFileField, 'validate_file')
+    @patch('change_request_form.views.get_profile')
+    def test_invalid_form_keeps_upload_token(self, mock_get_profile, mock_validate_file):
+        upload_id = start_upload('file.zip', 3)
+        self.put_chunk(upload_id, 0, b'abc')
+        token = make_token(upload_id)
+        post_data = {k: v for k, v in VALID_POST_DATA.items() if k != 'name'}
+
+        response = self.client.post('/', dict(post_data, attachment_upload=token))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'<input type="hidden" name="attachment_upload" value="{token}"/>', html=True)
+        self.assertTrue(os.path.exists(data_path(upload_id)))
+
+    def test_form_rejects_invalid_upload_token(self):
+        form = ChangeRequestForm(dict(VALID_POST_DATA, attachment_upload='not-a-token'))
+
+        self.assertFalse(form.is_valid())
+        self.assertIn('attachment', form.errors)
+
+    def test_invalid_upload_id(self):
+        for upload_id in ('..', '.', '', 'z' * 32, uuid.uuid4().hex + '/..'):
+            with self.assertRaises(UploadError):
+                upload_dir(upload_id)
+
+    @patch.object(AVFileField, 'validate_file')
+    def test_each_form_opens_its_own_upload(self, mock_validate_file):
+        upload_id = start_upload('file.zip', 3)
+        self.put_chunk(upload_id, 0, b'abc')
+        data = dict(VALID_POST_DATA, attachment_upload=make_token(upload_id))
+
+        first, second = ChangeRequestForm(data), ChangeRequestForm(data)
+        self.assertTrue(first.is_valid())
+        self.assertTrue(second.is_valid())
+
+        attachment = first.cleaned_data['attachment']
+        self.assertIsNot(attachment, second.cleaned_data['attachment'])
+
+        first.close_uploads()
+        self.assertTrue(attachment.closed)
+        self.assertTrue(os.path.exists(attachment.temporary_file_path()))
+
+        second.close_uploads(delete=True)
+        self.assertFalse(os.path.exists(attachment.temporary_file_path()))
+
+
+class AttachmentUploadHandlerTestCase(TestCase):
+    def receive(self, name, content, chunk_size=4):
+        request = Mock(spec=[])
+        handler = AttachmentUploadHandler(request)
+        handler.new_file('attachment', name, 'application/zip', None)
+
+        for start in range(0, len(content), chunk_size):
+            handler.receive_data_chunk(content[start:start + chunk_size], start)
+
+        return handler.file_complete(len(content)), request
+
+    @override_settings(AV_SCAN_DURING_UPLOAD=False)
+    def test_hashes_upload(self):
+        upload, _ = self.receive('file.zip', b'some content')
+
+        self.assertEqual(upload.sha256, hashlib.sha256(b'some content').hexdigest())
+        self.assertEqual(upload.read(), b'some content')
+        self.assertFalse(hasattr(upload, 'av_scan'))
+
+    @override_settings(ATTACHMENT_MAX_SIZE=8, AV_SCAN_DURING_UPLOAD=False)
+    def test_rejects_oversized_upload(self):
+        with self.assertRaises(SkipFile):
+            self.receive('file.zip', b'some content')
+
+    @override_settings(ATTACHMENT_ALLOWED_EXTENSIONS=['zip'], AV_SCAN_DURING_UPLOAD=False)
+    def test_rejects_disallowed_type(self):
+        request = Mock(spec=[])
+
+        with self.assertRaises(SkipFile):
+            AttachmentUploadHandler(request).new_file('attachment', 'file.exe', 'application/octet-stream', None)
+
+        self.assertIn('attachment', request.rejected_uploads)
+
+    @override_settings(AV_SCAN_DURING_UPLOAD=True, AV_VERDICT_CACHE={'BACKEND': ''})
+    @patch('change_request_form.fields.scan_stream')
+    def test_streams_upload_to_av(self, mock_scan_stream):
+        received = []
+
+        def scan_stream(name, chunks):
+            received.extend(chunks)
+            return {'malware': True, 'reason': 'Eicar-Test-Signature'}
+
+        mock_scan_stream.side_effect = scan_stream
+
+        upload, _ = self.receive('file.zip', b'some content')
+
+        with self.assertRaises(ValidationError):
+            upload.av_scan.result()
+
+        self.assertEqual(b''.join(received), b'some content')
+
+    @override_settings(AV_SCAN_DURING_UPLOAD=True, AV_SCAN_DURING_UPLOAD_STALL_SECONDS=0.1)
+    @patch('change_request_form.fields.check_verdict')
+    @patch('change_request_form.fields.scan_stream')
+    def test_abandoned_upload_ends_the_scan(self, mock_scan_stream, mock_check_verdict):
+        mock_scan_stream.side_effect = lambda name, chunks: list(chunks)
+
+        handler = AttachmentUploadHandler(Mock(spec=[]))
+        handler.new_file('attachment', 'file.zip', 'application/zip', None)
+        handler.receive_data_chunk(b'some', 0)
+
+        # the client goes away without the upload completing
+        with self.assertRaises(ValidationError):
+            handler.av_scan.result(timeout=5)
+        self.assertFalse(mock_check_verdict.called)
+
+    @override_settings(AV_SCAN_DURING_UPLOAD=True, AV_SCAN_DURING_UPLOAD_STALL_SECONDS=0.1)
+    @patch('change_request_form.fields.AVFileField.scan')
+    @patch('change_request_form.fields.scan_stream')
+    def test_stalled_upload_is_scanned_again_when_it_completes(self, mock_scan_stream, mock_scan):
+        mock_scan_stream.side_effect = lambda name, chunks: (list(chunks), {'malware': False})[1]
+        mock_scan.return_value = {'malware': True, 'reason': 'Eicar-Test-Signature'}
+
+        handler = AttachmentUploadHandler(Mock(spec=[]))
+        handler.new_file('attachment', 'file.zip', 'application/zip', None)
+        handler.receive_data_chunk(b'some', 0)
+
+        # the upload stalls long enough for the streamed scan to give up, then resumes
+        with self.assertRaises(ValidationError):
+            handler.av_scan.result(timeout=5)
+
+        handler.receive_data_chunk(b' malware', 4)
+        upload = handler.file_complete(12)
+
+        self.assertFalse(hasattr(upload, 'av_scan'))
+        with self.assertRaises(ValidationError):
+            AVFileField().clean(upload)
+        self.assertTrue(mock_scan.called)
+
+    @override_settings(ATTACHMENT_MAX_SIZE=8, AV_SCAN_DURING_UPLOAD=False)
+    def test_size_limit_is_per_file(self):
+        request = Mock(spec=[])
+        handler = AttachmentUploadHandler(request)
+        handler.content_length = 100
+        handler.new_file('attachment', 'file.zip', 'application/zip', None)
+        handler.receive_data_chunk(b'small', 0)
+
+        self.assertEqual(handler.file_complete(5).sha256, hashlib.sha256(b'small').hexdigest())
+
+    @override_settings(ATTACHMENT_MAX_SIZE=8)
+    @patch('change_request_form.views.get_profile')
+    @patch('authbroker_client.client.has_valid_token', return_value=True)
+    def test_rejected_upload_is_a_form_error(self, mock_has_valid_token, mock_get_profile):
+        post_data = dict(VALID_POST_DATA, attachment=SimpleUploadedFile('file.zip', b'some content'))
+
+        response = Client().post('/', post_data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response.context['form'].errors)
+
+
+class StubServiceTestCase(TestCase):
+    def start_stub(self, *args, **kwargs):
+        stub = StubService(*args, **kwargs)
+        stub.start()
+        self.addCleanup(stub.stop)
+
+        return stub
+
+    def test_responds_like_upstream(self):
+        stub = self.start_stub('zendesk')
+
+        response = requests.post(stub.url + 'api/v2/tickets.json', json={'ticket': {}})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('id', response.json()['ticket'])
+
+    def test_error_injection(self):
+        stub = self.start_stub('av', error_rate=1)
+
+        self.assertEqual(requests.post(stub.url, data=b'content').status_code, 500)
+
+
+class HashingReaderTestCase(TestCase):
+    def test_hashes_data_as_it_is_read(self):
+        reader = HashingReader(io.BytesIO(b'some file content'), 17)
+
+        self.assertEqual(reader.len, 17)
+        self.assertEqual(reader.read(4), b'some')
+        self.assertEqual(reader.len, 13)
+        reader.read()
+
+        self.assertEqual(reader.hash.hexdigest(), hashlib.sha256(b'some file content').hexdigest())
+
+    def test_stops_reading_when_cancelled(self):
+        stop_reading = threading.Event()
+        reader = HashingReader(io.BytesIO(b'some file content'), 17, stop_reading)
+
+        reader.read(4)
+        stop_reading.set()
+
+        with self.assertRaises(ScanCancelled):
+            reader.read(4)
+
+
+class VerdictCacheTestCase(TestCase):
+    def test_local_cache(self):
+        cache = LocalVerdictCache(max_size=10, ttl=60)
+
+        self.assertFalse(cache.is_clean('abc'))
+        cache.add_clean('abc')
+        self.assertTrue(cache.is_clean('abc'))
+
+    @patch('change_request_form.fields.is_known_clean')
+    @patch('change_request_form.fields.get_session')
+    def test_clean_file_is_not_rescanned(self, mock_get_session, mock_is_known_clean):
+        mock_is_known_clean.return_value = True
+        upload = SimpleUploadedFile('guidance.pdf', b'content')
+        upload.sha256 = hashlib.sha256(b'content').hexdigest()
+
+        self.assertEqual(AVFileField().clean(upload), upload)
+        self.assertFalse(mock_get_session.called)
+        mock_is_known_clean.assert_called_with(hashlib.sha256(b'content').hexdigest())
+
+    @patch('change_request_form.fields.mark_clean')
+    @patch('change_request_form.fields.is_known_clean')
+    @patch('change_request_form.fields.get_session')
+    def test_unhashed_file_is_hashed_as_it_is_scanned(self, mock_get_session, mock_is_known_clean, mock_mark_clean):
+        def post(url, data, **kwargs):
+            data.read()
+            return Mock(json=Mock(return_value={'malware': False}))
+
+        mock_get_session.return_value.post.side_effect = post
+        upload = SimpleUploadedFile('guidance.pdf', b'content')
+
+        with patch.object(upload, 'chunks', wraps=upload.chunks) as mock_chunks:
+            AVFileField().clean(upload)
+
+        self.assertFalse(mock_chunks.called)
+        self.assertFalse(mock_is_known_clean.called)
+        mock_mark_clean.assert_called_with(hashlib.sha256(b'content').hexdigest())
+
+    @patch('change_request_form.fields.mark_clean')
+    @patch('change_request_form.fields.get_session')
+    def test_malware_is_not_cached(self, mock_get_session, mock_mark_clean):
+        mock_get_session.return_value.post.return_value.json.return_value = {'malware': True, 'reason': 'Eicar'}
+
+        with self.assertRaises(ValidationError):
+            AVFileField().clean(SimpleUploadedFile('malware.zip', b'content'))
+
+        self.assertFalse(mock_mark_clean.called)
+
+
+@override_settings(AV_SCAN_CONCURRENTLY=True)
+class ConcurrentAVScanTestCase(TestCase):
+    @patch('change_request_form.fields.AVFileField.validate_file')
+    def test_scan_result_is_joined(self, mock_validate_file):
+        mock_validate_file.side_effect = ValidationError('File appears to contain Malware.')
+
+        form = ChangeRequestForm(VALID_POST_DATA, {'attachment': SimpleUploadedFile('malware.zip', b'content')})
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['attachment'], ['File appears to contain Malware.'])
+
+    @patch('change_request_form.fields.get_scan_executor')
+    def test_invalid_form_does_not_wait_for_scan(self, mock_get_scan_executor):
+        scan = mock_get_scan_executor.return_value.submit.return_value
+        post_data = {k: v for k, v in VALID_POST_DATA.items() if k != 'name'}
+
+        form = ChangeRequestForm(post_data, {'attachment': SimpleUploadedFile('a.zip', b'content')})
+
+        self.assertFalse(form.is_valid())
+        self.assertTrue(scan.cancel.called)
+        self.assertFalse(scan.result.called)
+
+        # in case the scan was already running
+        stop_reading = mock_get_scan_executor.return_value.submit.call_args[0][2]
+        self.assertIs(scan.stop_reading, stop_reading)
+        self.assertTrue(stop_reading.is_set())
+
+
+class SlackDigestDispatcherTestCase(TestCase):
+    def setUp(self):
+        self.dispatcher = SlackDigestDispatcher(window=10, max_backoff=60)
+        # buffer messages without starting the background thread
+        self.dispatcher._thread = Mock()
+
+    @patch('change_request_form.slack.post_slack_message')
+    def test_messages_are_coalesced(self, mock_post_slack_message):
+        mock_post_slack_message.return_value.status_code = 200
+
+        self.dispatcher.notify('new content request: 1')
+        self.dispatcher.notify('new content request: 2')
+
+        self.assertIsNone(self.dispatcher.flush())
+        mock_post_slack_message.assert_called_once_with(
+            '2 new messages:\nnew content request: 1\nnew content request: 2')
+
+        self.assertIsNone(self.dispatcher.flush())
+        self.assertEqual(mock_post_slack_message.call_count, 1)
+
+    @patch('change_request_form.slack.post_slack_message')
+    def test_rate_limited_messages_are_kept(self, mock_post_slack_message):
+        mock_post_slack_message.return_value = Mock(status_code=429, headers={'Retry-After': '30'})
+
+        self.dispatcher.notify('new content request: 1')
+
+        self.assertEqual(self.dispatcher.flush(), 30)
+
+        mock_post_slack_message.return_value = Mock(status_code=200)
+        self.dispatcher.notify('new content request: 2')
+
+        self.assertIsNone(self.dispatcher.flush())
+        mock_post_slack_message.assert_called_with(
+            '2 new messages:\nnew content request: 1\nnew content request: 2')
+
+    @patch('change_request_form.slack.post_slack_message')
+    def test_digests_are_limited_in_size(self, mock_post_slack_message):
+        mock_post_slack_message.return_value.status_code = 200
+        dispatcher = SlackDigestDispatcher(window=10, max_backoff=60, max_messages=2)
+        dispatcher._thread = Mock()
+
+        for ticket_id in range(3):
+            dispatcher.notify(f'new content request: {ticket_id}')
+
+        self.assertTrue(dispatcher._wake.is_set())
+        self.assertIsNone(dispatcher.flush())
+        self.assertEqual([call[0][0] for call in mock_post_slack_message.call_args_list], [
+            '2 new messages:\nnew content request: 0\nnew content request: 1',
+            'new content request: 2',
+        ])
+
+    def test_messages_are_refused_when_too_many_are_pending(self):
+        dispatcher = SlackDigestDispatcher(window=10, max_backoff=60, max_pending=2)
+        dispatcher._thread = Mock()
 
-        self.assertTrue(mock_create_jira_issue.called)
-        mock_create_jira_issue.assert_called_with(
-            settings.JIRA_CONTENT_PROJECT_ID, self.test_formatted_text, [], submitted_date,
-            customfield_11224='test dept', customfield_11225='test@test.com', customfield_11227='Mr Smith',
-            customfield_11228={'value': 'Add new content to Gov.uk'})
+        self.assertEqual([dispatcher.notify(f'new content request: {ticket_id}') for ticket_id in range(3)],
+                         [True, True, False])
+        self.assertEqual(dispatcher._messages, ['new content request: 0', 'new content request: 1'])
@@ -0,0 +1,138 @@
+"""The status of a submitted change request, for the success page and the status endpoint.
+
+A request is identified by its Zendesk ticket id or, if it went through the ticket queue, by its queue reference.
+Statuses are cached per request for TICKET_STATUS_TTL_SECONDS, so a user refreshing the page doesn't cost a Zendesk
+call each time, and `etag` and `last_modified` let the views answer a repeat request with a 304 without rendering.
+Unknown requests, and statuses that couldn't be fetched, are cached too, for TICKET_STATUS_UNAVAILABLE_TTL_SECONDS,
+so that neither a run of made-up ticket ids nor an outage turns each status request into Zendesk calls.
+
+A session can only look up the status of the requests it submitted, the last MAX_SESSION_REQUESTS of which are kept
+in the session; other tickets on the Zendesk instance, e.g. other teams', aren't reported.
+"""
+import hashlib
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.dateparse import parse_datetime
+
+from .models import TicketSubmission
+from .zendesk import get_ticket
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ticket-status:'
+SESSION_KEY = 'submitted_requests'
+MAX_SESSION_REQUESTS = 20
+
+UNAVAILABLE = 'unavailable'
+
+QUEUED = 'queued'
+NOT_SENT = 'not_sent'
+
+STATUS_LABELS = {
+    QUEUED: 'Received, waiting to be passed to the content team',
+    NOT_SENT: 'Not yet passed to the content team, please contact us',
+    'new': 'Received',
+    'open': 'In progress',
+    'pending': 'Waiting for a reply from you',
+    'hold': 'On hold',
+    'solved': 'Done',
+    'closed': 'Done',
+}
+
+
+def get_cache():
+    return caches[settings.TICKET_STATUS_CACHE]
+
+
+def remember_request(session, issue):
+    """Let the session look up the status of a request it has submitted."""
+
+    issues = [submitted for submitted in session.get(SESSION_KEY, []) if submitted != str(issue)]
+    session[SESSION_KEY] = (issues + [str(issue)])[-MAX_SESSION_REQUESTS:]
+
+
+def submitted_by(session, issue):
+    return issue in session.get(SESSION_KEY, [])
+
+
+def fetch_status(issue):
+    """Look up the status of a request, returning None if there's no such request."""
+
+    try:
+        reference = uuid.UUID(issue)
+    except ValueError:
+        reference = None
+
+    if reference is not None:
+        submission = TicketSubmission.objects.filter(reference=reference).first()
+
+        if submission is None:
+            return None
+
+        if submission.ticket_id is None:
+            status = NOT_SENT if submission.status == TicketSubmission.FAILED else QUEUED
+
+            return {'ticket_id': None, 'status': status, 'updated_at': submission.updated_at}
+
+        ticket_id = submission.ticket_id
+    else:
+        ticket_id = issue
+
+    # only Zendesk tickets have a status; Jira issue keys aren't numeric
+    if not str(ticket_id).isdigit():
+        return None
+
+    ticket_id = int(ticket_id)
+
+    ticket = get_ticket(ticket_id)
+
+    if ticket is None:
+        return None
+
+    return {'ticket_id': ticket_id, 'status': ticket.status, 'updated_at': parse_datetime(ticket.updated_at)}
+
+
+def get_status(issue):
+    """Return the cached status of a request: its ticket id, status, label and when it was last updated.
+
+    Returns None if there's no such request, or if its status can't be fetched at the moment."""
+
+    key = KEY_PREFIX + hashlib.sha256(issue.encode()).hexdigest()
+    status = get_cache().get(key)
+
+    if status is not None:
+        return None if status == UNAVAILABLE else status
+
+    try:
+        status = fetch_status(issue)
+    except Exception:
+        logger.warning('Failed to fetch the status of request %s', issue, exc_info=True)
+        status = None
+
+    if status is None:
+        get_cache().set(key, UNAVAILABLE, settings.TICKET_STATUS_UNAVAILABLE_TTL_SECONDS)
+        return None
+
+    status = dict(status, issue=issue, label=STATUS_LABELS.get(status['status'], status['status']))
+    get_cache().set(key, status, settings.TICKET_STATUS_TTL_SECONDS)
+
+    return status
+
+
+def etag(issue):
+    status = issue and get_status(issue)
+
+    if not status:
+        return None
+
+    return hashlib.sha256('{issue}:{status}:{updated_at}'.format(**status).encode()).hexdigest()
+
+
+def last_modified(issue):
+    status = issue and get_status(issue)
+
+    return status['updated_at'] if status else None
@@ -0,0 +1,125 @@
+"""Upload handling for attachments.
+
+`AttachmentUploadHandler` deals with each attachment as it is received, so that it's read from disk once, when it
+is uploaded to Zendesk:
+
+* its SHA-256 is computed from the incoming chunks and set as the uploaded file's `sha256` attribute;
+* an attachment that is over ATTACHMENT_MAX_SIZE or whose extension isn't in ATTACHMENT_ALLOWED_EXTENSIONS is
+  skipped as soon as that is known, rather than written to disk in full, and recorded in the request's
+  `rejected_uploads`;
+* with AV_SCAN_DURING_UPLOAD, the chunks are also streamed to the AV service as they arrive, and the scan is set as
+  the uploaded file's `av_scan` future for `ChangeRequestForm` to join.
+
+Django 2.2 doesn't tell upload handlers when a client disconnects mid-upload, so a scan whose stream receives no chunk
+for AV_SCAN_DURING_UPLOAD_STALL_SECONDS ends its stream and is abandoned, rather than holding a scan thread forever.
+The AV service has then only seen part of the file, so if the upload resumes and completes, the file isn't given the
+scan and `AVFileField` scans it in full instead.
+"""
+import hashlib
+import queue
+
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+
+from core.metrics import with_request_timings
+from .fields import get_scan_executor, validate_stream
+from .uploads import attachment_too_large_message, check_attachment_name
+
+
+class ChunkStream:
+    """Iterate over the chunks put on `chunks` until None is put. If none arrives within `timeout` seconds, the
+    stream ends early and is marked as abandoned."""
+
+    def __init__(self, chunks, timeout):
+        self.chunks = chunks
+        self.timeout = timeout
+        self.abandoned = False
+
+    def __iter__(self):
+        while True:
+            try:
+                chunk = self.chunks.get(timeout=self.timeout)
+            except queue.Empty:
+                self.abandoned = True
+                return
+
+            if chunk is None:
+                return
+
+            yield chunk
+
+
+class AttachmentUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        # create the file first: when a file is skipped, Django closes (and so deletes) each handler's current file
+        super().new_file(field_name, file_name, *args, **kwargs)
+
+        self.received = 0
+        self.sha256 = hashlib.sha256()
+        self.chunks = self.stream = self.av_scan = None
+
+        # the size is checked per file as its chunks arrive; the request's content length covers every field
+        error = check_attachment_name(file_name)
+
+        if error:
+            self.reject(error)
+
+        if settings.AV_SCAN_DURING_UPLOAD:
+            self.chunks = queue.Queue(maxsize=settings.AV_SCAN_DURING_UPLOAD_BUFFER_CHUNKS)
+            self.stream = ChunkStream(self.chunks, settings.AV_SCAN_DURING_UPLOAD_STALL_SECONDS)
+            self.av_scan = get_scan_executor().submit(
+                with_request_timings(validate_stream), file_name, self.stream, self.sha256)
+
+    def reject(self, error):
+        if not hasattr(self.request, 'rejected_uploads'):
+            self.request.rejected_uploads = {}
+
+        self.request.rejected_uploads[self.field_name] = error
+        self.end_av_stream()
+
+        raise SkipFile()
+
+    def send_to_av(self, chunk):
+        # the buffer is bounded, so a slow AV service holds up the upload rather than filling memory; stop sending
+        # if the scan has failed
+        while self.av_scan is not None and not self.av_scan.done():
+            try:
+                self.chunks.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def end_av_stream(self):
+        if self.chunks is not None:
+            self.send_to_av(None)
+            self.chunks = None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+
+        if self.received > settings.ATTACHMENT_MAX_SIZE:
+            self.reject(attachment_too_large_message())
+
+        self.sha256.update(raw_data)
+
+        if self.chunks is not None:
+            self.send_to_av(raw_data)
+
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.sha256.hexdigest()
+
+        if self.av_scan is not None:
+            self.end_av_stream()
+
+            # a scan whose stream stalled has no verdict for the whole file, so leave the form to scan it again
+            if not self.stream.abandoned:
+                file.av_scan = self.av_scan
+
+        return file
+
+    def upload_interrupted(self):
+        self.end_av_stream()
+        super().upload_interrupted()
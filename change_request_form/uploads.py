@@ -0,0 +1,315 @@
+"""Resumable, chunked attachment uploads.
+
+A large attachment is uploaded ahead of the form submission, in chunks, to the upload endpoints in
+`change_request_form.views`:
+
+* `POST uploads/` with `{"name": ..., "size": ...}` starts an upload and returns its id;
+* `PUT uploads/<id>/` with an `Upload-Offset` header appends the request body at that offset;
+* `GET uploads/<id>/` returns the current offset, so an interrupted upload can be resumed from there.
+
+Chunks are written straight into place in CHUNKED_UPLOAD_DIR, so once the last one arrives the file is assembled and
+a signed token for it is returned. The assembled file is hashed then, once, so that `AVFileField` can look its SHA-256
+up in the verdict cache at submission, as it does for files uploaded with the form. The form is then submitted with
+that token instead of the file, and `ChunkedUploadWidget` hands the assembled file to `AVFileField` as an ordinary
+uploaded file; if the form is invalid, it is rendered again with the token, so the file needn't be uploaded again.
+
+An upload is deleted once the form it was attached to has been submitted; abandoned uploads are purged in the
+background after CHUNKED_UPLOAD_EXPIRY_SECONDS.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.uploadedfile import UploadedFile
+from django.template.defaultfilters import filesizeformat
+from django.utils.html import format_html
+
+from govuk_forms import widgets
+
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SALT = 'change_request_form.uploads'
+READ_SIZE = 64 * 1024
+UPLOAD_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+_purger = None
+_purger_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        super().__init__(f'Expected a chunk at offset {offset}')
+        self.offset = offset
+
+
+class AssembledUploadedFile(UploadedFile):
+    """A completed chunked upload, presented like a `TemporaryUploadedFile`."""
+
+    def __init__(self, upload_id, path, name, size, token=None, sha256=None):
+        super().__init__(open(path, 'rb'), name, None, size)
+        self.upload_id = upload_id
+        self.path = path
+        self.token = token
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def check_attachment_name(name):
+    """Return why an attachment called `name` isn't accepted, or None if it is."""
+
+    extension = os.path.splitext(name)[1].lower().lstrip('.')
+    allowed = settings.ATTACHMENT_ALLOWED_EXTENSIONS
+
+    if allowed and extension not in allowed:
+        return 'Attachments must be one of these types: {}'.format(', '.join(allowed))
+
+    return None
+
+
+def attachment_too_large_message():
+    return f'Attachments must be smaller than {filesizeformat(settings.ATTACHMENT_MAX_SIZE)}'
+
+
+def upload_dir(upload_id):
+    # ids are generated by us, but also arrive in URLs and tokens
+    if not isinstance(upload_id, str) or not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+        raise UploadError('Invalid upload id')
+
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, upload_id)
+
+
+def read_meta(upload_id):
+    try:
+        with open(os.path.join(upload_dir(upload_id), 'meta.json')) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        raise UploadError('Unknown upload')
+
+
+def write_meta(upload_id, meta):
+    path = os.path.join(upload_dir(upload_id), 'meta.json')
+
+    # replaced in one step, so a concurrent read_meta never sees it half written
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(meta, fp)
+
+    os.replace(path + '.tmp', path)
+
+
+def hash_upload(upload_id):
+    sha256 = hashlib.sha256()
+
+    with open(data_path(upload_id), 'rb') as fp:
+        for chunk in iter(lambda: fp.read(READ_SIZE), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def data_path(upload_id):
+    return os.path.join(upload_dir(upload_id), 'data')
+
+
+def start_upload(name, size):
+    error = check_attachment_name(name)
+
+    if size > settings.ATTACHMENT_MAX_SIZE:
+        error = attachment_too_large_message()
+
+    if error or size <= 0:
+        raise UploadError(error or 'The attachment is empty')
+
+    start_purging()
+
+    upload_id = uuid.uuid4().hex
+    os.makedirs(upload_dir(upload_id))
+
+    write_meta(upload_id, {'name': os.path.basename(name), 'size': size})
+
+    open(data_path(upload_id), 'wb').close()
+
+    return upload_id
+
+
+def get_offset(upload_id):
+    read_meta(upload_id)
+
+    return os.path.getsize(data_path(upload_id))
+
+
+def write_chunk(upload_id, offset, stream, length):
+    """Write `length` bytes from `stream` at `offset`, which must be where the previous chunk ended, and record the
+    file's SHA-256 once it is complete.
+
+    Returns the new offset."""
+
+    meta = read_meta(upload_id)
+
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE or offset + length > meta['size']:
+        raise UploadError('Chunk too large')
+
+    with open(data_path(upload_id), 'ab') as fp:
+        # one writer at a time, from any process, so two chunks sent for the same offset can't both be appended
+        fcntl.flock(fp, fcntl.LOCK_EX)
+
+        current = os.fstat(fp.fileno()).st_size
+
+        if offset != current:
+            raise OffsetMismatch(current)
+
+        remaining = length
+
+        while remaining:
+            chunk = stream.read(min(READ_SIZE, remaining))
+            if not chunk:
+                break
+            fp.write(chunk)
+            remaining -= len(chunk)
+
+        fp.flush()
+
+        if os.fstat(fp.fileno()).st_size == meta['size']:
+            write_meta(upload_id, dict(meta, sha256=hash_upload(upload_id)))
+
+    return os.path.getsize(data_path(upload_id))
+
+
+def is_complete(upload_id):
+    return get_offset(upload_id) == read_meta(upload_id)['size']
+
+
+def make_token(upload_id):
+    return signing.dumps(upload_id, salt=TOKEN_SALT)
+
+
+def open_upload(token):
+    """Return the completed upload that `token` refers to."""
+
+    try:
+        upload_id = signing.loads(token, salt=TOKEN_SALT, max_age=settings.CHUNKED_UPLOAD_EXPIRY_SECONDS)
+    except signing.BadSignature:
+        raise UploadError('Invalid or expired upload token')
+
+    if not is_complete(upload_id):
+        raise UploadError('Upload is incomplete')
+
+    meta = read_meta(upload_id)
+
+    return AssembledUploadedFile(
+        upload_id, data_path(upload_id), meta['name'], meta['size'], token=token, sha256=meta.get('sha256'))
+
+
+def delete_upload(upload_id):
+    shutil.rmtree(upload_dir(upload_id), ignore_errors=True)
+
+
+def purge_expired_uploads():
+    """Remove uploads started more than CHUNKED_UPLOAD_EXPIRY_SECONDS ago, returning how many were removed."""
+
+    if not os.path.isdir(settings.CHUNKED_UPLOAD_DIR):
+        return 0
+
+    cutoff = time.time() - settings.CHUNKED_UPLOAD_EXPIRY_SECONDS
+    purged = 0
+
+    for upload_id in os.listdir(settings.CHUNKED_UPLOAD_DIR):
+        path = os.path.join(settings.CHUNKED_UPLOAD_DIR, upload_id)
+
+        if os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            purged += 1
+
+    return purged
+
+
+def start_purging():
+    """Purge expired uploads every CHUNKED_UPLOAD_PURGE_INTERVAL_SECONDS in the background. Only the first call does
+    anything."""
+
+    global _purger
+
+    with _purger_lock:
+        if _purger is None and settings.CHUNKED_UPLOAD_PURGE_INTERVAL_SECONDS:
+            _purger = threading.Thread(target=_purge_periodically, name='chunked-upload-purger', daemon=True)
+            _purger.start()
+
+
+def _purge_periodically():
+    while True:
+        time.sleep(settings.CHUNKED_UPLOAD_PURGE_INTERVAL_SECONDS)
+
+        try:
+            purge_expired_uploads()
+        except Exception:
+            logger.exception('Failed to purge expired chunked uploads')
+
+
+class ChunkedUploadWidget(widgets.ClearableFileInput):
+    """A file input that also accepts the token of a completed chunked upload, posted as `<name>_upload`, and renders
+    that token again when its form is redisplayed."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._uploads = {}
+
+    def __deepcopy__(self, memo):
+        # each form gets a copy of its fields' widgets, and so its own uploads
+        obj = super().__deepcopy__(memo)
+        obj._uploads = {}
+        return obj
+
+    def value_from_datadict(self, data, files, name):
+        value = super().value_from_datadict(data, files, name)
+        token = data.get(f'{name}_upload')
+
+        if value or not token:
+            return value
+
+        # the form asks for the value more than once; it must be the same file each time, as the AV scan is
+        # attached to it
+        if token not in self._uploads:
+            try:
+                self._uploads[token] = open_upload(token)
+            except UploadError as e:
+                # reported by AVFileField
+                self._uploads[token] = e
+
+        return self._uploads[token]
+
+    def render(self, name, value, attrs=None, renderer=None):
+        html = super().render(name, value, attrs, renderer)
+
+        if not isinstance(value, AssembledUploadedFile):
+            return html
+
+        return html + format_html(
+            '<input type="hidden" name="{}_upload" value="{}"/><p class="form-hint">{} has been uploaded</p>',
+            name, value.token, value.name)
+
+    def close_uploads(self, delete=False):
+        """Close the uploads opened for this form, and delete them if the form has been submitted.
+
+        The closed uploads are kept, as an invalid form is rendered with their tokens after it is closed."""
+
+        for upload in self._uploads.values():
+            if isinstance(upload, AssembledUploadedFile):
+                upload.close()
+
+                if delete:
+                    delete_upload(upload.upload_id)
@@ -0,0 +1,88 @@
+"""A cache of files the AV service has recently found clean, keyed by their SHA-256.
+
+Only clean verdicts are stored, so a file is never let through on the strength of a cached result that said
+otherwise. The backend is chosen by `settings.AV_VERDICT_CACHE['BACKEND']`: 'local' for a bounded, per-process
+LRU with a TTL, 'django' to share verdicts between processes through a Django cache, or '' to disable caching.
+"""
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import caches
+
+from core.metrics import counter
+
+
+KEY_PREFIX = 'av-clean:'
+
+_cache = None
+_lock = threading.Lock()
+
+
+class LocalVerdictCache:
+    def __init__(self, max_size, ttl):
+        self._cache = TTLCache(maxsize=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def is_clean(self, sha256):
+        with self._lock:
+            return self._cache.get(sha256, False)
+
+    def add_clean(self, sha256):
+        with self._lock:
+            self._cache[sha256] = True
+
+
+class DjangoVerdictCache:
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+
+    def is_clean(self, sha256):
+        return caches[self.alias].get(KEY_PREFIX + sha256, False)
+
+    def add_clean(self, sha256):
+        caches[self.alias].set(KEY_PREFIX + sha256, True, self.ttl)
+
+
+def build_verdict_cache():
+    config = settings.AV_VERDICT_CACHE
+
+    if config['BACKEND'] == 'local':
+        return LocalVerdictCache(config['MAX_SIZE'], config['TTL'])
+
+    if config['BACKEND'] == 'django':
+        return DjangoVerdictCache(config['CACHE_ALIAS'], config['TTL'])
+
+    return None
+
+
+def get_verdict_cache():
+    """Return the process-wide verdict cache, or None if caching is disabled."""
+
+    global _cache
+
+    with _lock:
+        if _cache is None:
+            _cache = build_verdict_cache() or False
+
+        return _cache or None
+
+
+def is_known_clean(sha256):
+    cache = get_verdict_cache()
+
+    if cache is None:
+        return False
+
+    hit = cache.is_clean(sha256)
+    counter('av_verdict_cache_requests_total', 'AV verdict cache lookups').inc(result='hit' if hit else 'miss')
+
+    return hit
+
+
+def mark_clean(sha256):
+    cache = get_verdict_cache()
+
+    if cache is not None:
+        cache.add_clean(sha256)
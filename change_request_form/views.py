@@ -1,13 +1,32 @@
+import functools
+import json
 import logging
+import uuid
 
 from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.views import View
 from django.views.generic.edit import FormView
 from django.views.generic.base import TemplateView
-from django.urls import reverse_lazy
+from django.urls import NoReverseMatch, reverse, reverse_lazy
 from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
-from .forms import ChangeRequestForm, slack_notify
-from authbroker_client.client import authbroker_login_required, get_profile
+from .backends import format_notification, primary_backend
+from .bulk import (
+    BulkSubmissionError, claim_batch, is_job_owner, parse_rows, record_batch, record_jobs, release_batch, submit_rows,
+    validate_rows)
+from .forms import ChangeRequestForm, render_cached, slack_notify
+from .idempotency import (
+    SubmissionConflict, SubmissionInProgress, claim_submission, record_submission, release_submission, session_scope,
+    submission_keys)
+from .outbox import enqueue_submission
+from .ticket_status import etag, get_status, last_modified, remember_request, submitted_by
+from .uploads import OffsetMismatch, UploadError, get_offset, is_complete, make_token, start_upload, write_chunk
+from .zendesk import AttachmentUploadError, get_job_status
+from authbroker_client.client import authbroker_login_required, authbroker_token_required, get_caller, get_profile
+from core.circuit_breaker import CircuitOpenError, get_breaker
 
 
 logger = logging.getLogger(__file__)
@@ -27,6 +46,8 @@ class ChangeRequestFormView(FormView):
 
             initial['email'] = profile['email']
             initial['name'] = profile['first_name'] + ' ' + profile['last_name']
+        except CircuitOpenError:
+            logger.warning('Authbroker unavailable, the form will not be prefilled')
         # TODO: don't catch blind exception - be specific
         except Exception:
 
@@ -34,28 +55,314 @@ class ChangeRequestFormView(FormView):
 
         return initial
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['rejected_uploads'] = getattr(self.request, 'rejected_uploads', None)
+        return kwargs
+
+    def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        submitted = False
+
+        try:
+            if not form.is_valid():
+                return self.form_invalid(form)
+
+            response = self.form_valid(form)
+            submitted = response.status_code == 302
+
+            return response
+        finally:
+            # chunked uploads are kept until the form is submitted, so an invalid form can be sent again with them
+            form.close_uploads(delete=submitted)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['idempotency_key'] = self.request.POST.get('idempotency_key') or uuid.uuid4().hex
+        # the session's submissions are tracked from when it's shown the form, so one that fails part way through
+        # (and so doesn't save the session) is still found when it's retried
+        session_scope(self.request.session)
+
+        if settings.FORM_FRAGMENT_CACHE and not context['form'].is_bound:
+            context['form_html'] = render_cached(context['form'])
+
+        return context
+
+    submission_keys = None
+
     def form_valid(self, form):
+        if not settings.SUBMISSION_DEDUP_ENABLED:
+            return self.submit(form)
+
+        keys = submission_keys(self.request.POST.get('idempotency_key'), form, session_scope(self.request.session))
+
+        try:
+            ticket_id = claim_submission(keys)
+        except SubmissionInProgress:
+            return HttpResponse('This request is already being submitted.', status=409)
+        except SubmissionConflict:
+            return HttpResponse(
+                'This form has already been submitted with different details. Reload it to make another request.',
+                status=409)
+
+        if ticket_id is not None:
+            self.request._ticket_id = ticket_id
+
+            return HttpResponseRedirect(self.get_success_url())
+
+        self.submission_keys = keys
+
+        try:
+            return self.submit(form)
+        finally:
+            # unless it got as far as creating a ticket, the form can be sent again with the same key
+            if not hasattr(self.request, '_ticket_id'):
+                release_submission(keys)
+
+    def submit(self, form):
+
+        primary = primary_backend(form.cleaned_data['platform'])
+
+        if settings.TICKET_QUEUE_ENABLED:
+            return self.queue_submission(form)
+
+        # while the primary ticket backend is unavailable, the user is asked to try again later rather than wait on it
+        if get_breaker(primary).is_open:
+            return self.backend_unavailable(form)
 
-        zendesk_id = form.create_zendesk_ticket()
-        zendesk_url = settings.ZENDESK_URL.format(zendesk_id)
+        tickets, errors = form.create_tickets()
 
-        self.request._ticket_id = zendesk_id
+        if primary not in tickets:
+            if isinstance(errors[primary], CircuitOpenError):
+                logger.error('Tickets created for a submission whose primary backend is unavailable: %s', tickets)
+                return self.backend_unavailable(form)
 
-        slack_notify(f'new content request: {zendesk_url}')
+            if isinstance(errors[primary], AttachmentUploadError):
+                # the chunked uploads are kept, so the user can submit the form again as it is
+                logger.error('Tickets created for a submission whose attachments failed to upload: %s', tickets)
+                form.add_upload_errors(errors[primary].paths)
+                return self.form_invalid(form)
+
+            logger.error('Tickets created for a failed submission: %s', tickets)
+            raise errors[primary]
+
+        self.submitted(tickets[primary])
+
+        notified = slack_notify(format_notification(tickets))
+
+        if errors or not notified:
+            # the ticket queue worker retries the backends that failed, and sends the notification Slack didn't take
+            enqueue_submission(form, tickets, notified=notified)
 
         return super().form_valid(form)
 
+    def backend_unavailable(self, form):
+        form.add_error(None, 'Your request cannot be sent at the moment, please try again later')
+
+        response = self.form_invalid(form)
+        response.status_code = 503
+
+        return response
+
+    def queue_submission(self, form, tickets=None):
+        self.submitted(enqueue_submission(form, tickets).reference)
+
+        return super().form_valid(form)
+
+    def submitted(self, ticket_id):
+        """Record the submission's ticket id as soon as it's known, so if anything after fails, e.g. the Slack
+        notification, a retry is given this ticket rather than creating another."""
+
+        self.request._ticket_id = ticket_id
+
+        if self.submission_keys:
+            record_submission(self.submission_keys, ticket_id)
+
     def get_success_url(self):
         url = super().get_success_url()
+        remember_request(self.request.session, self.request._ticket_id)
 
         return f'{url}?issue={self.request._ticket_id}'
 
 
+def status_etag(request, issue):
+    return etag(issue)
+
+
+def status_last_modified(request, issue):
+    return last_modified(issue)
+
+
+# a ticket's status is revalidated on every request, and answered with a 304 if it hasn't changed
+revalidate = cache_control(private=True, no_cache=True)
+
+
+def submitted_by_session(view):
+    """Answer a 404, without looking the request up, unless the user's session submitted it."""
+
+    @functools.wraps(view)
+    def wrapper(request, issue):
+        if not submitted_by(request.session, issue):
+            return JsonResponse({'error': 'The status of this request is not available'}, status=404)
+
+        return view(request, issue)
+
+    return wrapper
+
+
 @method_decorator(authbroker_login_required, name="dispatch")
 class ChangeRequestFormSuccessView(TemplateView):
+    """Confirm a submission. The ticket's status is fetched by the page from `TicketStatusView`, so the redirect
+    after submitting doesn't wait on Zendesk."""
+
     template_name = 'change_request_success.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['issue'] = self.request.GET.get('issue', 'Not specified')
+        context['issue'] = self.request.GET.get('issue')
+        context['status_url'] = None
+
+        if context['issue'] and submitted_by(self.request.session, context['issue']):
+            try:
+                context['status_url'] = reverse('ticket_status', args=[context['issue']])
+            except NoReverseMatch:
+                pass
+
         return context
+
+
+@method_decorator(authbroker_login_required, name="dispatch")
+@method_decorator(submitted_by_session, name="get")
+@method_decorator(revalidate, name="get")
+@method_decorator(condition(etag_func=status_etag, last_modified_func=status_last_modified), name="get")
+class TicketStatusView(View):
+    """The current status of a request, by ticket id or ticket queue reference; see
+    `change_request_form.ticket_status`."""
+
+    def get(self, request, issue):
+        status = get_status(issue)
+
+        if status is None:
+            return JsonResponse({'error': 'The status of this request is not available'}, status=404)
+
+        return JsonResponse(status)
+
+
+def upload_status(upload_id, offset):
+    status = {'id': upload_id, 'offset': offset}
+
+    if is_complete(upload_id):
+        status['token'] = make_token(upload_id)
+
+    return status
+
+
+@method_decorator(authbroker_login_required, name="dispatch")
+class ChunkedUploadView(View):
+    """Start a chunked upload; see `change_request_form.uploads`."""
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+            upload_id = start_upload(str(data['name']), int(data['size']))
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Provide the name and size of the file'}, status=400)
+        except UploadError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return JsonResponse(upload_status(upload_id, 0), status=201)
+
+
+@method_decorator(authbroker_login_required, name="dispatch")
+class ChunkedUploadChunkView(View):
+    """Report the progress of a chunked upload, or append a chunk to it."""
+
+    def get(self, request, upload_id):
+        try:
+            return JsonResponse(upload_status(upload_id, get_offset(upload_id)))
+        except UploadError as e:
+            return JsonResponse({'error': str(e)}, status=404)
+
+    def put(self, request, upload_id):
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+            length = int(request.META['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Provide the Upload-Offset and Content-Length headers'}, status=400)
+
+        try:
+            # read the body as a stream, so chunks aren't subject to DATA_UPLOAD_MAX_MEMORY_SIZE
+            offset = write_chunk(upload_id, offset, request, length)
+        except OffsetMismatch as e:
+            return JsonResponse({'error': str(e), 'offset': e.offset}, status=409)
+        except UploadError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return JsonResponse(upload_status(upload_id, offset))
+
+
+@method_decorator(authbroker_token_required, name="dispatch")
+class BulkSubmissionView(View):
+    """Create tickets for a batch of requests; see `change_request_form.bulk`."""
+
+    def post(self, request):
+        try:
+            rows = parse_rows(request.content_type, request.body)
+        except BulkSubmissionError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        forms, errors = validate_rows(rows)
+
+        if any(errors):
+            return JsonResponse({
+                'error': 'Some requests are invalid, none have been submitted',
+                'results': [{'index': index, 'errors': row_errors} for index, row_errors in enumerate(errors)],
+            }, status=400)
+
+        caller = get_caller(request)
+        idempotency_key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        results = None
+
+        if idempotency_key:
+            try:
+                results = claim_batch(caller, idempotency_key, request.body)
+            except SubmissionInProgress:
+                return JsonResponse({'error': 'This batch is already being submitted'}, status=409)
+            except SubmissionConflict:
+                return JsonResponse({'error': 'This idempotency key was used for a different batch'}, status=409)
+
+        try:
+            new_job_ids, results = submit_rows(forms, results)
+            record_jobs(caller, new_job_ids)
+
+            if idempotency_key:
+                record_batch(caller, idempotency_key, request.body, results)
+        finally:
+            if idempotency_key:
+                release_batch(caller, idempotency_key)
+
+        job_ids = list(dict.fromkeys(result['job_id'] for result in results if 'job_id' in result))
+
+        if not job_ids:
+            return JsonResponse({'error': 'Zendesk is unavailable, try again later', 'results': results}, status=503)
+
+        # the tickets are created when Zendesk runs the jobs; after a failure, send the batch again with the same
+        # idempotency key to submit the rest
+        status = 502 if any('error' in result for result in results) else 202
+
+        return JsonResponse({'job_ids': job_ids, 'results': results}, status=status)
+
+
+@method_decorator(authbroker_token_required, name="dispatch")
+class BulkJobStatusView(View):
+    """Report the progress of a bulk submission's Zendesk job, and the tickets it has created."""
+
+    def get(self, request, job_id):
+        if not is_job_owner(get_caller(request), job_id):
+            return JsonResponse({'error': 'Not found'}, status=404)
+
+        try:
+            return JsonResponse(get_job_status(job_id))
+        except Exception:
+            logger.exception('Failed to get the status of Zendesk job %s', job_id)
+            return JsonResponse({'error': 'Unable to get the status of the job'}, status=502)
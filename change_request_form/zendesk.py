@@ -0,0 +1,246 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from core.health import http_probe
+from core.http import get_session, get_upstream_config
+from core.metrics import timed, with_request_timings
+
+
+SERVICE_FIELD_MAPPING = {
+    'gov.uk': 'GOV.UK',
+    'great.gov.uk': 'Great',
+    'digital_workspace': 'Digital Workspace',
+    'None': 'None',
+}
+
+logger = logging.getLogger(__name__)
+
+_clients = queue.LifoQueue()
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
+
+class AttachmentUploadError(Exception):
+    """Some of a submission's attachments couldn't be uploaded, so no ticket was created."""
+
+    def __init__(self, paths):
+        super().__init__('Failed to upload {}'.format(', '.join(os.path.basename(path) for path in paths)))
+        self.paths = paths
+
+
+def build_zendesk_client():
+    """Build a Zenpy client on the process-wide zendesk connection pool.
+
+    Zenpy waits out 429 responses for their Retry-After period, up to ZENDESK_RATELIMIT_BUDGET seconds per call:
+    Zenpy spends the budget over the client's lifetime, so `zendesk_client` gives it a fresh one each time it's lent.
+    """
+
+    # zenpy is imported on first use, as it's slow to import and not needed to serve the form
+    from zenpy import Zenpy
+
+    return Zenpy(
+        subdomain=settings.ZENDESK_SUBDOMAIN,
+        email=settings.ZENDESK_EMAIL,
+        token=settings.ZENDESK_TOKEN,
+        session=get_session('zendesk'),
+        timeout=get_upstream_config('zendesk')['READ_TIMEOUT'],
+        ratelimit_budget=settings.ZENDESK_RATELIMIT_BUDGET,
+    )
+
+
+def reset_ratelimit_budget(client):
+    for api in vars(client).values():
+        if hasattr(api, 'ratelimit_budget'):
+            api.ratelimit_budget = settings.ZENDESK_RATELIMIT_BUDGET
+
+
+@contextmanager
+def zendesk_client():
+    """Borrow a Zenpy client from the process-wide pool of clients.
+
+    Zenpy's object caches aren't safe to share between concurrent requests, so each client is used by one thread or
+    greenlet at a time, and the pool grows to the number of concurrent Zendesk calls.
+    """
+
+    try:
+        client = _clients.get_nowait()
+    except queue.Empty:
+        client = build_zendesk_client()
+
+    reset_ratelimit_budget(client)
+
+    try:
+        yield client
+    finally:
+        _clients.put(client)
+
+
+def probe():
+    """Readiness probe: can we authenticate with Zendesk?"""
+    http_probe(
+        'zendesk',
+        f'https://{settings.ZENDESK_SUBDOMAIN}.zendesk.com/api/v2/users/me.json',
+        healthy_statuses=(200,),
+        auth=(f'{settings.ZENDESK_EMAIL}/token', settings.ZENDESK_TOKEN),
+    )
+
+
+def get_upload_executor():
+    global _upload_executor
+
+    with _upload_executor_lock:
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(
+                max_workers=settings.ZENDESK_UPLOAD_CONCURRENCY, thread_name_prefix='zendesk-upload')
+
+        return _upload_executor
+
+
+def upload_attachment(path):
+    with open(path, 'rb') as fp, zendesk_client() as client:
+        return client.attachments.upload(fp, target_name=os.path.basename(path)).token
+
+
+def upload_attachments(paths):
+    """Upload files to Zendesk concurrently, at most ZENDESK_UPLOAD_CONCURRENCY at a time.
+
+    Returns the upload tokens, in the order of `paths`, and the paths of any files that failed to upload.
+    """
+
+    executor = get_upload_executor()
+    futures = [(path, executor.submit(with_request_timings(upload_attachment), path)) for path in paths]
+
+    tokens, failed = [], []
+
+    for path, future in futures:
+        try:
+            tokens.append(future.result())
+        except Exception:
+            logger.exception('Failed to upload attachment %s to Zendesk', os.path.basename(path))
+            failed.append(path)
+
+    return tokens, failed
+
+
+def format_ticket_text(data):
+    return  """Name: {name}<br>
+                Department: {department}<br>
+                Email: {email}<br>
+                Telephone: {telephone}<br>
+                Title of request: {title_of_request}<br>
+                platform: {platform}<br>
+                request type: {request_type}<br>
+                Update urls: {update_url}<br>
+                Request summary: {request_summary}<br>
+                User need: {user_need}<br>
+                Approver: {approver}<br>
+                Publication date: {publication_date}<br>
+                Publication date not required?: {publication_date_not_required}<br>
+                publication date reason: {publication_date_explanation}""".format(**data)
+
+
+def build_ticket(data, html_body, uploads=None):
+    from zenpy.lib.api_objects import Ticket, CustomField, Comment, User
+
+    service = SERVICE_FIELD_MAPPING[data['platform']]
+
+    custom_fields = [
+        CustomField(id=30041969, value=service),                                        # service
+        CustomField(id=360000180437, value=data['department']),                         # directorate
+        CustomField(id=45522485, value=data['email']),                                  # email
+        CustomField(id=360000188178, value=data['telephone']),                          # Phone number
+        CustomField(id=360000182638, value=data['request_type']),                       # Content request
+        CustomField(id=360000180477, value=data['publication_date_explanation']),       # reason
+        CustomField(id=360000180457, value=str(data['publication_date']))               # due date
+    ]
+
+    return Ticket(
+        subject=data['title_of_request'],
+        custom_fields=custom_fields,
+        tags=['content_delivery', data['platform']],
+        comment=Comment(html_body=html_body, uploads=uploads or None),
+        requester=User(name=data['name'], email=data['email'])
+    )
+
+
+def create_ticket(data, attachment_paths):
+    """Upload the attachments and create a ticket from a submission's cleaned data.
+
+    `data` is either the form's cleaned data or its serialised copy held in the ticket queue. If an attachment fails
+    to upload, `AttachmentUploadError` is raised before the ticket is created, so the submission can be sent again
+    with its files without creating a second ticket.
+    """
+
+    if attachment_paths:
+        with timed('zendesk_uploads'):
+            uploads, failed = upload_attachments(attachment_paths)
+
+        if failed:
+            raise AttachmentUploadError(failed)
+    else:
+        uploads = None
+
+    with timed('zendesk_ticket'), zendesk_client() as client:
+        ticket = client.tickets.create(build_ticket(data, format_ticket_text(data), uploads)).ticket
+
+    return ticket.id
+
+
+def get_ticket(ticket_id):
+    """Return a ticket, or None if there's no such ticket."""
+
+    from zenpy.lib.exception import RecordNotFoundException
+
+    with timed('zendesk_ticket_status'), zendesk_client() as client:
+        try:
+            return client.tickets(id=ticket_id)
+        except RecordNotFoundException:
+            return None
+
+
+def create_ticket_batch(submissions):
+    """Create a ticket for each submission's cleaned data with a single Zendesk batch create, which takes at most
+    ZENDESK_BATCH_SIZE tickets.
+
+    Returns the id of the Zendesk job that creates the tickets; see `get_job_status`.
+    """
+
+    tickets = [build_ticket(data, format_ticket_text(data)) for data in submissions]
+
+    with timed('zendesk_batch'), zendesk_client() as client:
+        return client.tickets.create(tickets).id
+
+
+def get_job_status(job_id):
+    """Return the progress of a batch create and, for each ticket it has processed, the ticket's id or the error."""
+
+    with timed('zendesk_job_status'), zendesk_client() as client:
+        job = client.job_status(id=job_id)
+
+    results = []
+
+    for result in job.results or []:
+        result = result if isinstance(result, dict) else result.to_dict()
+
+        if result.get('id'):
+            results.append({
+                'index': result.get('index'),
+                'ticket_id': result['id'],
+                'ticket_url': settings.ZENDESK_URL.format(result['id']),
+            })
+        else:
+            results.append({'index': result.get('index'), 'error': result.get('details') or result.get('error')})
+
+    return {
+        'id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'results': results,
+    }
@@ -0,0 +1,13 @@
+"""
+ASGI config for config project.
+
+It exposes the ASGI callable as a module-level variable named ``application``. Django 2.2 has no native ASGI
+support, so the WSGI application is served from a thread pool with asgiref's ``WsgiToAsgi`` adapter, e.g.
+``uvicorn config.asgi:application``.
+"""
+
+from asgiref.wsgi import WsgiToAsgi
+
+from .wsgi import application as wsgi_application
+
+application = WsgiToAsgi(wsgi_application)
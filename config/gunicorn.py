@@ -0,0 +1,59 @@
+"""
+Gunicorn config for config project.
+
+Start the production server with ``gunicorn config.wsgi --config config/gunicorn.py``. Everything can be tuned with
+environment variables; see http://docs.gunicorn.org/en/stable/settings.html
+"""
+
+import subprocess
+import sys
+
+import environ
+
+
+env = environ.Env()
+
+bind = '0.0.0.0:{}'.format(env('PORT', default='8000'))
+
+workers = env.int('GUNICORN_WORKERS', default=2)
+# gevent workers make blocking I/O to the authbroker, AV, Zendesk and Slack cooperative, so each worker can hold
+# up to `worker_connections` slow submissions at once without a thread each. `threads` only applies to gthread.
+worker_class = env('GUNICORN_WORKER_CLASS', default='gevent')
+worker_connections = env.int('GUNICORN_WORKER_CONNECTIONS', default=100)
+threads = env.int('GUNICORN_THREADS', default=4)
+
+timeout = env.int('GUNICORN_TIMEOUT', default=120)
+# on SIGTERM, in-flight requests - including ticket submissions - get this long to finish before workers are killed
+graceful_timeout = env.int('GUNICORN_GRACEFUL_TIMEOUT', default=90)
+keepalive = env.int('GUNICORN_KEEPALIVE', default=5)
+
+accesslog = '-'
+
+
+def on_starting(server):
+    """Warn if the caches aren't shared between the workers, and apply any unapplied migrations, once before the
+    workers are started.
+
+    These run in separate processes so that Django, and with it ssl, isn't imported into the master before gevent
+    workers monkey-patch it."""
+
+    subprocess.check_call([sys.executable, 'manage.py', 'check', '--deploy', '--tag', 'caches'])
+
+    if env.bool('MIGRATE_ON_START', default=True):
+        subprocess.check_call([sys.executable, 'manage.py', 'migrate_if_needed'])
+
+
+def post_worker_init(worker):
+    """Start probing the upstream services as the worker starts, so /ready/ never waits for a probe."""
+
+    from core.health import get_prober
+
+    get_prober().start()
+
+
+def worker_exit(server, worker):
+    """Send the worker's buffered Slack notifications before it exits, including after a worker timeout."""
+
+    from change_request_form.slack import close_slack_dispatcher
+
+    close_slack_dispatcher()
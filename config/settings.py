@@ -12,7 +12,6 @@ https://docs.djangoproject.com/en/2.0/ref/settings/
 
 import os
 import environ
-import raven
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -50,10 +49,12 @@ INSTALLED_APPS = [
     'govuk_template',
     'govuk_forms',
     'change_request_form',
+    'core',
     'raven.contrib.django.raven_compat',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -70,7 +71,6 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -79,10 +79,23 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'govuk_template_base.context_processors.govuk_template_base',
             ],
+            # templates are compiled once per process, except in development so that changes show up
+            'loaders': [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ] if DEBUG else [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
 
+# render the unbound change request form once a day per process, adding only each user's prefilled values
+FORM_FRAGMENT_CACHE = env.bool('FORM_FRAGMENT_CACHE', default=True)
+
 WSGI_APPLICATION = 'config.wsgi.application'
 
 
@@ -90,13 +103,28 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    'default': env.db('DATABASE_URL', default='sqlite:///' + os.path.join(BASE_DIR, 'db.sqlite3'))
 }
 
 
+# Cache
+# The local-memory default is per process; set CACHE_URL to share the cache between processes and instances.
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+
+# Sessions
+# Sessions hold only the authbroker token (encrypted) and the user's profile, so by default they are kept in signed
+# cookies and don't touch the database; set SESSION_ENGINE to django.contrib.sessions.backends.cache to keep them in
+# the cache (CACHE_URL) instead.
+
+SESSION_ENGINE = env('SESSION_ENGINE', default='django.contrib.sessions.backends.signed_cookies')
+# Fernet key for encrypting tokens in sessions; derived from SECRET_KEY if not set
+TOKEN_ENCRYPTION_KEY = env('TOKEN_ENCRYPTION_KEY', default='')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -133,12 +161,31 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.0/howto/static-files/
 
 FILE_UPLOAD_HANDLERS = [
-    'django.core.files.uploadhandler.TemporaryFileUploadHandler'
+    'change_request_form.upload_handlers.AttachmentUploadHandler'
 ]
 
+# larger attachments, and those of other types, are rejected as soon as they start to arrive; leave the extensions
+# empty to allow any type
+ATTACHMENT_MAX_SIZE = env.int('ATTACHMENT_MAX_SIZE', default=1024 * 1024 * 1024)
+ATTACHMENT_ALLOWED_EXTENSIONS = env.list('ATTACHMENT_ALLOWED_EXTENSIONS', default=[])
+
+# chunked uploads (see change_request_form.uploads) are assembled here; shared by all web processes on an instance
+CHUNKED_UPLOAD_DIR = env('CHUNKED_UPLOAD_DIR', default=os.path.join(BASE_DIR, 'chunked_uploads'))
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = env.int('CHUNKED_UPLOAD_MAX_CHUNK_SIZE', default=10 * 1024 * 1024)
+CHUNKED_UPLOAD_EXPIRY_SECONDS = env.int('CHUNKED_UPLOAD_EXPIRY_SECONDS', default=24 * 60 * 60)
+# how often each web process purges expired uploads; 0 leaves it to `manage.py purge_chunked_uploads`
+CHUNKED_UPLOAD_PURGE_INTERVAL_SECONDS = env.int('CHUNKED_UPLOAD_PURGE_INTERVAL_SECONDS', default=60 * 60)
+
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# collectstatic gives each file a content-hashed name, and gzip and brotli copies, which whitenoise serves with
+# far-future cache headers; WHITENOISE_MAX_AGE applies to files requested by their unhashed name. In development
+# (and tests) files are served as they are, as there's no manifest until collectstatic has run.
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG else \
+    'whitenoise.storage.CompressedManifestStaticFilesStorage'
+WHITENOISE_MAX_AGE = env.int('WHITENOISE_MAX_AGE', default=0 if DEBUG else 60 * 60)
+
 GOVUK_SERVICE_SETTINGS = {
     'name': 'DIT Content request form',
     'phase': 'beta',
@@ -159,11 +206,29 @@ JIRA_CONTENT_PROJECT_ID = env('JIRA_PROJECT_ID')
 JIRA_WORKSPACE_PROJECT_ID = env('JIRA_WORKSPACE_PROJECT_ID')
 JIRA_ISSUE_URL = env('JIRA_ISSUE_URL')
 JIRA_WATCHERS = env.list('JIRA_WATCHERS')
+# how many watchers are added to a Jira issue at once
+JIRA_WATCHER_CONCURRENCY = env.int('JIRA_WATCHER_CONCURRENCY', default=4)
 
 # Anti virus config
 AV_URL = env('AV_URL')
 AV_USERNAME = env('AV_USERNAME')
 AV_PASSWORD = env('AV_PASSWORD')
+# scan uploads in the background while the rest of the form is validated
+AV_SCAN_CONCURRENTLY = env.bool('AV_SCAN_CONCURRENTLY', default=False)
+AV_SCAN_CONCURRENCY = env.int('AV_SCAN_CONCURRENCY', default=4)
+# stream attachments to the AV service while they are being uploaded, holding up to this many chunks (64KB each)
+# in memory when it can't keep up
+AV_SCAN_DURING_UPLOAD = env.bool('AV_SCAN_DURING_UPLOAD', default=False)
+AV_SCAN_DURING_UPLOAD_BUFFER_CHUNKS = env.int('AV_SCAN_DURING_UPLOAD_BUFFER_CHUNKS', default=16)
+# a scan whose upload sends nothing for this long is abandoned, as the client has probably gone
+AV_SCAN_DURING_UPLOAD_STALL_SECONDS = env.int('AV_SCAN_DURING_UPLOAD_STALL_SECONDS', default=60)
+# files found clean are not re-scanned for TTL seconds; BACKEND is 'local' (per process), 'django' or '' (off)
+AV_VERDICT_CACHE = {
+    'BACKEND': env('AV_VERDICT_CACHE_BACKEND', default='local'),
+    'MAX_SIZE': env.int('AV_VERDICT_CACHE_MAX_SIZE', default=1000),
+    'TTL': env.int('AV_VERDICT_CACHE_TTL', default=24 * 60 * 60),
+    'CACHE_ALIAS': env('AV_VERDICT_CACHE_ALIAS', default='default'),
+}
 
 # authbroker config
 AUTHBROKER_URL = env('AUTHBROKER_URL')
@@ -172,6 +237,13 @@ AUTHBROKER_CLIENT_SECRET = env('AUTHBROKER_CLIENT_SECRET')
 AUTHBROKER_SCOPES = 'read write'
 
 SLACK_URL = env('SLACK_URL')
+# notifications sent in the request path are coalesced into one digest per window; 0 posts each one immediately
+SLACK_DIGEST_WINDOW_SECONDS = env.int('SLACK_DIGEST_WINDOW_SECONDS', default=10)
+SLACK_DIGEST_MAX_BACKOFF_SECONDS = env.int('SLACK_DIGEST_MAX_BACKOFF_SECONDS', default=300)
+# the most ticket links posted in one Slack message, and kept waiting while Slack is unavailable; submissions whose
+# links aren't kept are notified by the ticket queue worker
+SLACK_DIGEST_MAX_MESSAGES = env.int('SLACK_DIGEST_MAX_MESSAGES', default=20)
+SLACK_DIGEST_MAX_PENDING = env.int('SLACK_DIGEST_MAX_PENDING', default=1000)
 
 TEST_RUNNER = 'core.test_runner.DatabaselessTestRunner'
 
@@ -179,3 +251,105 @@ ZENDESK_EMAIL = env('ZENDESK_EMAIL')
 ZENDESK_SUBDOMAIN = env('ZENDESK_SUBDOMAIN')
 ZENDESK_TOKEN = env('ZENDESK_TOKEN')
 ZENDESK_URL = env('ZENDESK_URL')
+# the most time, in seconds, a Zendesk call may spend waiting out 429 rate limit responses
+ZENDESK_RATELIMIT_BUDGET = env.int('ZENDESK_RATELIMIT_BUDGET', default=60)
+# how many attachments are uploaded to Zendesk at once
+ZENDESK_UPLOAD_CONCURRENCY = env.int('ZENDESK_UPLOAD_CONCURRENCY', default=4)
+# the most tickets created by one Zendesk batch create job; Zendesk accepts up to 100
+ZENDESK_BATCH_SIZE = env.int('ZENDESK_BATCH_SIZE', default=100)
+
+# the most requests accepted by one call to the bulk submission API
+BULK_SUBMISSION_MAX_ROWS = env.int('BULK_SUBMISSION_MAX_ROWS', default=500)
+# how long a batch's results are kept for a retry with its idempotency key, and its Zendesk jobs can be looked up by
+# the caller that submitted it; kept in SUBMISSION_DEDUP_CACHE
+BULK_SUBMISSION_TTL_SECONDS = env.int('BULK_SUBMISSION_TTL_SECONDS', default=24 * 60 * 60)
+
+# Ticket backends; see change_request_form.backends. The first backend listed for a platform is its primary.
+TICKET_BACKENDS = {
+    'zendesk': {
+        'CREATE': 'change_request_form.zendesk.create_ticket',
+        'URL': ZENDESK_URL,
+    },
+    'jira': {
+        'CREATE': 'change_request_form.jira.create_issue',
+        'URL': JIRA_ISSUE_URL,
+    },
+}
+TICKET_BACKENDS_BY_PLATFORM = {
+    'default': env.list('TICKET_BACKENDS', default=['zendesk']),
+    'digital_workspace': env.list('DIGITAL_WORKSPACE_TICKET_BACKENDS', default=[]),
+}
+TICKET_BACKEND_CONCURRENCY = env.int('TICKET_BACKEND_CONCURRENCY', default=8)
+
+# Ticket queue config - when enabled, submissions are stored and sent to Zendesk/Slack by
+# `manage.py process_ticket_queue` instead of in the request. The worker must share the web process's database.
+TICKET_QUEUE_ENABLED = env.bool('TICKET_QUEUE_ENABLED', default=False)
+TICKET_QUEUE_ATTACHMENT_DIR = env('TICKET_QUEUE_ATTACHMENT_DIR', default=os.path.join(BASE_DIR, 'queued_attachments'))
+TICKET_QUEUE_MAX_ATTEMPTS = env.int('TICKET_QUEUE_MAX_ATTEMPTS', default=10)
+TICKET_QUEUE_BACKOFF_SECONDS = env.int('TICKET_QUEUE_BACKOFF_SECONDS', default=30)
+TICKET_QUEUE_MAX_BACKOFF_SECONDS = env.int('TICKET_QUEUE_MAX_BACKOFF_SECONDS', default=3600)
+TICKET_QUEUE_LEASE_SECONDS = env.int('TICKET_QUEUE_LEASE_SECONDS', default=600)
+TICKET_QUEUE_POLL_SECONDS = env.int('TICKET_QUEUE_POLL_SECONDS', default=5)
+
+# calls to an upstream fail fast for RESET_TIMEOUT seconds after FAILURE_THRESHOLD consecutive failures
+CIRCUIT_BREAKERS = {
+    'default': {
+        'FAILURE_THRESHOLD': env.int('CIRCUIT_BREAKER_FAILURE_THRESHOLD', default=5),
+        'RESET_TIMEOUT': env.int('CIRCUIT_BREAKER_RESET_TIMEOUT', default=30),
+    },
+}
+
+# /ready/ serves the results of these probes, run in the background every READINESS_PROBE_INTERVAL_SECONDS
+READINESS_PROBES = {
+    'authbroker': 'authbroker_client.client.probe',
+    'av': 'change_request_form.fields.probe',
+    'zendesk': 'change_request_form.zendesk.probe',
+}
+READINESS_PROBE_INTERVAL_SECONDS = env.int('READINESS_PROBE_INTERVAL_SECONDS', default=30)
+# probes aren't retried, and time out well within the interval
+READINESS_PROBE_CONNECT_TIMEOUT = env.float('READINESS_PROBE_CONNECT_TIMEOUT', default=2)
+READINESS_PROBE_READ_TIMEOUT = env.float('READINESS_PROBE_READ_TIMEOUT', default=5)
+
+# /metrics/ requires an `Authorization: Bearer <METRICS_TOKEN>` header, and is disabled if this isn't set
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+# Outbound HTTP connection pools, timeouts (seconds) and retries per upstream; see core.http
+HTTP_UPSTREAMS = {
+    'default': {
+        'POOL_SIZE': env.int('HTTP_POOL_SIZE', default=10),
+        'CONNECT_TIMEOUT': env.float('HTTP_CONNECT_TIMEOUT', default=5),
+        'READ_TIMEOUT': env.float('HTTP_READ_TIMEOUT', default=30),
+        'RETRIES': env.int('HTTP_RETRIES', default=2),
+        'BACKOFF_FACTOR': env.float('HTTP_BACKOFF_FACTOR', default=0.3),
+    },
+    'authbroker': {
+        'READ_TIMEOUT': env.float('AUTHBROKER_READ_TIMEOUT', default=10),
+    },
+    'av': {
+        'READ_TIMEOUT': env.float('AV_READ_TIMEOUT', default=120),
+    },
+    'jira': {
+        'READ_TIMEOUT': env.float('JIRA_READ_TIMEOUT', default=60),
+    },
+    'slack': {
+        'READ_TIMEOUT': env.float('SLACK_READ_TIMEOUT', default=10),
+    },
+    'zendesk': {
+        'POOL_SIZE': env.int('ZENDESK_POOL_SIZE', default=10),
+        'READ_TIMEOUT': env.float('ZENDESK_READ_TIMEOUT', default=60),
+    },
+}
+
+# repeated submissions of the same request within this period return the original ticket; the cache must be shared
+# between processes (see CACHE_URL)
+SUBMISSION_DEDUP_ENABLED = env.bool('SUBMISSION_DEDUP_ENABLED', default=True)
+SUBMISSION_DEDUP_CACHE = env('SUBMISSION_DEDUP_CACHE', default='default')
+SUBMISSION_DEDUP_TTL_SECONDS = env.int('SUBMISSION_DEDUP_TTL_SECONDS', default=600)
+# how long a repeat waits for the original to finish before it's answered with a 409, holding a worker connection
+SUBMISSION_DEDUP_WAIT_SECONDS = env.int('SUBMISSION_DEDUP_WAIT_SECONDS', default=5)
+
+# the ticket status shown on the success page is fetched from Zendesk at most once per request per TTL
+TICKET_STATUS_CACHE = env('TICKET_STATUS_CACHE', default='default')
+TICKET_STATUS_TTL_SECONDS = env.int('TICKET_STATUS_TTL_SECONDS', default=60)
+# unknown tickets, and statuses that couldn't be fetched, are remembered for this long
+TICKET_STATUS_UNAVAILABLE_TTL_SECONDS = env.int('TICKET_STATUS_UNAVAILABLE_TTL_SECONDS', default=10)
@@ -1,11 +1,20 @@
 from django.urls import path, include
 
-from change_request_form.views import ChangeRequestFormView, ChangeRequestFormSuccessView
-from core.views import healthcheck
+from change_request_form.views import (
+    BulkJobStatusView, BulkSubmissionView, ChangeRequestFormView, ChangeRequestFormSuccessView, ChunkedUploadChunkView,
+    ChunkedUploadView, TicketStatusView)
+from core.views import healthcheck, metrics, readiness
 
 urlpatterns = [
     path('', ChangeRequestFormView.as_view(), name='home'),
     path('success/', ChangeRequestFormSuccessView.as_view(), name='success'),
+    path('status/<str:issue>/', TicketStatusView.as_view(), name='ticket_status'),
+    path('uploads/', ChunkedUploadView.as_view(), name='chunked_upload'),
+    path('uploads/<str:upload_id>/', ChunkedUploadChunkView.as_view(), name='chunked_upload_chunk'),
+    path('bulk/', BulkSubmissionView.as_view(), name='bulk_submission'),
+    path('bulk/jobs/<str:job_id>/', BulkJobStatusView.as_view(), name='bulk_job_status'),
     path('auth/', include('authbroker_client.urls')),
-    path('check/', healthcheck, name='healthcheck')
+    path('check/', healthcheck, name='healthcheck'),
+    path('ready/', readiness, name='readiness'),
+    path('metrics/', metrics, name='metrics'),
 ]
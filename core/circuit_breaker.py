@@ -0,0 +1,113 @@
+"""Per-upstream circuit breakers.
+
+`core.http.TimeoutHTTPAdapter` passes every call to an upstream through that upstream's breaker. After
+FAILURE_THRESHOLD consecutive failures (connection errors, timeouts or 5xx responses) the breaker opens and calls
+fail immediately with `CircuitOpenError` for RESET_TIMEOUT seconds. It then lets a single trial call through; if that
+succeeds the breaker closes again, otherwise it re-opens. A trial call that hasn't reported back within RESET_TIMEOUT
+seconds, e.g. because it was killed, is given up on and another call becomes the trial; one abandoned by its caller
+is given up on straight away.
+
+`CircuitOpenError` is a `requests.ConnectionError`, so code that already copes with an unreachable upstream copes
+with an open breaker too.
+"""
+import threading
+import time
+
+import requests
+from django.conf import settings
+
+from .metrics import gauge
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self._lock = threading.Lock()
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state):
+        self.state = state
+        gauge('circuit_breaker_state', 'Circuit breaker state: 0 closed, 1 half open, 2 open').set(
+            self.STATE_VALUES[state], upstream=self.name)
+
+    @property
+    def is_open(self):
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go ahead."""
+
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+
+            now = time.monotonic()
+
+            if (self.state == self.OPEN and now - self.opened_at >= self.reset_timeout
+                    or self.state == self.HALF_OPEN
+                    and (self.trial_started_at is None or now - self.trial_started_at >= self.reset_timeout)):
+                # let this call through as the trial
+                self.trial_started_at = now
+                self._set_state(self.HALF_OPEN)
+                return
+
+        raise CircuitOpenError(f'The {self.name} circuit breaker is open')
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_abandoned(self):
+        """Record a call its caller gave up on, which says nothing about the upstream."""
+
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                # let the next call be the trial
+                self.trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+def get_breaker(upstream):
+    try:
+        return _breakers[upstream]
+    except KeyError:
+        pass
+
+    with _lock:
+        if upstream not in _breakers:
+            config = dict(settings.CIRCUIT_BREAKERS['default'])
+            config.update(settings.CIRCUIT_BREAKERS.get(upstream, {}))
+
+            _breakers[upstream] = CircuitBreaker(upstream, config['FAILURE_THRESHOLD'], config['RESET_TIMEOUT'])
+
+        return _breakers[upstream]
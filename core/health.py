@@ -0,0 +1,128 @@
+"""Readiness checks for the services this app depends on.
+
+Each probe named in `settings.READINESS_PROBES` is a function that raises if its service is unavailable. Probes are
+run by a background thread, started as each gunicorn worker starts, every READINESS_PROBE_INTERVAL_SECONDS, and the
+readiness endpoint serves the latest results, so frequent polling by the load balancer costs nothing upstream and no
+request waits for a probe. HTTP probes have their own short timeouts, READINESS_PROBE_CONNECT_TIMEOUT and
+READINESS_PROBE_READ_TIMEOUT, and aren't retried, so a round of probes finishes quickly even when a service is down.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .http import get_probe_session
+
+
+logger = logging.getLogger(__name__)
+
+_prober = None
+_prober_lock = threading.Lock()
+
+
+class ProbeFailed(Exception):
+    pass
+
+
+def http_probe(upstream, url, healthy_statuses=None, **kwargs):
+    """GET `url` with the upstream's probe session, failing on a connection error or an unhealthy status.
+
+    By default any response other than a 5xx counts as healthy, as it shows the service is up and answering."""
+
+    response = get_probe_session(upstream).get(url, **kwargs)
+
+    if healthy_statuses is None:
+        healthy = response.status_code < 500
+    else:
+        healthy = response.status_code in healthy_statuses
+
+    if not healthy:
+        raise ProbeFailed(f'{upstream} responded with {response.status_code}')
+
+
+class HealthProber:
+    def __init__(self, probes, interval):
+        self.probes = probes
+        self.interval = interval
+        self.results = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def probe(self, name, probe):
+        start = time.monotonic()
+
+        try:
+            probe()
+        except Exception as e:
+            logger.warning('Readiness probe %s failed', name, exc_info=True)
+            # connection errors name internal hosts, so only their type is reported
+            error = str(e) if isinstance(e, ProbeFailed) else e.__class__.__name__
+        else:
+            error = None
+
+        return {
+            'healthy': error is None,
+            'latency_ms': round((time.monotonic() - start) * 1000, 1),
+            'checked_at': time.time(),
+            'error': error,
+        }
+
+    def run_probes(self):
+        results = {name: self.probe(name, probe) for name, probe in self.probes.items()}
+
+        with self._lock:
+            self.results = results
+
+    def start(self):
+        """Start probing in the background. Only the first call does anything."""
+
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(target=self._run, name='readiness-prober', daemon=True)
+
+        self._thread.start()
+
+    def status(self):
+        """Return whether every dependency is healthy, and the latest result for each.
+
+        The prober is started if it hasn't been already, but never waited for: a dependency counts as unhealthy until
+        its first probe has finished, and once its result is older than three intervals, in case the prober has
+        stopped."""
+
+        self.start()
+
+        with self._lock:
+            results = {name: dict(result) for name, result in self.results.items()}
+
+        for name in self.probes:
+            results.setdefault(
+                name, {'healthy': False, 'latency_ms': None, 'checked_at': None, 'error': 'not checked yet'})
+
+        stale_before = time.time() - 3 * self.interval
+
+        for result in results.values():
+            if result['checked_at'] is not None and result['checked_at'] < stale_before:
+                result['healthy'] = False
+                result['error'] = 'stale result'
+
+        return all(result['healthy'] for result in results.values()), results
+
+    def _run(self):
+        while True:
+            self.run_probes()
+            time.sleep(self.interval)
+
+
+def get_prober():
+    global _prober
+
+    with _prober_lock:
+        if _prober is None:
+            probes = {name: import_string(path) for name, path in settings.READINESS_PROBES.items()}
+            _prober = HealthProber(probes, settings.READINESS_PROBE_INTERVAL_SECONDS)
+
+        return _prober
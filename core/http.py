@@ -0,0 +1,193 @@
+"""Shared, per-process HTTP connection pools for the services this app talks to.
+
+Each upstream named in `settings.HTTP_UPSTREAMS` gets a single `TimeoutHTTPAdapter`, so keep-alive connections are
+reused across requests and every call has a timeout and retry policy. Calls go through the upstream's circuit
+breaker, and their latency and response codes are recorded in `core.metrics`. A call given up on by raising
+`RequestAbandoned`, e.g. from its body, isn't counted as a failure of the upstream.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .circuit_breaker import get_breaker
+from .metrics import counter, histogram
+
+
+_adapters = {}
+_sessions = {}
+_probe_sessions = {}
+_lock = threading.RLock()
+
+
+class RequestAbandoned(Exception):
+    """Raised while a request is being sent, e.g. by its body, to give up on it."""
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter that applies a default timeout to requests that are sent without one and records how long
+    each call to `upstream` took.
+
+    With `base_url`, requests are sent to that scheme and host instead of the one they are addressed to, though
+    they (and so their responses) keep their original URL."""
+
+    def __init__(self, timeout=None, upstream='default', base_url=None, **kwargs):
+        self.timeout = timeout
+        self.upstream = upstream
+        self.base_url = base_url and urlsplit(base_url)
+        super().__init__(**kwargs)
+
+    def get_connection(self, url, proxies=None):
+        if self.base_url:
+            url = urlsplit(url)._replace(scheme=self.base_url.scheme, netloc=self.base_url.netloc).geturl()
+
+        return super().get_connection(url, proxies)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+
+        breaker = get_breaker(self.upstream)
+        breaker.before_call()
+
+        start = time.monotonic()
+
+        try:
+            response = super().send(request, **kwargs)
+        except RequestAbandoned:
+            breaker.record_abandoned()
+            raise
+        except BaseException:
+            # including e.g. gevent's Timeout, so a trial call that's interrupted still re-opens the breaker
+            breaker.record_failure()
+            counter('upstream_errors_total', 'Upstream calls that failed without a response').inc(
+                upstream=self.upstream)
+            raise
+        finally:
+            histogram('upstream_request_duration_seconds', 'Time spent calling upstream services').observe(
+                time.monotonic() - start, upstream=self.upstream)
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        counter('upstream_responses_total', 'Upstream responses by status code').inc(
+            upstream=self.upstream, status=str(response.status_code))
+
+        return response
+
+
+def get_upstream_config(upstream):
+    config = dict(settings.HTTP_UPSTREAMS['default'])
+    config.update(settings.HTTP_UPSTREAMS.get(upstream, {}))
+
+    return config
+
+
+def build_adapter(upstream, base_url=None):
+    config = get_upstream_config(upstream)
+
+    # only idempotent requests are retried after a read error or a 5xx; connection errors are always retried
+    # as nothing has been sent.
+    retry = Retry(
+        total=config['RETRIES'],
+        backoff_factor=config['BACKOFF_FACTOR'],
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+
+    return TimeoutHTTPAdapter(
+        timeout=(config['CONNECT_TIMEOUT'], config['READ_TIMEOUT']),
+        upstream=upstream,
+        base_url=base_url,
+        pool_connections=1,
+        pool_maxsize=config['POOL_SIZE'],
+        max_retries=retry,
+    )
+
+
+def get_adapter(upstream):
+    """Return the process-wide adapter, and so connection pool, for `upstream`."""
+
+    try:
+        return _adapters[upstream]
+    except KeyError:
+        pass
+
+    with _lock:
+        if upstream not in _adapters:
+            _adapters[upstream] = build_adapter(upstream)
+
+        return _adapters[upstream]
+
+
+def route_upstream(upstream, base_url):
+    """Send `upstream`'s calls to `base_url`, e.g. a local stand-in for the service, instead of the host they are
+    addressed to. Sessions for `upstream` mounted before this is called keep the old route."""
+
+    with _lock:
+        _adapters[upstream] = build_adapter(upstream, base_url=base_url)
+        _sessions.pop(upstream, None)
+        _probe_sessions.pop(upstream, None)
+
+
+def mount_adapter(session, upstream):
+    """Route all of `session`'s requests through the shared connection pool for `upstream`."""
+
+    adapter = get_adapter(upstream)
+
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def get_session(upstream):
+    """Return a process-wide `requests.Session` for `upstream`."""
+
+    try:
+        return _sessions[upstream]
+    except KeyError:
+        pass
+
+    with _lock:
+        if upstream not in _sessions:
+            _sessions[upstream] = mount_adapter(requests.Session(), upstream)
+
+        return _sessions[upstream]
+
+
+def get_probe_session(upstream):
+    """Return a process-wide `requests.Session` for readiness probes of `upstream`.
+
+    Its calls go the same way as `upstream`'s, through its circuit breaker, but on a connection of their own, with
+    the READINESS_PROBE_* timeouts and no retries, so a probe of a service that is down fails fast."""
+
+    try:
+        return _probe_sessions[upstream]
+    except KeyError:
+        pass
+
+    with _lock:
+        if upstream not in _probe_sessions:
+            base_url = get_adapter(upstream).base_url
+            adapter = TimeoutHTTPAdapter(
+                timeout=(settings.READINESS_PROBE_CONNECT_TIMEOUT, settings.READINESS_PROBE_READ_TIMEOUT),
+                upstream=upstream,
+                base_url=base_url and base_url.geturl(),
+                pool_connections=1,
+                pool_maxsize=1,
+                max_retries=0,
+            )
+
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _probe_sessions[upstream] = session
+
+        return _probe_sessions[upstream]
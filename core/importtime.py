@@ -0,0 +1,80 @@
+"""Measure how long importing each module takes, as `python -X importtime` does from Python 3.7.
+
+Run it in a fresh interpreter so that nothing has been imported yet, e.g. to profile what a web process imports
+before it serves its first request:
+
+    python -m core.importtime config.wsgi config.urls
+
+or use the `profile_startup` management command, which does just that.
+"""
+import builtins
+import importlib
+import sys
+import time
+from importlib.util import resolve_name
+
+
+def profile_imports(modules):
+    """Import `modules`, returning the total time taken and (module, self time, cumulative time) for each module
+    that was imported, in the order they were imported."""
+
+    timings = []
+    stack = []
+    original_import = builtins.__import__
+    original_import_module = importlib.import_module
+
+    def timed(name, do_import):
+        if name in sys.modules:
+            return do_import()
+
+        entry = [name, 0, 0]
+        timings.append(entry)
+        stack.append(0)
+        start = time.perf_counter()
+
+        try:
+            return do_import()
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            entry[1], entry[2] = elapsed - children, elapsed
+
+            if stack:
+                stack[-1] += elapsed
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        absolute_name = name
+        if level:
+            absolute_name = resolve_name('.' * level + name, (globals or {}).get('__package__'))
+
+        return timed(absolute_name, lambda: original_import(name, globals, locals, fromlist, level))
+
+    def timed_import_module(name, package=None):
+        return timed(resolve_name(name, package), lambda: original_import_module(name, package))
+
+    builtins.__import__ = timed_import
+    importlib.import_module = timed_import_module
+    start = time.perf_counter()
+
+    try:
+        for module in modules:
+            importlib.import_module(module)
+    finally:
+        builtins.__import__ = original_import
+        importlib.import_module = original_import_module
+
+    return time.perf_counter() - start, [tuple(entry) for entry in timings]
+
+
+def main(modules, limit=30):
+    total, timings = profile_imports(modules)
+
+    print('{:>10}  {:>10}  module'.format('self (ms)', 'cum. (ms)'))
+    for name, own, cumulative in sorted(timings, key=lambda timing: timing[2], reverse=True)[:limit]:
+        print('{:>10.1f}  {:>10.1f}  {}'.format(own * 1000, cumulative * 1000, name))
+
+    print('Imported {} modules in {:.0f}ms'.format(len(timings), total * 1000))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or ['config.wsgi', 'config.urls'])
@@ -0,0 +1,14 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+
+class Command(BaseCommand):
+    help = 'Apply migrations, but only if there are any unapplied'
+
+    def handle(self, *args, **options):
+        executor = MigrationExecutor(connection)
+
+        if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            call_command('migrate', interactive=False)
@@ -0,0 +1,23 @@
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Report the modules that take longest to import when a web process starts and serves its first request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*', default=['config.wsgi', settings.ROOT_URLCONF],
+                            help='Modules to import (default: the WSGI application and the URLconf)')
+        parser.add_argument('--limit', type=int, default=30, help='Number of modules to report')
+
+    def handle(self, *args, **options):
+        # this process has already imported Django and the project, so profile a fresh interpreter
+        subprocess.run(
+            [sys.executable, '-c', 'import sys; from core.importtime import main; main(sys.argv[2:], int(sys.argv[1]))',
+             str(options['limit'])] + options['modules'],
+            cwd=settings.BASE_DIR,
+            check=True,
+        )
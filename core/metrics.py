@@ -0,0 +1,217 @@
+"""Lightweight, thread-safe in-process metrics.
+
+Metrics are created on first use with `counter`, `gauge` or `histogram` and live for the lifetime of the process, e.g.:
+
+    histogram('upstream_request_duration_seconds', 'Time spent calling upstream services').observe(0.2, upstream='av')
+
+Stages of handling a request are timed with `timed`, which also records the timing against the current request
+when `core.middleware.TimingMiddleware` is installed; wrap functions run on other threads for a request with
+`with_request_timings` so their stages are recorded against it too. `render_prometheus` renders every metric in the
+Prometheus text format.
+
+Each process keeps its own metrics, so every sample is labelled with the process's `worker` (its pid): a scrape of
+one gunicorn worker never reports lower totals than an earlier scrape of another. Aggregate across workers in
+Prometheus, e.g. `sum without (worker) (rate(...))`.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+_registry = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(dict(key), value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(_label_key(labels), ([0], 0))
+        return sum(counts)
+
+    def samples(self):
+        """Return (labels, cumulative bucket counts, sum) for each label set."""
+
+        with self._lock:
+            samples = []
+            for key, (counts, total) in self._values.items():
+                cumulative, running = [], 0
+                for count in counts:
+                    running += count
+                    cumulative.append(running)
+                samples.append((dict(key), cumulative, total))
+
+            return samples
+
+
+def _get_or_create(metric_class, name, *args):
+    try:
+        return _registry[name]
+    except KeyError:
+        pass
+
+    with _lock:
+        if name not in _registry:
+            _registry[name] = metric_class(name, *args)
+
+        return _registry[name]
+
+
+def counter(name, description=''):
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name, description=''):
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name, description='', buckets=DEFAULT_BUCKETS):
+    return _get_or_create(Histogram, name, description, buckets)
+
+
+def get_metrics():
+    return list(_registry.values())
+
+
+def start_request_timings():
+    _local.timings = []
+    return _local.timings
+
+
+def stop_request_timings():
+    timings = getattr(_local, 'timings', [])
+    _local.timings = None
+    return timings
+
+
+def with_request_timings(func):
+    """Wrap `func`, to be run on another thread, so that the stages it times are recorded against the current
+    request."""
+
+    timings = getattr(_local, 'timings', None)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'timings', None)
+        _local.timings = timings
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.timings = previous
+
+    return wrapper
+
+
+@contextmanager
+def timed(stage):
+    """Time a stage of handling a request, counting it as an error if it raises."""
+
+    start = time.monotonic()
+
+    try:
+        yield
+    except Exception:
+        counter('stage_errors_total', 'Request stages that raised an exception').inc(stage=stage)
+        raise
+    finally:
+        duration = time.monotonic() - start
+        histogram('stage_duration_seconds', 'Time spent in each stage of handling a request').observe(
+            duration, stage=stage)
+
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings.append((stage, duration))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join('{}="{}"'.format(key, escape(value)) for key, value in sorted(labels.items())) + '}'
+
+
+def render_prometheus():
+    lines = []
+    worker = str(os.getpid())
+
+    for metric in sorted(get_metrics(), key=lambda metric: metric.name):
+        lines.append('# HELP {} {}'.format(metric.name, metric.description))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+
+        if metric.type in ('counter', 'gauge'):
+            for labels, value in metric.samples():
+                lines.append('{}{} {}'.format(metric.name, _format_labels(dict(labels, worker=worker)), value))
+            continue
+
+        for labels, cumulative, total in metric.samples():
+            labels = dict(labels, worker=worker)
+
+            for bucket, count in zip(metric.buckets, cumulative):
+                bucket_labels = dict(labels, le='+Inf' if bucket == float('inf') else bucket)
+                lines.append('{}_bucket{} {}'.format(metric.name, _format_labels(bucket_labels), count))
+
+            lines.append('{}_sum{} {}'.format(metric.name, _format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(metric.name, _format_labels(labels), cumulative[-1]))
+
+    return '\n'.join(lines) + '\n'
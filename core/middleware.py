@@ -0,0 +1,28 @@
+import time
+
+from .metrics import histogram, start_request_timings, stop_request_timings
+
+
+class TimingMiddleware:
+    """Collect the stages timed while handling a request into `request.timings` and a Server-Timing header."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.timings = start_request_timings()
+        start = time.monotonic()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_request_timings()
+
+        total = time.monotonic() - start
+        histogram('request_duration_seconds', 'Time spent handling requests').observe(total, method=request.method)
+
+        response['Server-Timing'] = ', '.join(
+            ['{};dur={:.1f}'.format(stage, duration * 1000) for stage, duration in request.timings] +
+            ['total;dur={:.1f}'.format(total * 1000)])
+
+        return response
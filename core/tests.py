@@ -0,0 +1,285 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, Mock
+
+import requests
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .health import HealthProber, ProbeFailed
+from .http import RequestAbandoned, TimeoutHTTPAdapter, get_adapter, get_probe_session, get_session
+from .metrics import (
+    Counter, Histogram, counter, gauge, histogram, render_prometheus, timed, with_request_timings)
+from .middleware import TimingMiddleware
+
+
+class HttpTestCase(TestCase):
+    def test_session_is_shared(self):
+        self.assertIs(get_session('slack'), get_session('slack'))
+        self.assertIsNot(get_session('slack'), get_session('av'))
+
+    def test_session_uses_upstream_adapter(self):
+        self.assertIs(get_session('av').get_adapter('https://av/'), get_adapter('av'))
+
+    @patch('requests.adapters.HTTPAdapter.send')
+    def test_default_timeout(self, mock_send):
+        mock_send.return_value.status_code = 200
+        adapter = TimeoutHTTPAdapter(timeout=(1, 2))
+
+        adapter.send('request')
+        self.assertEqual(mock_send.call_args[1]['timeout'], (1, 2))
+
+        adapter.send('request', timeout=5)
+        self.assertEqual(mock_send.call_args[1]['timeout'], 5)
+
+    @patch('requests.adapters.HTTPAdapter.send')
+    def test_records_latency(self, mock_send):
+        mock_send.return_value.status_code = 200
+        adapter = TimeoutHTTPAdapter(upstream='test-upstream')
+
+        adapter.send('request')
+
+        self.assertEqual(histogram('upstream_request_duration_seconds').count(upstream='test-upstream'), 1)
+        self.assertEqual(counter('upstream_responses_total').value(upstream='test-upstream', status='200'), 1)
+
+    @override_settings(READINESS_PROBE_CONNECT_TIMEOUT=1, READINESS_PROBE_READ_TIMEOUT=2)
+    def test_probe_session_does_not_retry(self):
+        adapter = get_probe_session('probed-upstream').get_adapter('https://probed/')
+
+        self.assertIsNot(adapter, get_adapter('probed-upstream'))
+        self.assertEqual(adapter.timeout, (1, 2))
+        self.assertEqual(adapter.max_retries.total, 0)
+
+    def test_base_url(self):
+        adapter = TimeoutHTTPAdapter(base_url='http://localhost:8000')
+
+        pool = adapter.get_connection('https://test.zendesk.com/api/v2/tickets.json')
+
+        self.assertEqual((pool.scheme, pool.host, pool.port), ('http', 'localhost', 8000))
+
+    @patch('core.http.get_breaker')
+    @patch('requests.adapters.HTTPAdapter.send')
+    def test_interrupted_call_is_a_failure(self, mock_send, mock_get_breaker):
+        mock_send.side_effect = KeyboardInterrupt()
+        adapter = TimeoutHTTPAdapter(upstream='interrupted-upstream')
+
+        with self.assertRaises(KeyboardInterrupt):
+            adapter.send('request')
+
+        self.assertTrue(mock_get_breaker.return_value.record_failure.called)
+
+    @patch('core.http.get_breaker')
+    @patch('requests.adapters.HTTPAdapter.send')
+    def test_abandoned_call_is_not_a_failure(self, mock_send, mock_get_breaker):
+        mock_send.side_effect = RequestAbandoned()
+        adapter = TimeoutHTTPAdapter(upstream='abandoned-upstream')
+
+        with self.assertRaises(RequestAbandoned):
+            adapter.send('request')
+
+        self.assertFalse(mock_get_breaker.return_value.record_failure.called)
+        self.assertTrue(mock_get_breaker.return_value.record_abandoned.called)
+
+
+class MetricsTestCase(TestCase):
+    def test_counter(self):
+        metric = Counter('test_total', 'a counter')
+
+        metric.inc(upstream='a')
+        metric.inc(2, upstream='a')
+        metric.inc(upstream='b')
+
+        self.assertEqual(metric.value(upstream='a'), 3)
+        self.assertEqual(metric.value(upstream='b'), 1)
+        self.assertEqual(metric.value(upstream='c'), 0)
+
+    def test_histogram_buckets_are_cumulative(self):
+        metric = Histogram('test_seconds', 'a histogram', buckets=(1, 5, float('inf')))
+
+        metric.observe(0.5)
+        metric.observe(2)
+        metric.observe(10)
+
+        self.assertEqual(metric.samples(), [({}, [1, 2, 3], 12.5)])
+
+    def test_render_prometheus(self):
+        counter('test_render_total', 'a counter').inc(upstream='av')
+        histogram('test_render_seconds', 'a histogram', buckets=(1, float('inf'))).observe(0.5)
+
+        rendered = render_prometheus()
+        worker = os.getpid()
+
+        self.assertIn(
+            f'# TYPE test_render_total counter\ntest_render_total{{upstream="av",worker="{worker}"}} 1\n', rendered)
+        self.assertIn(f'test_render_seconds_bucket{{le="1",worker="{worker}"}} 1\n', rendered)
+        self.assertIn(f'test_render_seconds_bucket{{le="+Inf",worker="{worker}"}} 1\n', rendered)
+        self.assertIn(f'test_render_seconds_count{{worker="{worker}"}} 1\n', rendered)
+
+    def test_timed_records_against_request(self):
+        def view(request):
+            with timed('test_stage'):
+                pass
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        response = TimingMiddleware(view)(request)
+
+        self.assertEqual([stage for stage, _ in request.timings], ['test_stage'])
+        self.assertTrue(response['Server-Timing'].startswith('test_stage;dur='))
+        self.assertEqual(histogram('stage_duration_seconds').count(stage='test_stage'), 1)
+
+    def test_timings_on_other_threads_record_against_request(self):
+        def stage():
+            with timed('test_thread_stage'):
+                pass
+
+        def view(request):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(with_request_timings(stage)).result()
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        TimingMiddleware(view)(request)
+
+        self.assertEqual([stage for stage, _ in request.timings], ['test_thread_stage'])
+
+
+class MetricsViewTestCase(TestCase):
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics(self):
+        response = Client().get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'request_duration_seconds', response.content)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        self.assertEqual(Client().get('/metrics/').status_code, 403)
+        self.assertEqual(Client().get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_disabled_without_token(self):
+        self.assertEqual(Client().get('/metrics/', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+class HealthProberTestCase(TestCase):
+    def failing_probe(self):
+        raise ProbeFailed('av responded with 502')
+
+    @patch('core.health.threading.Thread')
+    def test_status(self, mock_thread):
+        prober = HealthProber({'ok': lambda: None, 'av': self.failing_probe}, interval=30)
+        prober.run_probes()
+
+        ready, checks = prober.status()
+
+        self.assertFalse(ready)
+        self.assertTrue(checks['ok']['healthy'])
+        self.assertEqual(checks['av']['error'], 'av responded with 502')
+        self.assertTrue(mock_thread.return_value.start.called)
+
+    @patch('core.health.threading.Thread')
+    def test_status_does_not_probe(self, mock_thread):
+        probe = Mock()
+        prober = HealthProber({'ok': probe}, interval=30)
+
+        prober.status()
+        prober.status()
+
+        self.assertFalse(probe.called)
+        self.assertEqual(mock_thread.return_value.start.call_count, 1)
+
+    @patch('core.health.threading.Thread')
+    def test_unhealthy_until_first_probes_finish(self, mock_thread):
+        prober = HealthProber({'ok': lambda: None}, interval=30)
+
+        ready, checks = prober.status()
+
+        self.assertFalse(ready)
+        self.assertEqual(checks['ok']['error'], 'not checked yet')
+
+    @patch('core.health.threading.Thread')
+    @patch('core.health.time.time')
+    def test_stale_results_are_unhealthy(self, mock_time, mock_thread):
+        mock_time.return_value = 1000
+        prober = HealthProber({'ok': lambda: None}, interval=30)
+        prober.run_probes()
+
+        mock_time.return_value = 1100
+        ready, checks = prober.status()
+
+        self.assertFalse(ready)
+        self.assertEqual(checks['ok']['error'], 'stale result')
+
+
+class CircuitBreakerTestCase(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.before_call()
+
+        self.breaker.record_failure()
+
+        self.assertTrue(self.breaker.is_open)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.assertEqual(gauge('circuit_breaker_state').value(upstream='test'), 2)
+
+    @patch('core.circuit_breaker.time.monotonic')
+    def test_trial_call_after_reset_timeout(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+        mock_monotonic.return_value = 131
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+        # only one trial call at a time
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open)
+
+        mock_monotonic.return_value = 162
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    @patch('core.circuit_breaker.time.monotonic')
+    def test_unfinished_trial_call_expires(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+        mock_monotonic.return_value = 131
+        self.breaker.before_call()
+
+        mock_monotonic.return_value = 160
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        mock_monotonic.return_value = 161
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+    @patch('core.circuit_breaker.time.monotonic')
+    def test_abandoned_trial_call_is_replaced(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+        mock_monotonic.return_value = 131
+        self.breaker.before_call()
+        self.breaker.record_abandoned()
+
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
@@ -1,6 +1,32 @@
-from django.http import HttpResponse
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+
+from .health import get_prober
+from .metrics import render_prometheus
 
 
 def healthcheck(request):
     """An initial health check endpoint."""
     return HttpResponse('OK')
+
+
+def readiness(request):
+    """Report the health and latency of each upstream service from the latest background probes."""
+
+    ready, checks = get_prober().status()
+
+    return JsonResponse({'ready': ready, 'checks': checks}, status=200 if ready else 503)
+
+
+def metrics(request):
+    """This process's metrics in the Prometheus text format, for requests with the METRICS_TOKEN bearer token; with
+    no token set, they aren't served."""
+
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+
+    if not settings.METRICS_TOKEN or not hmac.compare_digest(authorization, f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponseForbidden()
+
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')